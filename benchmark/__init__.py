@@ -0,0 +1,430 @@
+"""
+   Benchmarks for the scanner: synthetic inputs at configurable scale and timing of each stage of a scan.
+   Inputs look like the real ones: vidarr*.shesmu olives with Run lines and assay_info checks
+   (some of them with mismatched versions or commented out) and assay_info.jsonconfig with assays,
+   versions and enabled workflow versions, a share of assays with a prefix for the research instance.
+
+   Results are a dict which goes into a .json file:
+   {
+     format     = BENCHMARK_FORMAT
+     parameters = scale of generated inputs and the number of repeats
+     stages     = {stage: {min, median, runs}}, times are in seconds
+   }
+   and can be compared to a stored baseline (results of an earlier run with the same parameters).
+   Startup stages (startup:<run>) time the scanner as a separate process, with interpreter startup and imports.
+   Engine stages (enabled:<engine> and configScanner:<engine>) compare ways of matching olives to assay versions.
+   Memory stages (memory:<run>, in MB) give peak resident set size of loading assay config MEMORY_SCALE times larger
+   than the generated one, each run in a new process, load:<run> stages are times of these runs.
+   Site stages time scans of several sites (forks of the generated olives) as separate runs of the scanner
+   (sites:separate, all of them) and as one run with all sites in one settings file (sites:batch)
+"""
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from checkMatcher import checkMatcher
+from configScanner import configScanner
+import enablementMatrix
+import gsiOlive
+import htmlRenderer
+from outputWriter import atomic_open
+import runConfigScanner
+from scanSession import scanSession
+
+BENCHMARK_FORMAT = 1
+STAGES = ("collect_olives", "parse_olives", "configScanner.__init__", "save_report", "render_page", "save_config")
+INSTANCES = ("research", "production-cap")
+RESEARCH_PREFIX = "RUO"
+CHECK_PATTERN = r'config::assay_info::get\(\S+\)\.versions\[\S+\]\.workflows\["(?P<workflow>[^"]+)"\]:\s*Any\s+v\s*==' \
+                r'\s*"(?P<version>[^"]+)"'
+EXTRA_PATTERN = r'config::extra{}_info::get\(\S+\)\.versions\[\S+\]\.workflows\["(?P<workflow>[^"]+)"\]:\s*Any\s+v' \
+                r'\s*==\s*"(?P<version>[^"]+)"'
+DEFAULT_PARAMETERS = {'olives': 2000, 'assays': 500, 'versions': 3, 'workflows': 200, 'patterns': 1, 'seed': 1}
+STARTUP_RUNS = ("import", "config", "json", "html", "all")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JAVA_SCRIPT = os.path.join(REPO_DIR, "js", "dropDown.js")
+MEMORY_SCALE = 10
+MEMORY_RUNS = ("import", "json.load", "load_config", "save_config")
+SITE_JOBS = 2
+'''A run of the memory benchmark in a new process, prints peak memory (bytes) and time of the run.
+   On Linux ru_maxrss of a new process starts with the peak of the process which started it, VmHWM does not'''
+MEMORY_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+import runConfigScanner
+from scanMetrics import scanMetrics
+def peak_memory():
+    try:
+        with open("/proc/self/status", "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return scanMetrics.peak_memory()
+run, config_path, output_path = sys.argv[2:5]
+start = time.perf_counter()
+if run == "json.load":
+    with open(config_path, "r") as config_file:
+        config_data = json.load(config_file)
+elif run != "import":
+    config_data = runConfigScanner.load_config(config_path)
+    if run == "save_config":
+        runConfigScanner.save_config(config_data, output_path)
+print(json.dumps([peak_memory(), time.perf_counter() - start]))
+"""
+
+
+"""
+   Write synthetic olives, assay_info.jsonconfig and settings (config.toml) under root, return path to the settings.
+   olives is the number of olives per instance, patterns the number of check patterns in settings (the assay
+   pattern and extra ones which olives do not use, they show how matching scales with the number of patterns)
+"""
+def generate_inputs(root: str, olives: int, assays: int, versions: int, workflows: int, seed: int = 1,
+                    patterns: int = 1) -> str:
+    rand = random.Random(seed)
+    wf_names = [f"workflow{w}" for w in range(workflows)]
+    wf_versions = {w: [f"{rand.randint(1, 4)}.{rand.randint(0, 20)}.{rand.randint(0, 9)}" for _ in range(3)]
+                   for w in wf_names}
+    for instance in INSTANCES:
+        olive_dir = os.path.join(root, "olives", instance)
+        os.makedirs(olive_dir, exist_ok=True)
+        for o in range(olives):
+            with open(os.path.join(olive_dir, f"vidarr-{instance}-{o}.shesmu"), "w") as olive:
+                olive.write(synthetic_olive(rand, wf_names, wf_versions))
+    config_path = os.path.join(root, "assay_info.jsonconfig")
+    write_config(config_path, synthetic_values(rand, assays, versions, wf_names, wf_versions))
+    settings_path = os.path.join(root, "config.toml")
+    write_settings(settings_path, os.path.join(root, 'olives'), config_path, patterns)
+    return settings_path
+
+
+'''Write a settings file for olives in olive_dir, with a number of check patterns'''
+def write_settings(settings_path: str, olive_dir: str, config_path: str, patterns: int = 1):
+    with open(settings_path, "w") as settings_file:
+        settings_file.write("[data]\n"
+                            f"local_olive_dir = {json.dumps(olive_dir)}\n"
+                            f"assay_config_file = {json.dumps(config_path)}\n\n"
+                            "[instances]\n"
+                            f"instance_a = \"{INSTANCES[0]}\"\n"
+                            f"instance_b = \"{INSTANCES[1]}\"\n\n"
+                            "[prefixes]\n"
+                            f"{INSTANCES[0]} = \"{RESEARCH_PREFIX}\"\n\n"
+                            "[checks]\n"
+                            f"assay = '{CHECK_PATTERN}'\n")
+        for p in range(1, patterns):
+            settings_file.write("\n[[checks.patterns]]\n"
+                                f"name = \"extra{p}\"\n"
+                                f"pattern = '{EXTRA_PATTERN.format(p)}'\n")
+
+
+"""
+   Generate sites for inputs in root: olives of each site are a copy of the generated olives (a fork) with one
+   olive of each instance changed, all sites use the generated assay config. Return the settings file with all
+   sites and a list of settings files for each site
+"""
+def generate_sites(root: str, sites: int) -> tuple:
+    config_path = os.path.join(root, "assay_info.jsonconfig")
+    batch_path = os.path.join(root, "sites.toml")
+    site_paths = []
+    with open(batch_path, "w") as batch_file:
+        batch_file.write(f"[data]\nassay_config_file = {json.dumps(config_path)}\n\n"
+                         f"[checks]\nassay = '{CHECK_PATTERN}'\n")
+        for site in range(sites):
+            site_dir = os.path.join(root, "sites", f"site{site}")
+            shutil.copytree(os.path.join(root, "olives"), site_dir, dirs_exist_ok=True)
+            for instance in INSTANCES:
+                with open(os.path.join(site_dir, instance, f"vidarr-{instance}-0.shesmu"), "a") as olive:
+                    olive.write(f"\n# changed for site{site}\n")
+            batch_file.write(f"\n[sites.site{site}]\n"
+                             f"local_olive_dir = {json.dumps(site_dir)}\n"
+                             f"instances = {json.dumps(list(INSTANCES))}\n"
+                             f"[sites.site{site}.prefixes]\n"
+                             f"{INSTANCES[0]} = \"{RESEARCH_PREFIX}\"\n")
+            site_paths.append(os.path.join(root, f"site{site}.toml"))
+            write_settings(site_paths[-1], site_dir, config_path)
+    return batch_path, site_paths
+
+
+'''Synthetic assay entries of assay_info, every third assay has the prefix of the research instance'''
+def synthetic_values(rand: random.Random, assays: int, versions: int, wf_names: list, wf_versions: dict) -> dict:
+    values = {}
+    for a in range(assays):
+        assay_name = (RESEARCH_PREFIX + "_" if a % 3 == 0 else "") + f"ASSAY{a}"
+        assay = {'reference': rand.choice(["hg38", "hg19", ["mm10", "mm39"]]), 'versions': {}}
+        for v in range(rand.randint(1, versions)):
+            enabled = rand.sample(wf_names, min(len(wf_names), rand.randint(10, 40)))
+            assay['versions'][f"{v + 1}.0"] = {'workflows': {w: sorted(rand.sample(wf_versions[w], rand.randint(1, 2)))
+                                                             for w in enabled}}
+        values[assay_name] = assay
+    return values
+
+
+def write_config(config_path: str, values: dict):
+    with open(config_path, "w") as config_file:
+        json.dump({'values': values}, config_file, indent=1)
+
+
+'''Text of a synthetic olive with one or more olive blocks'''
+def synthetic_olive(rand: random.Random, wf_names: list, wf_versions: dict) -> str:
+    lines = ["Version 1;", "Input cerberus_fp;", ""]
+    for _ in range(rand.randint(1, 3)):
+        wf = rand.choice(wf_names)
+        wf_version = rand.choice(wf_versions[wf])
+        lines.append("Olive")
+        lines.append(f"  Description \"{wf} for assays with the workflow enabled\"")
+        mode = rand.random()
+        if mode < 0.7:
+            checked = wf_version if rand.random() < 0.95 else rand.choice(wf_versions[wf])
+            lines.append(f"  Where config::assay_info::get(assay_name).versions[assay_version]"
+                         f".workflows[\"{wf}\"]: Any v == \"{checked}\"")
+        elif mode < 0.8:
+            lines.append(f"  # Where config::assay_info::get(assay_name).versions[assay_version]"
+                         f".workflows[\"{wf}\"]: Any v == \"{wf_version}\"")
+        lines.extend(["  Group By workflow_run_accession, project, donor",
+                      "  Pick max timestamp By donor"])
+        lines.append(f"  Run {wf}_v{wf_version.replace('.', '_')}")
+        lines.extend(["  With {", "    memory = 16Gi;", "    project_info = project;", "  }", ""])
+    return "\n".join(lines)
+
+
+"""
+   Output of the scanner while we time it is kept in a buffer and dropped. The scanner calls exit() on errors
+   (i.e. a missing java script), then the output is printed, so a failed run is not silent
+"""
+@contextlib.contextmanager
+def captured_output():
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            yield output
+    except SystemExit:
+        print(output.getvalue(), end="")
+        print("ERROR: The scanner stopped, timings are incomplete")
+        raise
+
+
+"""
+   Run the scanner (or Python) as a separate process with its output captured. If the process fails, its output
+   is printed and we stop with its exit code
+"""
+def run_process(command: list):
+    result = subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        print(result.stdout, end="")
+        print(f"ERROR: {' '.join(command)} failed with exit code {result.returncode}")
+        raise SystemExit(result.returncode)
+
+
+"""
+   Run a full scan of generated inputs with each stage timed, repeat times. Outputs go into work_dir,
+   output of the scanner itself is dropped (see captured_output). Return a dict of stages with lists of times
+   (seconds)
+"""
+def time_stages(settings_path: str, work_dir: str, repeat: int = 3, java_script: str = JAVA_SCRIPT) -> dict:
+    timings = {stage: [] for stage in STAGES}
+    with captured_output() as output:
+        settings = runConfigScanner.load_settings(settings_path)
+        config_check = checkMatcher.from_settings(settings["checks"])
+        config_data = runConfigScanner.load_config(settings["data"]["assay_config_file"])
+        for run in range(repeat):
+            '''Only output of the current run is kept, the buffer does not grow with the number of runs'''
+            if run > 0:
+                output.seek(0)
+                output.truncate()
+            stage_times = dict.fromkeys(STAGES, 0.0)
+            session = scanSession(config_data)
+            deltas = []
+            for instance in settings['instances'].values():
+                start = time.perf_counter()
+                olive_files = gsiOlive.collect_olives(settings["data"]["local_olive_dir"], instance, [], {})
+                stage_times["collect_olives"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                olive_info = gsiOlive.parse_olives(olive_files, config_check)
+                stage_times["parse_olives"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                filters = runConfigScanner.init_filters(settings["prefixes"], instance)
+                conf_scanner = session.scan(olive_info, filters)
+                stage_times["configScanner.__init__"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                conf_scanner.save_report(os.path.join(work_dir, f"enabled_workflows_{instance}.json"))
+                stage_times["save_report"] += time.perf_counter() - start
+
+                start = time.perf_counter()
+                with atomic_open(os.path.join(work_dir, f"running_workflows_{instance}.html"), "w") as page:
+                    htmlRenderer.render_page(page, conf_scanner.get_report(), java_script, instance, None,
+                                             conf_scanner.get_errors())
+                stage_times["render_page"] += time.perf_counter() - start
+                deltas.append(conf_scanner.get_staged_delta())
+
+            start = time.perf_counter()
+            runConfigScanner.save_config(session.staged_config(deltas),
+                                         os.path.join(work_dir, "assay_staging.jsonconfig"))
+            stage_times["save_config"] += time.perf_counter() - start
+            for stage in STAGES:
+                timings[stage].append(stage_times[stage])
+    return timings
+
+
+"""
+   Time the scanner as a separate process, repeat times: importing runConfigScanner only and full runs
+   writing only some outputs (--only config, json, html) or all of them. Return a dict of stages with lists of times
+"""
+def time_startup(settings_path: str, work_dir: str, repeat: int = 3, java_script: str = JAVA_SCRIPT) -> dict:
+    timings = {}
+    for run in STARTUP_RUNS:
+        if run == "import":
+            command = [sys.executable, "-c", "import runConfigScanner"]
+        else:
+            command = [sys.executable, os.path.join(REPO_DIR, "runConfigScanner.py"),
+                       "-s", os.path.abspath(settings_path),
+                       "-o", os.path.join(os.path.abspath(work_dir), "enabled_workflows"),
+                       "-c", os.path.join(os.path.abspath(work_dir), "assay_staging.jsonconfig"),
+                       "-p", os.path.join(os.path.abspath(work_dir), "running_workflows"),
+                       "-j", os.path.abspath(java_script)]
+            if run != "all":
+                command.extend(["--only", run])
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_process(command)
+            times.append(time.perf_counter() - start)
+        timings["startup:" + run] = times
+    return timings
+
+
+"""
+   Time scans of sites (see generate_sites), repeat times: separate runs of the scanner for each site (the time
+   of all of them) and one run with all sites, both with a pool of SITE_JOBS workers.
+   Return a dict of stages with lists of times
+"""
+def time_sites(batch_path: str, site_paths: list, work_dir: str, repeat: int = 3,
+               java_script: str = JAVA_SCRIPT) -> dict:
+    runs = {"separate": [[path] for path in site_paths], "batch": [[batch_path]]}
+    timings = {}
+    for run, run_settings in runs.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for settings in run_settings:
+                name = os.path.splitext(os.path.basename(settings[0]))[0]
+                run_process([sys.executable, os.path.join(REPO_DIR, "runConfigScanner.py"),
+                             "-s", os.path.abspath(settings[0]),
+                             "-o", os.path.join(os.path.abspath(work_dir), name + "_workflows"),
+                             "-c", os.path.join(os.path.abspath(work_dir), name + "_staging.jsonconfig"),
+                             "-p", os.path.join(os.path.abspath(work_dir), name + "_running"),
+                             "-j", os.path.abspath(java_script), "--jobs", str(SITE_JOBS)])
+            times.append(time.perf_counter() - start)
+        timings["sites:" + run] = times
+    return timings
+
+
+"""
+   Time matching of olives to assay versions with each engine, repeat times: deciding enabled cells for all
+   olives of all instances (enabled:index and enabled:matrix) and building reports (configScanner:<engine>).
+   Olives are parsed once, the matrix is timed only if NumPy is installed. Return a dict of stages with lists
+   of times
+"""
+def time_engines(settings_path: str, repeat: int = 3) -> dict:
+    engines = ["index"] + (["matrix"] if enablementMatrix.available() else [])
+    timings = {f"{stage}:{engine}": [] for engine in engines for stage in ("enabled", "configScanner")}
+    with captured_output():
+        settings = runConfigScanner.load_settings(settings_path)
+        config_check = checkMatcher.from_settings(settings["checks"])
+        config_data = runConfigScanner.load_config(settings["data"]["assay_config_file"])
+        scans = []
+        for instance in settings['instances'].values():
+            olive_files = gsiOlive.collect_olives(settings["data"]["local_olive_dir"], instance, [], {})
+            filters = runConfigScanner.init_filters(settings["prefixes"], instance)
+            _, cells = configScanner.report_layout(config_data, filters)
+            scans.append((gsiOlive.parse_olives(olive_files, config_check), filters, cells))
+        for _ in range(repeat):
+            for engine in engines:
+                start = time.perf_counter()
+                for olive_info, _, cells in scans:
+                    index = configScanner.index_config(cells, config_data)
+                    check_lists = [oli.checks for oli in olive_info if len(oli.checks) > 0]
+                    if engine == "matrix":
+                        enablementMatrix.enablementMatrix(cells, index, check_lists).enabled()
+                    else:
+                        all_cells = set(range(len(cells)))
+                        for checks in check_lists:
+                            sorted(configScanner.enabled_cells(checks, index, all_cells))
+                timings["enabled:" + engine].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for olive_info, filters, _ in scans:
+                    configScanner(config_data, olive_info, filters, None, engine)
+                timings["configScanner:" + engine].append(time.perf_counter() - start)
+    return timings
+
+
+"""
+   Measure peak memory of loading assay config scale times larger than the one generated with these parameters
+   (assays, versions, workflows, seed), repeat times. Each run is a new process (see MEMORY_RUNS): importing
+   the scanner only (memory of the interpreter and modules), json.load of the config (how we used to load it),
+   load_config and load_config followed by save_config. Return a dict of stages with lists of values:
+   memory:<run> in MB and load:<run> in seconds
+"""
+def time_memory(work_dir: str, assays: int, versions: int, workflows: int, seed: int = 1, repeat: int = 3,
+                scale: int = MEMORY_SCALE) -> dict:
+    rand = random.Random(seed)
+    wf_names = [f"workflow{w}" for w in range(workflows)]
+    wf_versions = {w: [f"{rand.randint(1, 4)}.{rand.randint(0, 20)}.{rand.randint(0, 9)}" for _ in range(3)]
+                   for w in wf_names}
+    config_path = os.path.join(work_dir, f"assay_info_x{scale}.jsonconfig")
+    write_config(config_path, synthetic_values(rand, assays * scale, versions, wf_names, wf_versions))
+    print(f"INFO: Assay config for memory runs has {os.path.getsize(config_path) // (1024 * 1024)} MB")
+    timings = {}
+    for run in MEMORY_RUNS:
+        timings["memory:" + run] = []
+        timings["load:" + run] = []
+        for _ in range(repeat):
+            command = [sys.executable, "-c", MEMORY_SCRIPT, REPO_DIR, run, config_path,
+                       os.path.join(work_dir, "assay_staging_memory.jsonconfig")]
+            output = subprocess.run(command, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                    text=True)
+            peak, elapsed = json.loads(output.stdout.strip().splitlines()[-1])
+            timings["memory:" + run].append(peak / (1024 * 1024) if peak is not None else 0.0)
+            timings["load:" + run].append(elapsed)
+    return timings
+
+
+def summarize(timings: dict, parameters: dict) -> dict:
+    return {'format': BENCHMARK_FORMAT,
+            'parameters': parameters,
+            'stages': {stage: {'min': min(times), 'median': statistics.median(times), 'runs': times}
+                       for stage, times in timings.items()}}
+
+
+"""
+   Compare results with a baseline, print a table and return stages which are slower than the baseline
+   by more than tolerance (0.2 means 20% slower). Best (min) times are compared, they are the least noisy
+"""
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    regressions = []
+    if baseline.get('parameters') != results['parameters']:
+        print("WARNING: Baseline was recorded with different parameters, comparison may not be meaningful")
+    print(f"{'stage':<24}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for stage, stage_results in results['stages'].items():
+        if stage not in baseline.get('stages', {}):
+            print(f"{stage:<24}{'-':>12}{stage_results['min']:>12.4f}{'-':>8}")
+            continue
+        base_time = baseline['stages'][stage]['min']
+        ratio = stage_results['min'] / base_time if base_time > 0 else 1.0
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            regressions.append(stage)
+            flag = "  SLOWER"
+        print(f"{stage:<24}{base_time:>12.4f}{stage_results['min']:>12.4f}{ratio:>8.2f}{flag}")
+    return regressions
@@ -0,0 +1,275 @@
+"""
+   Matcher for assay_info (project_info etc.) checks in olives. The [checks] section of settings may have
+   one assay pattern and/or a list of named patterns:
+
+   [[checks.patterns]]
+   name = "project"
+   pattern = 'config::project_info::get\\(\\S+\\)...(?P<workflow>...)...(?P<version>...)'
+   literals = ["project_info"]
+
+   Patterns are combined into a single regex (one alternative per pattern), so a line is searched only once.
+   Lines without any of the literals of the patterns are never searched (the olive lexer looks for the literals
+   of the matcher, see shesmuLexer), and a line is searched only with patterns whose literals it has (combined
+   regexes for such sets of patterns are compiled once and kept).
+   Literals are given in settings or taken from the pattern (its longest required literal part).
+   Patterns which cannot go into the combined regex (global inline flags like (?i) apply only at the start of
+   a regex, numbered group references would point to other groups) are compiled and searched on their own
+"""
+import json
+import re
+
+LEGACY_NAME = "assay"
+LEGACY_LITERALS = ("assay_info", "project_info")
+GROUP_NAME = re.compile(r"\(\?P([<=])(\w+)([>)])")
+SPECIAL = set(".^$()|")
+QUANTIFIERS = set("*+?")
+REPEAT = re.compile(r"\{\d*,?\d*\}")
+NUMBERED_CONDITION = re.compile(r"\(\?\(\d")
+GROUP_DIGITS = set("123456789")
+
+
+class checkMatcher:
+
+    """
+       patterns is a list of (name, pattern, literals), literals may be None (they are taken from the pattern).
+       A literal which contains another one is covered by the shorter one, so we look only for the shortest.
+       If we do not have literals for a pattern, every line is searched
+    """
+    def __init__(self, patterns: list):
+        self.names = {}
+        self.alternatives = []
+        '''Patterns searched on their own (position: compiled pattern), their alternatives are None'''
+        self.separate = {}
+        pattern_literals = []
+        for position, (name, pattern, literals) in enumerate(patterns):
+            group = f"c{position}"
+            self.names[group] = name
+            alternative = combined_alternative(group, pattern)
+            if alternative is None:
+                self.separate[position] = re.compile(pattern)
+                if len(patterns) > 1:
+                    print(f"INFO: Check pattern {name} cannot be combined with other patterns, it is searched "
+                          f"on its own")
+            self.alternatives.append(alternative)
+            if not literals:
+                literal = required_literal(pattern)
+                literals = [literal] if literal else []
+                if len(literals) == 0:
+                    print(f"WARNING: No literals for check pattern {name}, all olive lines will be searched with it")
+            pattern_literals.append(literals)
+        shortest = []
+        for literal in sorted(set(literal for literals in pattern_literals for literal in literals), key=len):
+            if not any(short in literal for short in shortest):
+                shortest.append(literal)
+        '''Patterns to search a line with when it has a literal, patterns without literals are always used'''
+        self.by_literal = {short.encode(): frozenset(position for position, literals in enumerate(pattern_literals)
+                                                     if any(short in literal for literal in literals))
+                           for short in shortest}
+        self.unfiltered = frozenset(position for position, literals in enumerate(pattern_literals) if not literals)
+        '''Lines with literals are found by the olive lexer (see shesmuLexer), the prefilter (a lookahead) finds
+           all literals of a line, even if they overlap. Literals go into a trie, so the cost of matching them
+           barely grows with their number'''
+        self.literals = tuple(self.by_literal)
+        self.prefilter = re.compile(b"(?=(" + literal_trie(self.literals) + b"))") if self.literals else None
+        self.combined = {}
+        '''Key of the matcher for caches, it changes when any of patterns or literals change'''
+        self.pattern = json.dumps([[name, pattern, list(literals or [])] for name, pattern, literals in patterns])
+
+    '''Combined regexes are compiled again when needed, they do not go with the matcher into worker processes'''
+    def __getstate__(self):
+        return dict(self.__dict__, combined={})
+
+    """
+       Build a matcher from the [checks] section of settings, invalid patterns are reported and skipped.
+       Returns None if we do not have any valid pattern
+    """
+    @classmethod
+    def from_settings(cls, checks: dict):
+        patterns = []
+        if isinstance(checks.get(LEGACY_NAME), str):
+            '''The assay pattern keeps the prefilter it always had'''
+            patterns.append((LEGACY_NAME, checks[LEGACY_NAME], list(LEGACY_LITERALS)))
+        for entry in checks.get('patterns', []):
+            if not isinstance(entry, dict) or not isinstance(entry.get('pattern'), str):
+                print(f"ERROR: Check pattern {entry} should have a pattern")
+                continue
+            patterns.append((entry.get('name', f"pattern{len(patterns)}"), entry['pattern'], entry.get('literals')))
+        valid = []
+        for name, pattern, literals in patterns:
+            try:
+                re.compile(pattern)
+                valid.append((name, pattern, literals))
+            except re.error as error:
+                print(f"ERROR: Failed to compile check pattern {name}: {error}")
+        '''Alternatives compile on their own (see combined_alternative), all of them together have to compile too'''
+        alternatives = [combined_alternative(f"c{position}", pattern) for position, (_, pattern, _) in enumerate(valid)]
+        try:
+            re.compile("|".join(alternative for alternative in alternatives if alternative is not None))
+        except re.error as error:
+            print(f"ERROR: Check patterns cannot be combined into one regex: {error}")
+            return None
+        return cls(valid) if len(valid) > 0 else None
+
+    '''Return positions of patterns we need to search a line with'''
+    def line_patterns(self, line: bytes) -> frozenset:
+        literals = set(self.prefilter.findall(line)) if self.prefilter is not None else ()
+        if len(literals) == 1 and not self.unfiltered:
+            return self.by_literal[literals.pop()]
+        return self.unfiltered.union(*(self.by_literal[literal] for literal in literals))
+
+    """
+       Search a line for a check, return (workflow, version, name of the pattern) or None if there is no check
+       (or the matched pattern did not give us both workflow and version). The line is searched once, with
+       patterns which may match it (all patterns if we do not know them) combined into one regex: the leftmost
+       check is found and the first pattern wins if more than one match there. Patterns which cannot be combined
+       are searched on their own, the same rule decides between their matches and the match of the combined regex
+    """
+    def search(self, line: str, patterns: set = None):
+        key = frozenset(patterns) if patterns is not None else frozenset(range(len(self.alternatives)))
+        combined_key = key.difference(self.separate) if self.separate else key
+        combined = self.combined.get(combined_key)
+        if combined is None and len(combined_key) > 0:
+            combined = self.combined[combined_key] = re.compile("|".join(self.alternatives[p]
+                                                                         for p in sorted(combined_key)))
+        best = None
+        found = combined.search(line) if combined is not None else None
+        if found is not None:
+            '''The group wrapping a pattern closes last, so it is the last group of the match'''
+            group = found.lastgroup
+            groups = found.groupdict()
+            best = (found.start(), int(group[1:]), groups.get(group + "_workflow"), groups.get(group + "_version"))
+        for position in sorted(key.intersection(self.separate)):
+            found = self.separate[position].search(line)
+            if found is not None and (best is None or (found.start(), position) < best[:2]):
+                groups = found.groupdict()
+                best = (found.start(), position, groups.get("workflow"), groups.get("version"))
+        if best is None or not best[2] or not best[3]:
+            return None
+        return best[2], best[3], self.names[f"c{best[1]}"]
+
+
+"""
+   Return the alternative for a pattern in the combined regex: the pattern in a group named after its position,
+   with its named groups renamed (workflow becomes <group>_workflow). None if the pattern cannot be combined:
+   the alternative does not compile (i.e. global inline flags not at the start) or the pattern refers to groups
+   by number (the wrapping group and groups of other patterns shift the numbers)
+"""
+def combined_alternative(group: str, pattern: str):
+    if numbered_reference(pattern):
+        return None
+    alternative = f"(?P<{group}>" + GROUP_NAME.sub(lambda m: f"(?P{m.group(1)}{group}_{m.group(2)}{m.group(3)}",
+                                                   pattern) + ")"
+    try:
+        re.compile(alternative)
+    except re.error:
+        return None
+    return alternative
+
+
+'''Return True if a pattern refers to a group by its number (\\1 or (?(1)...)), escapes in classes included'''
+def numbered_reference(pattern: str) -> bool:
+    if NUMBERED_CONDITION.search(pattern):
+        return True
+    position = 0
+    while position < len(pattern):
+        if pattern[position] == "\\":
+            if pattern[position + 1:position + 2] in GROUP_DIGITS:
+                return True
+            position += 2
+        else:
+            position += 1
+    return False
+
+
+"""
+   Return the longest literal part of a pattern which any match has to contain, None if we cannot tell
+   (i.e. the pattern has alternatives at the top level or ignores case). Groups, classes and escapes
+   like \\S are not literal, a character under a quantifier which allows zero repeats is not required
+"""
+def required_literal(pattern: str):
+    try:
+        if re.compile(pattern).flags & (re.IGNORECASE | re.VERBOSE):
+            return None
+    except re.error:
+        return None
+    best = ""
+    run = ""
+    depth = 0
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        repeat = REPEAT.match(pattern, position) if char == "{" else None
+        if char in QUANTIFIERS or repeat:
+            '''x*, x? and x{m,n} may skip x, x+ has x but may repeat it: the literal run ends here either way'''
+            best = max(best, run if char == "+" else run[:-1], key=len)
+            run = ""
+            position = repeat.end() if repeat else position + 1
+            if pattern[position:position + 1] in ("?", "+"):
+                position += 1
+            continue
+        literal = None
+        if char == "\\":
+            escaped = pattern[position + 1:position + 2]
+            literal = escaped if escaped and not escaped.isalnum() else None
+            position += 2
+        elif char == "[":
+            position = class_end(pattern, position)
+        else:
+            depth += (char == "(") - (char == ")")
+            if char == "|" and depth == 0:
+                return None
+            if char not in SPECIAL:
+                literal = char
+            position += 1
+        if literal is not None and depth == 0:
+            run += literal
+        else:
+            best = max(best, run, key=len)
+            run = ""
+    best = max(best, run, key=len)
+    return best if best else None
+
+
+'''Return the position after a character class which starts at position'''
+def class_end(pattern: str, position: int) -> int:
+    position += 1
+    if pattern[position:position + 1] == "^":
+        position += 1
+    if pattern[position:position + 1] == "]":
+        position += 1
+    while position < len(pattern) and pattern[position] != "]":
+        position += 2 if pattern[position] == "\\" else 1
+    return position + 1
+
+
+"""
+   Return a regex (bytes) matching any of literals, built as a trie: literals with a common prefix share it,
+   so the regex engine does not try each literal at each position of the text. Alternatives at the top level
+   are not wrapped in a group, each of them starts with a literal byte (the regex engine uses that to skip
+   quickly to positions where a literal may start). A suffix (a regex) goes after each literal
+"""
+def literal_trie(literals: list, suffix: bytes = b"") -> bytes:
+    trie = {}
+    for literal in literals:
+        node = trie
+        for byte in literal:
+            node = node.setdefault(byte, {})
+        node[None] = {}
+    return b"|".join(alternative + suffix for alternative in trie_alternatives(trie))
+
+
+'''Return alternatives of a trie node: one for each next byte, an empty one if a literal ends at the node'''
+def trie_alternatives(node: dict) -> list:
+    alternatives = [re.escape(bytes([byte])) + trie_regex(child) for byte, child in sorted(
+        (item for item in node.items() if item[0] is not None), key=lambda item: item[0])]
+    if None in node:
+        alternatives.append(b"")
+    return alternatives
+
+
+'''Return the regex for the rest of literals below a trie node, alternatives are grouped'''
+def trie_regex(node: dict) -> bytes:
+    alternatives = trie_alternatives(node)
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return b"(?:" + b"|".join(alternatives) + b")"
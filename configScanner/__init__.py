@@ -2,52 +2,95 @@ import collections
 import json
 import re
 import os
-from copy import deepcopy
 from json import JSONDecodeError
 from typing import OrderedDict
 
+import enablementMatrix
+import jsonWriter
+from outputWriter import publish
+
 class configScanner:
     REF_KEY = 'reference'
+    ENGINES = ("auto", "index", "matrix")
+    '''With auto, the matrix is used (if NumPy is installed) when we have at least this many cells x olives'''
+    MATRIX_MIN_WORK = 100000
 
-    def __init__(self, config_data, olive_info, filters):
+    """
+       engine decides how olives are matched to cells: with the set index or with enablementMatrix (auto picks
+       one by the size of the job), the results are the same. With a session (see scanSession) the report layout,
+       the index of assay config and configured workflows come from the session instead of being built here
+    """
+    def __init__(self, config_data, olive_info, filters, only_cells: set = None, engine: str = "auto",
+                 session=None):
+        self.engine = engine
         self.report = {}
         self.errors = 0
-        self.config = deepcopy(config_data)
-        self.validate_olives(olive_info)
+        self.error_messages = []
+        '''Staged config shares data with config_data, cells are copied when they get updates (copy on write)'''
+        self.config = dict(config_data)
+        self.copied_assays = set()
+        self.copied_cells = set()
+        configured = session.configured_workflows() if session is not None else \
+            configScanner.configured_workflows(config_data)
+        self.validate_olives(olive_info, configured)
         '''Get the data, make report'''
+        index = None
+        if session is not None:
+            assays, self.cells, index = session.layout(filters)
+        else:
+            assays, self.cells = configScanner.report_layout(config_data, filters)
+        for assay in assays:
+            self.report[assay] = {}
+        for assay, version in self.cells:
+            '''Get the reference if we have it'''
+            if self.REF_KEY not in self.report[assay].keys():
+                self.extract_reference(config_data, assay)
+            '''If we have version specified, account for it here'''
+            self.report[assay][version] = {}
+        '''Cells which are not in only_cells (if we have it) are left empty, to be filled from an earlier scan'''
+        if only_cells is not None:
+            cells_to_build = [c for c in self.cells if c in only_cells]
+            index = None
+        else:
+            cells_to_build = self.cells
+        self.computed_cells = len(cells_to_build)
+        self.construct_report(cells_to_build, config_data, olive_info, index)
+
+    """
+       Return assays we report on (if we have prefixes, check assay names) and
+       assay/version cells of the report, in the order of config data
+    """
+    @staticmethod
+    def report_layout(config_data: dict, filters: dict) -> tuple:
+        assays = []
+        cells = []
         for assay in config_data.keys():
-            '''If we have prefixes, check assay names'''
             if len(filters) > 0 and configScanner.filter_assay(filters, assay):
                 continue
-            '''Get reference info and put it in'''
-            self.report[assay] = {}
+            assays.append(assay)
             if 'versions' in config_data[assay].keys():
                 for version in config_data[assay]["versions"].keys():
-                    '''Get the reference if we have it'''
-                    if self.REF_KEY not in self.report[assay].keys():
-                        self.extract_reference(config_data, assay)
-                    '''If we have version specified, account for it here'''
-                    self.report[assay][version] = {}
-                    self.construct_report(assay,
-                                          version,
-                                          config_data[assay]["versions"][version]["workflows"],
-                                          olive_info)
-
-    """
-       validate olives vs config file, report errors
-    """
-    def validate_olives(self, olive_info: dict):
-        a_wfs = []
-        avail_olives = []
-        for a in self.config.keys():
-            for a_version in self.config[a]['versions'].keys():
-                a_wfs.extend(w for w in list(self.config[a]['versions'][a_version]['workflows'].keys()))
+                    cells.append((assay, version))
+        return assays, cells
+
+    '''Return a set of workflows configured for any assay/version in config data'''
+    @staticmethod
+    def configured_workflows(config_data: dict) -> set:
+        workflows = set()
+        for a in config_data.keys():
+            for a_version in config_data[a]['versions'].values():
+                workflows.update(a_version['workflows'].keys())
+        return workflows
+
+    """
+       validate olives vs config file (workflows configured in it), report errors
+    """
+    def validate_olives(self, olive_info: list, configured: set):
+        avail_olives = set()
         for olive in olive_info:
-            avail_olives.extend(n for n in olive['names'])
-        for avail_olive in set(avail_olives):
-            if avail_olive not in a_wfs:
-                print(f'ERROR: Workflow {avail_olive} has an olive deployed but is not configured in assay_info')
-                self.errors += 1
+            avail_olives.update(olive.names)
+        for avail_olive in sorted(avail_olives - configured):
+            self.report_error(f'Workflow {avail_olive} has an olive deployed but is not configured in assay_info')
 
     """
        filter is prepared by the main runConfigScanner block, we may have include or/and exclude hashes
@@ -58,8 +101,7 @@ class configScanner:
             if assay_ref is not None:
                 self.report[assay][self.REF_KEY] = assay_ref[0] if isinstance(assay_ref, list) else assay_ref
         except:
-            print(f"ERROR: No Reference found for Assay {assay}")
-            self.errors += 1
+            self.report_error(f"No Reference found for Assay {assay}")
 
     @staticmethod
     def filter_assay(filters: dict, assay_name: str):
@@ -95,21 +137,63 @@ class configScanner:
     def get_errors(self):
         return self.errors
 
+    '''Return messages of errors we found, in the order they were reported (see scanChanges for their use)'''
+    def get_error_messages(self):
+        return self.error_messages
+
+    '''Print an error and count it'''
+    def report_error(self, message: str):
+        print(f"ERROR: {message}")
+        self.errors += 1
+        self.error_messages.append(message)
+
     '''Return config which may get updates from an olive scan'''
     def get_staged_config(self):
         return self.config
 
+    """
+       Return workflows of a staged config cell which we can update. The assay entry and the cell are copied
+       from config data on the first update, everything else stays shared with config data
+    """
+    def staged_workflows(self, assay: str, version: str) -> dict:
+        if (assay, version) not in self.copied_cells:
+            if assay not in self.copied_assays:
+                self.config[assay] = dict(self.config[assay])
+                self.config[assay]['versions'] = dict(self.config[assay]['versions'])
+                self.copied_assays.add(assay)
+            cell = dict(self.config[assay]['versions'][version])
+            cell['workflows'] = dict(cell['workflows'])
+            self.config[assay]['versions'][version] = cell
+            self.copied_cells.add((assay, version))
+        return self.config[assay]['versions'][version]['workflows']
+
+    """
+       Return staged config updates of this scan: {assay: {version: workflows}} for cells which got updates.
+       This is all that differs from config data, deltas of instances are merged by scanSession.staged_config
+    """
+    def get_staged_delta(self) -> dict:
+        delta = {}
+        for assay, version in sorted(self.copied_cells):
+            delta.setdefault(assay, {})[version] = self.config[assay]['versions'][version]['workflows']
+        return delta
+
+    '''Replace workflows of a staged config cell (i.e. with updates from an earlier scan)'''
+    def set_staged_workflows(self, assay: str, version: str, workflows: dict):
+        self.staged_workflows(assay, version)
+        self.config[assay]['versions'][version]['workflows'] = workflows
+
+    '''Return assay/version cells of the report'''
+    def get_cells(self):
+        return self.cells
+
+    '''Return the number of report cells computed by this scan (others may come from an earlier scan)'''
+    def get_computed_cells(self):
+        return self.computed_cells
+
     '''Save report into a .json file for further analysis'''
     def save_report(self, output_json: str):
-        vetted_od = configScanner.deepsort_dict(self.get_report())
-        with open(output_json, "w") as wfj:
-            jstring = json.dumps(vetted_od, indent=2, ensure_ascii=False)
-            jstring = re.sub(r'(\[)\n', r'\1', jstring)
-            jstring = re.sub(r'(\d\")\s+', r'\1', jstring)
-            jstring = re.sub(r'(\d\",)\s+', r'\1', jstring)
-            jstring = re.sub(r'(\[)\s+', r'\1', jstring)
-            jstring = re.sub(r'(\d\",)\n', r'\1', jstring)
-            wfj.write(jstring)
+        with publish(output_json, "w") as wfj:
+            jsonWriter.write_json(self.get_report(), wfj, jsonWriter.REPORT)
             print(f"INFO: Saved assay report into a .json file {output_json}")
 
     '''Flatten a list of mixed types (str, list, set)'''
@@ -144,20 +228,6 @@ class configScanner:
                 sorted_items.append((k, v))
         return OrderedDict(sorted_items)
 
-    """
-       when we have an olive check:
-       returns False when it is not enabled in .jsonconfig 
-    """
-    @staticmethod
-    def is_configured_2run(d1, d2):
-        """Return True only if workflow version in d2 is also present in d1."""
-        for k, v in d2.items():
-            if k not in d1:
-                return False
-            if isinstance(d1[k], list):
-                return v in d1[k]
-        return False
-
     """
         A small utility function for vetting/tracking changes in version list (depends on settings and previous report)
     """
@@ -177,28 +247,60 @@ class configScanner:
         except ValueError:
             print(f"INFO: Could not find older report for {assay} version {assay_version}")
         except Exception as e:
-            print(f"ERROR: problem with {e} in get_vetted_versions")
-            self.errors += 1
+            self.report_error(f"problem with {e} in get_vetted_versions")
         return configured_olives
 
     """
-       Make sure we register values as the right type, also check if we have the same olive in report already -
-       this takes care of multiple olive files running the same workflow
+       Index assay/version cells we report on (cells are positions in the list, in assay/version order):
+       * versions   - (workflow, version) -> cells where this version of the workflow is enabled
+       * unlisted   - workflow -> cells where the workflow is configured, but not with a list of versions
+       * configured - workflow -> cells where the workflow is configured at all
     """
-    def safe_register(self, versions: list, assay: str, assay_version: str, o_name: str):
-        vetted_versions = list(versions)
-        if isinstance(self.report[assay][assay_version], dict) and o_name in self.report[assay][assay_version].keys():
-            existing_tags = self.report[assay][assay_version][o_name]
-            if isinstance(existing_tags, str):
-                vetted_versions.append(existing_tags)
-            elif isinstance(existing_tags, list):
-                for t in existing_tags:
-                    vetted_versions.append(t)
-        '''Make sure we have unique tags in the list'''
-        if len(vetted_versions) > 1:
-            vetted_versions = list(set(vetted_versions))
-        '''Make sure we register array all the time, for config and report'''
-        self.report[assay][assay_version][o_name] = sorted(vetted_versions)
+    @staticmethod
+    def index_config(cells: list, config_data: dict) -> dict:
+        index = {'versions': {}, 'unlisted': {}, 'configured': {}}
+        for c, (assay, assay_version) in enumerate(cells):
+            for wf, wf_versions in config_data[assay]["versions"][assay_version]["workflows"].items():
+                index['configured'].setdefault(wf, set()).add(c)
+                if not isinstance(wf_versions, list):
+                    index['unlisted'].setdefault(wf, set()).add(c)
+                    continue
+                for v in wf_versions:
+                    if isinstance(v, str):
+                        index['versions'].setdefault((wf, v), set()).add(c)
+        return index
+
+    """
+       Return cells where an olive with checks is enabled to run: every check has to be satisfied (the checked
+       version is in the list of versions of the workflow, or the workflow is configured without a list) and
+       at least one of them has to find its version in a list. Cells which do not have a checked workflow
+       configured are not enabled
+    """
+    @staticmethod
+    def enabled_cells(checks, index: dict, all_cells: set) -> set:
+        enabled = all_cells
+        listed = set()
+        for wf, wf_version in checks:
+            versions = index['versions'].get((wf, wf_version), set())
+            listed |= versions
+            enabled = enabled & (versions | index['unlisted'].get(wf, set()))
+            if len(enabled) == 0:
+                break
+        return enabled & listed
+
+    """
+       Return enabled cells (sorted lists) for olives with checks, in the order of olives. Without the matrix
+       this returns None and cells are looked up in the index for each olive
+    """
+    def matrix_cells(self, cells: list, index: dict, olives: list):
+        if self.engine == "index" or not enablementMatrix.available():
+            if self.engine == "matrix":
+                print("WARNING: NumPy is not installed, using the index instead of the enablement matrix")
+            return None
+        check_lists = [oli.checks for oli in olives if len(oli.checks) > 0]
+        if self.engine == "auto" and len(cells) * len(check_lists) < self.MATRIX_MIN_WORK:
+            return None
+        return iter(enablementMatrix.enablementMatrix(cells, index, check_lists).enabled())
 
     """
        fuses config assay_info and olive data:
@@ -207,26 +309,44 @@ class configScanner:
        * if the olive is not in config and there are no checks, report
        
        in the config - no olives which are not checking assay_info settings
+
+       This is a single pass over olives, cells which enable an olive are looked up in the index
+       (or decided for all olives at once with the enablement matrix).
+       Cells are visited in the same order for each olive, so report and staged config come out
+       the same as when going through all olives for each cell. The index may come from a scan session
     """
-    def construct_report(self, assay, assay_version, config: dict, olives: list):
+    def construct_report(self, cells: list, config_data: dict, olives: list, index: dict = None):
+        index = index if index is not None else configScanner.index_config(cells, config_data)
+        all_cells = set(range(len(cells)))
+        decided = self.matrix_cells(cells, index, olives)
         for oli in olives:
             try:
                 """
                    Olive has checks, verify that it is enabled in the config
                    if an olive does not have checks, it will run regardless
                 """
-                for n in oli['names']:
-                    vetted_versions = oli['tags']
-                    if len(oli['checks']) > 0:
-                        if configScanner.is_configured_2run(config, oli['checks']):
-                            self.safe_register(vetted_versions, assay, assay_version, n)
-                        elif n in self.config[assay]['versions'][assay_version]['workflows'].keys():
-                            '''get_vetted_versions new olive tags with existing (configured) ones, if present'''
-                            vetted_versions = self.get_vetted_versions(n, oli['tags'], assay, assay_version)
-                            self.config[assay]['versions'][assay_version]['workflows'][n] = sorted(vetted_versions)
-                    elif len(oli['checks']) == 0:
-                        self.safe_register(vetted_versions, assay, assay_version, n)
+                has_checks = len(oli.checks) > 0
+                if has_checks and decided is not None:
+                    enabled_order = next(decided)
+                    enabled = set(enabled_order)
+                else:
+                    enabled = configScanner.enabled_cells(oli.checks, index, all_cells) if has_checks else all_cells
+                    enabled_order = sorted(enabled)
+                for n in oli.names:
+                    for c in enabled_order:
+                        assay, assay_version = cells[c]
+                        self.report[assay][assay_version].setdefault(n, set()).update(oli.tags)
+                    if not has_checks:
+                        continue
+                    for c in sorted(index['configured'].get(n, set()) - enabled):
+                        assay, assay_version = cells[c]
+                        '''get_vetted_versions new olive tags with existing (configured) ones, if present'''
+                        vetted_versions = self.get_vetted_versions(n, oli.tags, assay, assay_version)
+                        self.staged_workflows(assay, assay_version)[n] = sorted(vetted_versions)
             except Exception as e:
                 print(f"An error occurred: {e}")
-                print("ERROR: Could not construct workflow report given the inputs")
-                self.errors += 1
+                self.report_error("Could not construct workflow report given the inputs")
+        '''Make sure we register arrays of unique tags all the time, for config and report'''
+        for assay, assay_version in cells:
+            for n, versions in self.report[assay][assay_version].items():
+                self.report[assay][assay_version][n] = sorted(versions)
@@ -0,0 +1,73 @@
+"""
+   Enablement of olives as boolean matrices (NumPy is optional, without it configScanner uses its set index).
+   Rows are assay/version cells of the report, columns are (workflow, version) pairs checked by olives:
+
+   satisfied[cell, pair]  the workflow version is enabled in the cell, or the workflow is configured there
+                          without a list of versions
+   listed[cell, pair]     the workflow version is enabled in the cell (in a list of versions)
+
+   Checks of an olive are a set of columns. An olive is enabled in a cell if every one of its checks is
+   satisfied there and at least one of them is listed (the same rule as configScanner.enabled_cells).
+   Many olives check the same workflow versions, so each distinct set of checks is decided once, sets with
+   the same number of checks together: columns are gathered for all of them and reduced in one go.
+   NumPy is imported only when the matrix is built, small scans do not pay for importing it
+"""
+import importlib.util
+
+CHUNK_SIZE = 50000000
+
+
+'''Return True if we can use the matrix (NumPy is installed)'''
+def available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+class enablementMatrix:
+
+    """
+       cells are report cells, index is the index of assay config (see configScanner.index_config),
+       check_lists are checks of olives ((workflow, version) pairs)
+    """
+    def __init__(self, cells: list, index: dict, check_lists: list):
+        import numpy
+        self.columns = {}
+        self.check_sets = {}
+        '''Position of the distinct set of checks (sorted columns) for each olive'''
+        self.olive_sets = []
+        for checks in check_lists:
+            check_set = tuple(sorted(set(self.columns.setdefault((wf, wf_version), len(self.columns))
+                                         for wf, wf_version in checks)))
+            self.olive_sets.append(self.check_sets.setdefault(check_set, len(self.check_sets)))
+        self.satisfied = numpy.zeros((len(cells), len(self.columns)), dtype=bool)
+        self.listed = numpy.zeros((len(cells), len(self.columns)), dtype=bool)
+        for (wf, wf_version), column in self.columns.items():
+            self.listed[list(index['versions'].get((wf, wf_version), ())), column] = True
+            self.satisfied[list(index['unlisted'].get(wf, ())), column] = True
+        self.satisfied |= self.listed
+
+    """
+       Return enabled cells for each olive, as sorted lists of cell positions in the order of check_lists.
+       Olives with the same checks share the list
+    """
+    def enabled(self) -> list:
+        import numpy
+        decided = [None] * len(self.check_sets)
+        by_size = {}
+        for check_set, position in self.check_sets.items():
+            by_size.setdefault(len(check_set), []).append((position, check_set))
+        for size, sets in by_size.items():
+            '''Chunks keep the gathered (cells x sets x checks) array at a moderate size'''
+            chunk = max(1, CHUNK_SIZE // max(1, self.satisfied.shape[0] * size))
+            for start in range(0, len(sets), chunk):
+                part = sets[start:start + chunk]
+                columns = numpy.array([check_set for _, check_set in part], dtype=numpy.intp)
+                if size == 1:
+                    enabled = self.listed[:, columns[:, 0]]
+                else:
+                    enabled = self.satisfied[:, columns].all(axis=2) & self.listed[:, columns].any(axis=2)
+                '''Enabled (set, cell) pairs come sorted by set and then by cell, we split them by sets'''
+                set_positions, enabled_cells = numpy.nonzero(enabled.T)
+                bounds = numpy.searchsorted(set_positions, numpy.arange(1, len(part)))
+                for (position, _), cells in zip(part, numpy.split(enabled_cells, bounds)):
+                    decided[position] = cells.tolist()
+        return [decided[position] for position in self.olive_sets]
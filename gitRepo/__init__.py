@@ -0,0 +1,171 @@
+"""
+   Reading olives (and assay config) from a local git repository at any revision, without a checkout.
+   Objects come from a single long-lived `git cat-file --batch` process, this works offline and is fast
+   for many small reads. Trees are kept by their hash, parsed olives are kept by blob hash (see gsiOlive),
+   so files which did not change between commits are read and parsed only once
+"""
+import os
+import subprocess
+
+BATCH_COMMAND = ["cat-file", "--batch"]
+TREE_MODE = b"40000"
+
+
+class gitRepo:
+    readers = {}
+
+    def __init__(self, repo_dir: str):
+        self.repo_dir = repo_dir
+        self.top = os.path.realpath(self.git("rev-parse", "--show-toplevel").strip())
+        self.batch = None
+        self.trees = {}
+        self.commits = {}
+        self.roots = {}
+        self.parsed = {}
+
+    """
+       Return a reader for a repository, we keep one per repository for the whole run.
+       Returns None if repo_dir is not in a git repository
+    """
+    @classmethod
+    def open(cls, repo_dir: str):
+        if repo_dir not in cls.readers:
+            try:
+                cls.readers[repo_dir] = cls(repo_dir)
+            except (OSError, subprocess.CalledProcessError):
+                print(f"ERROR: {repo_dir} is not a git repository (or git is not available)")
+                return None
+        return cls.readers[repo_dir]
+
+    '''Return path relative to the top of the repository, None if the path is outside of it'''
+    def repo_path(self, path: str):
+        relative = os.path.relpath(os.path.realpath(path), self.top)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            return None
+        return "" if relative == os.curdir else relative.replace(os.sep, "/")
+
+    def git(self, *git_args) -> str:
+        return subprocess.run(["git", "-C", self.repo_dir] + list(git_args), check=True, capture_output=True,
+                              text=True).stdout
+
+    """
+       Return (type, oid, data) of an object given by its name (oid or any revision expression),
+       None if there is no such object
+    """
+    def read_object(self, name: str):
+        if self.batch is None:
+            self.batch = subprocess.Popen(["git", "-C", self.repo_dir] + BATCH_COMMAND, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE)
+        self.batch.stdin.write(name.encode() + b"\n")
+        self.batch.stdin.flush()
+        header = self.batch.stdout.readline()
+        if len(header) == 0:
+            raise OSError(f"git cat-file stopped while reading {name} from {self.repo_dir}")
+        fields = header.split()
+        if len(fields) != 3:
+            return None
+        oid, object_type, size = fields
+        data = self.batch.stdout.read(int(size))
+        self.batch.stdout.read(1)
+        return object_type.decode(), oid.decode(), data
+
+    """
+       Return full hash of the commit for a revision, None if the revision is not known
+    """
+    def resolve(self, revision: str):
+        if revision not in self.commits:
+            commit = self.read_object(revision + "^{commit}")
+            self.commits[revision] = commit[1] if commit is not None else None
+            if commit is not None:
+                self.roots[commit[1]] = commit[2].split(b"\n", 1)[0].split(b" ")[1].decode()
+        return self.commits[revision]
+
+    """
+       Return commit hash, commit time (seconds since epoch) and the subject line of a commit
+    """
+    def commit_info(self, revision: str) -> tuple:
+        commit = self.read_object(revision + "^{commit}")
+        if commit is None:
+            return revision, 0, ""
+        headers, _, message = commit[2].partition(b"\n\n")
+        commit_time = 0
+        for header in headers.split(b"\n"):
+            if header.startswith(b"committer "):
+                commit_time = int(header.rsplit(b" ", 2)[1])
+        return commit[1], commit_time, message.split(b"\n", 1)[0].decode(errors="replace")
+
+    """
+       Return commits for a revision or a range (anything with .., as git rev-list takes it), oldest first
+    """
+    def revisions(self, revision_spec: str) -> list:
+        if ".." not in revision_spec:
+            commit = self.resolve(revision_spec)
+            return [commit] if commit is not None else []
+        try:
+            return self.git("rev-list", "--reverse", revision_spec).split()
+        except subprocess.CalledProcessError:
+            print(f"ERROR: Could not list commits in {revision_spec}")
+        return []
+
+    """
+       Return entries of a tree as a dict: name -> (mode, oid). Trees are kept, they do not change
+    """
+    def tree_entries(self, tree_oid: str) -> dict:
+        if tree_oid not in self.trees:
+            entries = {}
+            tree = self.read_object(tree_oid)
+            if tree is not None and tree[0] == "tree":
+                data = tree[2]
+                oid_length = len(tree_oid) // 2
+                position = 0
+                while position < len(data):
+                    name_end = data.index(b"\0", position)
+                    mode, name = data[position:name_end].split(b" ", 1)
+                    oid = data[name_end + 1:name_end + 1 + oid_length].hex()
+                    entries[name.decode(errors="surrogateescape")] = (mode, oid)
+                    position = name_end + 1 + oid_length
+            self.trees[tree_oid] = entries
+        return self.trees[tree_oid]
+
+    """
+       Return entries of a directory (path relative to the top of the repo) at a revision,
+       empty dict if there is no such directory
+    """
+    def list_dir(self, revision: str, dir_path: str) -> dict:
+        commit_oid = self.resolve(revision)
+        if commit_oid is None:
+            return {}
+        tree_oid = self.roots[commit_oid]
+        for part in [p for p in dir_path.split("/") if p not in ("", ".")]:
+            entry = self.tree_entries(tree_oid).get(part)
+            if entry is None or entry[0] != TREE_MODE:
+                return {}
+            tree_oid = entry[1]
+        return self.tree_entries(tree_oid)
+
+    '''Return oid of a file at a revision, None if there is no such file'''
+    def file_oid(self, revision: str, file_path: str):
+        dir_path, _, name = file_path.rpartition("/")
+        entry = self.list_dir(revision, dir_path).get(name)
+        if entry is None or entry[0] == TREE_MODE:
+            return None
+        return entry[1]
+
+    '''Return content of a file at a revision, None if there is no such file'''
+    def read_file(self, revision: str, file_path: str):
+        oid = self.file_oid(revision, file_path)
+        blob = self.read_object(oid) if oid is not None else None
+        return blob[2] if blob is not None else None
+
+    def close(self):
+        if self.batch is not None:
+            self.batch.stdin.close()
+            self.batch.wait()
+            self.batch = None
+
+    '''Stop git processes of all readers we opened, readers are dropped (with trees and parsed olives they keep)'''
+    @classmethod
+    def close_all(cls):
+        for reader in cls.readers.values():
+            reader.close()
+        cls.readers = {}
@@ -1,24 +1,35 @@
 """
    Functions for handling Olive data (this is different from what we use in workflowTracker)
 """
+import fnmatch
 import glob
+import hashlib
+import itertools
 import os
 import re
-import subprocess
+import sys
 from os.path import basename
-from re import Match
+
+from checkMatcher import checkMatcher
+import shesmuLexer
+
+CHECK_LITERALS = (b'assay_info', b'project_info')
+RUN_TAG = re.compile(r"(\S+)_v(\d+_\d+_*\d*\w*)$")
+PARSE_CHUNK = 16
+OLIVE_GLOB = "vidarr*.shesmu"
 
 """
-   Find olives, return dict with lists of files
+   Find olives, return dict with lists of files. With a revision, olives are listed from the git
+   repository repo_dir is in, as they were at this revision (paths are the same as in a checkout)
 """
-def collect_olives(repo_dir: str, instance: str, blacklist: list, aliases: dict) -> list:
+def collect_olives(repo_dir: str, instance: str, blacklist: list, aliases: dict, revision: str = None) -> list:
     olive_list = []
     if repo_dir and os.path.isdir(repo_dir):
         subdir = "/".join([repo_dir, instance])
-        olive_files = glob.glob("/".join([subdir, "vidarr*.shesmu"]))
+        olive_files = glob_olives(repo_dir, subdir, revision)
         if len(olive_files) == 0 and instance in aliases.keys():
             subdir = "/".join([repo_dir, "shesmu", aliases[instance]])
-            olive_files = glob.glob("/".join([subdir, "vidarr*.shesmu"]))
+            olive_files = glob_olives(repo_dir, subdir, revision)
         print(f'INFO: We have {len(olive_files)} .shesmu files for {instance}')
         if len(olive_files) > 0:
             olive_list = []
@@ -29,15 +40,20 @@ def collect_olives(repo_dir: str, instance: str, blacklist: list, aliases: dict)
 
 
 """
-   A simple subroutine for merging two hashes with Olive info
+   List olives in a directory, on disk or (with a revision) in git. Olives are sorted (the order of olives matters
+   for staged config), so a scan of a revision and of the same files on disk give the same outputs
 """
-def merge_info(existing_hash: dict, new_hash: dict) -> dict:
-    if isinstance(existing_hash, dict) and len(existing_hash) != 0:
-        new_hash['olives'].extend(existing_hash['olives'])
-        new_hash['data_modules'] = new_hash['data_modules'].union(existing_hash['data_modules'])
-        new_hash['code_modules'] = new_hash['code_modules'].union(existing_hash['code_modules'])
-        new_hash['tags'] = new_hash['tags'].union(existing_hash['tags'])
-    return new_hash
+def glob_olives(repo_dir: str, subdir: str, revision: str = None) -> list:
+    if revision is None:
+        return sorted(glob.glob("/".join([subdir, OLIVE_GLOB])))
+    '''git support is imported only when we read from git, it is not needed for scanning files on disk'''
+    from gitRepo import gitRepo, TREE_MODE
+    repo = gitRepo.open(repo_dir)
+    dir_path = repo.repo_path(subdir) if repo is not None else None
+    if dir_path is None:
+        return []
+    return sorted("/".join([subdir, name]) for name, (mode, _) in repo.list_dir(revision, dir_path).items()
+                  if fnmatch.fnmatchcase(name, OLIVE_GLOB) and mode != TREE_MODE)
 
 
 """
@@ -53,60 +69,377 @@ def list_to_nested_dict(arr):
 
 
 """
-   Parse Olive: return a dict with tags names and checks
+   Compact records for parsed olives. Workflow names and versions are interned, so the same strings
+   are shared by all olives (and by reports built from them), tags and names are frozen sets.
+   Checks keep the order of the olive, an olive is enabled only where all of its checks hold
+   (see configScanner.enabled_cells). A check knows the name of the pattern it matched
+"""
+class oliveCheck:
+    __slots__ = ('workflow', 'version', 'pattern')
+
+    def __init__(self, workflow: str, version: str, pattern: str = None):
+        self.workflow = sys.intern(workflow)
+        self.version = sys.intern(version)
+        self.pattern = sys.intern(pattern) if pattern is not None else None
+
+    '''A check unpacks as (workflow, version)'''
+    def __iter__(self):
+        yield self.workflow
+        yield self.version
+
+    def __eq__(self, other):
+        return isinstance(other, oliveCheck) and self.workflow == other.workflow and \
+            self.version == other.version and self.pattern == other.pattern
+
+    def __hash__(self):
+        return hash((self.workflow, self.version, self.pattern))
+
+    def __repr__(self):
+        return f"oliveCheck({self.workflow!r}, {self.version!r}, {self.pattern!r})"
+
+
+class oliveRecord:
+    __slots__ = ('olives', 'tags', 'checks', 'names', 'block')
+
+    """
+       checks may be a dict (workflow: version) or (workflow, version[, pattern]) tuples, in the order of the olive.
+       block is the position of the olive block in the file (0 is for Runs and checks outside olive blocks)
+    """
+    def __init__(self, olives, tags, checks, names, block: int = 0):
+        self.block = block
+        self.olives = tuple(olives)
+        self.tags = frozenset(map(sys.intern, tags))
+        self.checks = tuple(itertools.starmap(oliveCheck, checks.items() if isinstance(checks, dict) else checks))
+        self.names = frozenset(map(sys.intern, names))
+
+    '''Return checks as a dict: workflow -> version'''
+    def checks_dict(self) -> dict:
+        return {check.workflow: check.version for check in self.checks}
+
+    '''Return the same record for another olive file (an olive with the same content)'''
+    def at_path(self, m_olive: str):
+        record = oliveRecord.__new__(oliveRecord)
+        record.block = self.block
+        record.olives = (m_olive,)
+        record.tags = self.tags
+        record.checks = self.checks
+        record.names = self.names
+        return record
+
+    def __eq__(self, other):
+        return isinstance(other, oliveRecord) and self.olives == other.olives and self.tags == other.tags and \
+            self.checks == other.checks and self.names == other.names and self.block == other.block
+
+    def __repr__(self):
+        return f"oliveRecord({list(self.olives)!r}, {sorted(self.tags)!r}, {self.checks_dict()!r}, " \
+               f"{sorted(self.names)!r}, {self.block})"
+
+
+"""
+   Read an olive once, return its raw content or None if the file is not readable.
+   No shell is involved, so odd file names are safe
+"""
+def read_olive(olive_file: str, messages: list = None):
+    try:
+        with open(olive_file, "rb") as olive:
+            return olive.read()
+    except OSError:
+        log_message(f'WARNING: Could not read the Olive {olive_file}', messages)
+    return None
+
+
+"""
+   Split an olive into olive blocks with their Runs and check lines (see shesmuLexer), comments and strings
+   are skipped. Without check patterns we look for assay_info/project_info checks. With defines (a dict) we get
+   check lines of Define and Function blocks with olive blocks which refer to them
+"""
+def olive_blocks(content: bytes, check_pattern: checkMatcher = None, defines: dict = None) -> list:
+    if check_pattern is None:
+        return shesmuLexer.olive_blocks(content, CHECK_LITERALS, False, defines)
+    return shesmuLexer.olive_blocks(content, check_pattern.literals, len(check_pattern.unfiltered) > 0, defines)
+
+
+"""
+   Print a message or, if we have a list for messages, keep it there. Kept messages are printed
+   by the caller, this way they can be cached and come out in the same order when parsing in a pool
+"""
+def log_message(message: str, messages: list = None):
+    if messages is None:
+        print(message)
+    else:
+        messages.append(message)
+
+
+"""
+   Parse a single Olive: return records with tags names and checks, one for each olive block (and one for Runs
+   and checks outside olive blocks, if there are any). Content may be passed in if the file was already read
+   (i.e. for hashing).
+   Checks outside olive blocks are usually in a Define or Function which olives call. Checks of a Define or
+   Function apply to olive blocks which refer to its name, block 0 has no record of its own unless it has Runs.
+   Other checks outside olive blocks cannot be given to any olive block, olive blocks without checks are
+   then reported
+"""
+def parse_olive(m_olive: str, check_pattern: checkMatcher, content: bytes = None, messages: list = None) -> list:
+    if content is None:
+        content = read_olive(m_olive, messages)
+    defines = {}
+    blocks = olive_blocks(content, check_pattern, defines) if content is not None else [([], [])]
+    if not any(len(runs) > 0 for runs, _ in blocks):
+        log_message(f'WARNING: No Run lines in the Olive {m_olive}', messages)
+    if not any(len(check_lines) > 0 for _, check_lines in blocks):
+        log_message(f'WARNING: No Config Checks in the Olive {m_olive}', messages)
+    loose_checks = len(blocks) > 1 and len(blocks[0][1]) > sum(len(lines) for lines, _ in defines.values())
+    records = []
+    for block, (runs, check_lines) in enumerate(blocks):
+        if block == 0 and len(runs) == 0 and len(blocks) > 1:
+            continue
+        if block > 0:
+            check_lines = check_lines + [line for lines, callers in defines.values() if block in callers
+                                         for line in lines]
+            if len(check_lines) == 0 and loose_checks and len(runs) > 0:
+                log_message(f'WARNING: Olive block {block} in {m_olive} has no config checks, checks outside '
+                            f'olive blocks which are not in a Define or Function it calls are not applied to it',
+                            messages)
+        records.append(parse_block(m_olive, block, runs, check_lines, check_pattern, messages))
+    return records
+
+
+"""
+   Parse an olive block: config checks of the block decide where its Runs are enabled
+"""
+def parse_block(m_olive: str, block: int, runs: list, check_lines: list, check_pattern: checkMatcher,
+                messages: list = None) -> oliveRecord:
+    vetted_tags = []
+    vetted_names = []
+    config_checks = {}
+    check_names = {}
+    for c in check_lines:
+        check = check_pattern.search(c.decode(errors="replace"), check_pattern.line_patterns(c)) \
+            if check_pattern else None
+        if check is not None:
+            config_checks[check[0]] = check[1]
+            check_names[check[0]] = check[2]
+
+    for action in runs:
+        '''An action is a single word, so the tag can only be matched from its start'''
+        next_run = RUN_TAG.match(action)
+        if next_run is None:
+            continue
+        next_name, next_tag = next_run.groups()
+        next_tag = next_tag.replace("_", ".")
+        if next_tag is not None:
+            vetted_tags.append(next_tag)
+        if next_name is not None:
+            vetted_names.append(next_name)
+            if next_name in config_checks.keys():
+                if next_tag and next_tag != config_checks[next_name]:
+                    log_message(f'ERROR: config check for {next_name} not using correct version in  {m_olive}',
+                                messages)
+
+    return oliveRecord([m_olive], vetted_tags, [(wf, v, check_names[wf]) for wf, v in config_checks.items()],
+                       vetted_names, block)
+
+
+"""
+   Read, hash (if asked to) and parse a single olive. Parsing is skipped if the content hash is the
+   one we already know. This is a unit of work for a process pool, so messages are returned, not printed
+"""
+def scan_olive(m_olive: str, check_pattern: checkMatcher, hashed: bool = False, known_hash: str = None) -> tuple:
+    messages = []
+    digest = None
+    try:
+        olive_stat = os.stat(m_olive)
+        olive_stat = (olive_stat.st_mtime_ns, olive_stat.st_size)
+    except OSError:
+        olive_stat = None
+    content = read_olive(m_olive, messages)
+    if content is not None and hashed:
+        digest = hashlib.sha256(content).hexdigest()
+        if digest == known_hash:
+            return None, messages, digest, olive_stat
+    parsed = parse_olive(m_olive, check_pattern, content if content is not None else b"", messages)
+    return parsed, messages, digest, olive_stat
+
+
+"""
+   Parse Olives: return a list of records (see oliveRecord) with tags names and checks of each olive block
    {
-     olives = []
-     tags = []
-     checks = {}
-     names = []
+     olives = ()
+     tags = frozenset()
+     checks = (oliveCheck(workflow, version, pattern))
+     names = frozenset()
+     block = position of the olive block in the file
    }
+   Unchanged olives come from the cache (if we have one), the rest is parsed in a pool
+   (if we have an executor). Messages are printed in the order of olive_files in all cases.
+   With a revision, olives are read from git (see parse_git_olives) and the cache is not used. With a dict for
+   contents, olives with the same content are parsed once (see parse_shared_olives).
+   If we have a dict for stats, counts of olives, parsed olives, cache hits and bytes read are added to it
 """
-def parse_olives(olive_files: list, check_pattern: re.Pattern[str]) -> list:
+def parse_olives(olive_files: list, check_pattern: checkMatcher, cache=None, executor=None,
+                 repo_dir: str = None, revision: str = None, stats: dict = None, contents: dict = None) -> list:
     """ Return a list of Olive data structure(s) """
+    if revision is not None:
+        return parse_git_olives(olive_files, check_pattern, repo_dir, revision, executor, stats)
+    if contents is not None:
+        return parse_shared_olives(olive_files, check_pattern, contents, cache, executor, stats)
     parsed_olives = []
+    cached = [cache.lookup(m_olive) if cache is not None else None for m_olive in olive_files]
+    to_parse = [m_olive for m_olive, hit in zip(olive_files, cached) if hit is None]
+    scan_args = (to_parse,
+                 [check_pattern] * len(to_parse),
+                 [cache is not None] * len(to_parse),
+                 [cache.known_hash(m_olive) if cache is not None else None for m_olive in to_parse])
+    if executor is not None:
+        scanned = executor.map(scan_olive, *scan_args, chunksize=PARSE_CHUNK)
+    else:
+        scanned = map(scan_olive, *scan_args)
     ''' extract versions of the Workflow, names and modules'''
+    for m_olive, hit in zip(olive_files, cached):
+        if hit is None:
+            parsed, messages, digest, olive_stat = next(scanned)
+            count(stats, 'bytes_read', olive_stat[1] if olive_stat else 0)
+            count(stats, 'olive_cache_hits' if parsed is None else 'olives_parsed')
+            if cache is not None:
+                parsed, messages = cache.update(m_olive, parsed, messages, digest, olive_stat)
+        else:
+            parsed, messages = hit
+            count(stats, 'olive_cache_hits')
+        for message in messages:
+            print(message)
+        parsed_olives.extend(parsed)
+    count(stats, 'olives', len(olive_files))
+    return parsed_olives
+
+
+'''Add to a counter in stats, if we have them'''
+def count(stats: dict, name: str, value: int = 1):
+    if stats is not None:
+        stats[name] = stats.get(name, 0) + value
+
+
+"""
+   Parse olive content we already have, return parsed data and messages. This is a unit of work for a process pool
+"""
+def parse_content(m_olive: str, check_pattern: checkMatcher, content: bytes) -> tuple:
+    messages = []
+    parsed = parse_olive(m_olive, check_pattern, content, messages)
+    return parsed, messages
+
+
+"""
+   Parse olives as they are in git at a revision. Olive blobs are parsed only once for the run: parsed data
+   is kept by blob hash (and the path, it appears in messages), so scanning many commits parses only
+   the olives which changed between them
+"""
+def parse_git_olives(olive_files: list, check_pattern: checkMatcher, repo_dir: str, revision: str,
+                     executor=None, stats: dict = None) -> list:
+    from gitRepo import gitRepo
+    parsed_olives = []
+    repo = gitRepo.open(repo_dir)
+    pattern = check_pattern.pattern if check_pattern else None
+    keys = []
     for m_olive in olive_files:
-        vetted_tags = []
-        vetted_names = []
-        config_checks = {}
-        try:
-            run_lines = subprocess.check_output(f"grep 'Run ' '{m_olive}'", shell=True).decode().strip()
-            run_lines = run_lines.split("\n")
-            if not isinstance(run_lines, list):
-                run_lines = [run_lines]
-        except subprocess.CalledProcessError:
-            print(f'WARNING: No Run lines in the Olive {m_olive}')
-            run_lines = []
+        repo_path = repo.repo_path(m_olive) if repo is not None else None
+        oid = repo.file_oid(revision, repo_path) if repo_path is not None else None
+        keys.append((oid, m_olive, pattern))
+    to_parse = [key for key in dict.fromkeys(keys) if key[0] is not None and key not in repo.parsed]
+    scan_args = ([m_olive for _, m_olive, _ in to_parse],
+                 [check_pattern] * len(to_parse),
+                 [repo.read_object(oid)[2] for oid, _, _ in to_parse])
+    if executor is not None:
+        scanned = executor.map(parse_content, *scan_args, chunksize=PARSE_CHUNK)
+    else:
+        scanned = map(parse_content, *scan_args)
+    for key, result in zip(to_parse, scanned):
+        repo.parsed[key] = result
+    count(stats, 'olives', len(olive_files))
+    count(stats, 'olives_parsed', len(to_parse))
+    count(stats, 'olive_cache_hits', len(olive_files) - len(to_parse))
+    count(stats, 'bytes_read', sum(len(content) for content in scan_args[2]))
+    for key in keys:
+        if key[0] is None:
+            print(f'WARNING: Could not read the Olive {key[1]} at {revision}')
+            parsed, messages = parse_content(key[1], check_pattern, b"")
+        else:
+            parsed, messages = repo.parsed[key]
+        for message in messages:
+            print(message)
+        parsed_olives.extend(parsed)
+    return parsed_olives
 
+
+"""
+   Return parsed data and messages of an olive for another olive file with the same content: records and
+   messages get the path of the other file
+"""
+def moved_olive(parsed: list, messages: list, source: str, m_olive: str) -> tuple:
+    if source == m_olive:
+        return parsed, messages
+    return [record.at_path(m_olive) for record in parsed], [message.replace(source, m_olive) for message in messages]
+
+
+"""
+   Parse olives which may have the same content as olives of other repositories (forks, sites sharing olives).
+   contents is shared by all parse_olives calls of a run: {(content hash, check pattern): (olive, parsed, messages)}.
+   Unchanged olives come from the cache, the rest is read and hashed here and only contents we have not seen
+   (in this run or, under another path, in the cache) are parsed, in a pool if we have an executor
+"""
+def parse_shared_olives(olive_files: list, check_pattern: checkMatcher, contents: dict, cache=None, executor=None,
+                        stats: dict = None) -> list:
+    pattern = check_pattern.pattern if check_pattern else None
+    results = [cache.lookup(m_olive) if cache is not None else None for m_olive in olive_files]
+    count(stats, 'olive_cache_hits', sum(1 for hit in results if hit is not None))
+    read = {}
+    to_parse = {}
+    for position, m_olive in enumerate(olive_files):
+        if results[position] is not None:
+            continue
+        messages = []
+        content = read_olive(m_olive, messages)
+        if content is None:
+            parsed, parse_messages = parse_content(m_olive, check_pattern, b"")
+            results[position] = (parsed, messages + parse_messages)
+            continue
+        count(stats, 'bytes_read', len(content))
         try:
-            check_lines = subprocess.check_output(f"grep -E 'assay_info|project_info' '{m_olive}'",
-                                                  shell=True).decode().strip()
-            check_lines = check_lines.split("\n")
-            for c in check_lines:
-                matcher: Match[str] | None = re.search(check_pattern, c)
-                if matcher and matcher.groupdict():
-                    if matcher.groupdict()['workflow'] and matcher.groupdict()['version']:
-                        checker = {matcher.groupdict()['workflow']: matcher.groupdict()['version']}
-                        config_checks.update(checker)
-        except subprocess.CalledProcessError:
-            print(f'WARNING: No Config Checks in the Olive {m_olive}')
-
-        for rl in run_lines:
-            next_run = re.search(r"(\S+)_v(\d+_\d+_*\d*\w*)$", rl)
-            if next_run is None:
-                continue
-            next_tag = next_run.group(2).replace("_", ".")
-            next_name = next_run.group(1)
-            if next_tag is not None:
-                vetted_tags.append(next_tag)
-            if next_name is not None:
-                vetted_names.append(next_name)
-                if next_name in config_checks.keys():
-                    if next_tag and next_tag != config_checks[next_name]:
-                        print(f'ERROR: config check for {next_name} not using correct version in  {m_olive}')
-
-        parsed_olives.append({'olives': [m_olive],
-                              'tags': set(vetted_tags),
-                              'checks': config_checks,
-                              'names': set(vetted_names)})
+            olive_stat = os.stat(m_olive)
+            olive_stat = (olive_stat.st_mtime_ns, olive_stat.st_size)
+        except OSError:
+            olive_stat = None
+        key = (hashlib.sha256(content).hexdigest(), pattern)
+        read[position] = (key, olive_stat)
+        if key not in contents and cache is not None:
+            known = cache.find_hash(key[0])
+            if known is not None:
+                contents[key] = (known, *cache.replay(known, cache.entries[known]))
+        if key not in contents and key not in to_parse:
+            to_parse[key] = (m_olive, content)
+    scan_args = ([m_olive for m_olive, _ in to_parse.values()],
+                 [check_pattern] * len(to_parse),
+                 [content for _, content in to_parse.values()])
+    if executor is not None:
+        scanned = executor.map(parse_content, *scan_args, chunksize=PARSE_CHUNK)
+    else:
+        scanned = map(parse_content, *scan_args)
+    for (key, (m_olive, _)), (parsed, messages) in zip(to_parse.items(), scanned):
+        contents[key] = (m_olive, parsed, messages)
+    count(stats, 'olives_parsed', len(to_parse))
+    count(stats, 'olives_deduplicated', len(read) - len(to_parse))
+    parsed_olives = []
+    for position, m_olive in enumerate(olive_files):
+        if position in read:
+            key, olive_stat = read[position]
+            source, parsed, messages = contents[key]
+            parsed, messages = moved_olive(parsed, list(messages), source, m_olive)
+            if cache is not None and to_parse.get(key, (None,))[0] == m_olive:
+                cache.update(m_olive, parsed, messages, key[0], olive_stat)
+            elif cache is not None:
+                cache.add_shared(m_olive, parsed, messages, key[0], olive_stat)
+            results[position] = (parsed, messages)
+        parsed, messages = results[position]
+        for message in messages:
+            print(message)
+        parsed_olives.extend(parsed)
+    count(stats, 'olives', len(olive_files))
     return parsed_olives
@@ -1,32 +1,136 @@
 """
    This module provides functions for converting json to html and formatting
    it into a proper HTML page. All hardcoded stuff is here!
-   
+
    Note that we pass a number of errors which is instance-specific
+
+   The page is a fixed template written line by line straight into the output file, report data
+   comes in as a dict (no need to read it back from the .json report). With pretty=True lines of
+   the template are indented and broken, otherwise the page goes out without extra whitespace
+
+   For large reports the page may be sharded: data for each assay goes into a separate .json file
+   (optionally with a precompressed .json.gz copy) in a directory next to the page, and the page
+   carries only an index of assays, versions and references. Shards are fetched when an assay is selected
 """
 import datetime
+import gzip
+import hashlib
+import html
 import json
 import os.path
-from bs4 import BeautifulSoup as Bs
+from string import Template
+
+from configScanner import configScanner
+from outputWriter import atomic_open
+
+DATA_SLOT = "$data"
+SCRIPT_SLOT = "$script"
+PAGE_TEMPLATE = (
+    (0, "<!DOCTYPE html>"),
+    (0, "<html>"),
+    (0, "<head>"),
+    (1, "<meta charset=\"UTF-8\">"),
+    (1, "<title>Config Scanner</title>"),
+    (1, "<link rel=\"stylesheet\" href=\"css/config_scanner.css\">"),
+    (1, "<style>body { font-family: sans-serif; padding: 20px; } select { margin-bottom: 20px; } "
+        ".reference { font-weight: bold; color: #3366cc; } "
+        "pre { background: #f4f4f4; padding: 10px; border-radius: 8px; }</style>"),
+    (1, "<script type=\"text/javascript\">"),
+    (2, DATA_SLOT),
+    (1, "</script>"),
+    (0, "</head>"),
+    (0, "<body>"),
+    (1, "<h2>Select an Assay and version to list the enabled workflows for [ $instance ] shesmu</h2>"),
+    (1, "<label for=\"assay\">Assay:</label>"),
+    (1, "<select id=\"assay\"></select>"),
+    (1, "<label for=\"version\">Version:</label>"),
+    (1, "<select id=\"version\"></select>"),
+    (1, "<label for=\"reference\">Reference:</label>"),
+    (1, "<span id=\"reference\" class=\"reference-label\"></span>"),
+    (1, "<br>"),
+    (1, "<pre id=\"output\"></pre>"),
+    (1, "<script>"),
+    (0, SCRIPT_SLOT),
+    (1, "</script>"),
+    (1, "$updated"),
+    (1, "<br>"),
+    (1, "$log"),
+    (0, "</body>"),
+    (0, "</html>"),
+)
+PRETTY_INDENT = " "
+SHARD_DIR_SUFFIX = "_data"
+SHARD_INDEX = "index.json"
 
 """
-   Return JSON rendered into HTML table
+   Write HTML page for the report into an open file
 """
-def convert2page(input_data: str, script_path: str, instance: str, log_file: str, errors: int = 0):
-    html = ("<!DOCTYPE html><head><meta charset=\"UTF-8\"><title>Config Scanner</title> \
-            <link rel=\"stylesheet\" href=\"css/config_scanner.css\"> \
-            <style>body { font-family: sans-serif; padding: 20px; } select { margin-bottom: 20px; } \
-            .reference { font-weight: bold; color: #3366cc; } \
-            pre { background: #f4f4f4; padding: 10px; border-radius: 8px; }</style><script type=\"text/javascript\"> \
-            readJson = function() { return " + convert2datachunk(input_data) + "} </script> </head>" +
-            "<body><h2>Select an Assay and version to list the enabled workflows for [ " + instance + " ] shesmu</h2> \
-            <label for=\"assay\">Assay:</label><select id=\"assay\"> \
-            </select><label for=\"version\">Version:</label><select id=\"version\"></select> \
-            <label for=\"reference\">Reference:</label><span id=\"reference\" class=\"reference-label\"></span><br> \
-            <pre id=\"output\"></pre><script>" + append_script(script_path) + "</script>" + today_date() +
-            "<br>" + process_log(log_file, errors) + "</body></html>")
-    soup = Bs(html, "html.parser")
-    return soup.prettify()
+def render_page(out, report: dict, script_path: str, instance: str, log_file: str, errors: int = 0,
+                pretty: bool = False, shard_index: dict = None):
+    values = {'instance': html.escape(instance),
+              'updated': today_date(),
+              'log': process_log(log_file, errors)}
+    script_text = append_script(script_path)
+    for depth, line in PAGE_TEMPLATE:
+        if line == DATA_SLOT:
+            text = None
+        elif line == SCRIPT_SLOT:
+            text = script_text
+        else:
+            text = Template(line).safe_substitute(values) if "$" in line else line
+            if len(text) == 0:
+                continue
+        if pretty:
+            out.write(PRETTY_INDENT * depth)
+        if text is None:
+            if shard_index is None:
+                out.write("readJson = function() { return ")
+                out.write(convert2datachunk(report))
+                out.write("}")
+            else:
+                out.write("readJson = function() { return {}}; readShardIndex = function() { return ")
+                out.write(convert2datachunk(shard_index))
+                out.write("}")
+        else:
+            out.write(text)
+        if pretty:
+            out.write("\n")
+
+
+"""
+   Write data for each assay into a shard next to the page, return the index for the page:
+   {
+     base = directory with shards, relative to the page
+     assays = {assay: {reference, versions, shard}}
+   }
+   Shard names do not change between runs, shards which did not change are not rewritten and shards of assays
+   gone from the report are removed
+"""
+def write_shards(report: dict, page_path: str, compress: bool = False) -> dict:
+    shard_dir = os.path.splitext(page_path)[0] + SHARD_DIR_SUFFIX
+    os.makedirs(shard_dir, exist_ok=True)
+    shard_index = {'base': os.path.basename(shard_dir), 'assays': {}}
+    written = {SHARD_INDEX}
+    for assay in sorted(report.keys()):
+        shard_name = hashlib.sha256(assay.encode()).hexdigest()[:16] + ".json"
+        assay_data = {k: v for k, v in report[assay].items() if k != configScanner.REF_KEY}
+        shard_index['assays'][assay] = {'versions': sorted(assay_data.keys()), 'shard': shard_name}
+        if configScanner.REF_KEY in report[assay]:
+            shard_index['assays'][assay][configScanner.REF_KEY] = report[assay][configScanner.REF_KEY]
+        shard_text = json.dumps(assay_data, sort_keys=True, separators=(",", ":"))
+        with atomic_open(os.path.join(shard_dir, shard_name), "w", skip_unchanged=True) as shard:
+            shard.write(shard_text)
+        written.add(shard_name)
+        if compress:
+            with atomic_open(os.path.join(shard_dir, shard_name + ".gz"), "wb", skip_unchanged=True) as shard:
+                shard.write(gzip.compress(shard_text.encode(), mtime=0))
+            written.add(shard_name + ".gz")
+    for old_shard in os.listdir(shard_dir):
+        if old_shard not in written and (old_shard.endswith(".json") or old_shard.endswith(".json.gz")):
+            os.remove(os.path.join(shard_dir, old_shard))
+    with atomic_open(os.path.join(shard_dir, SHARD_INDEX), "w", skip_unchanged=True) as index_file:
+        json.dump(shard_index, index_file, sort_keys=True)
+    return shard_index
 
 
 """
@@ -39,17 +143,14 @@ def today_date() -> str:
 
 
 """
-   Using supplied data file path return html-compliant block
+   Return report data as a js-compliant block for embedding into a script element,
+   with keys sorted in the same way as in the .json report
 """
-def convert2datachunk(input_json: str) -> str:
+def convert2datachunk(report: dict) -> str:
     try:
-        with open(input_json, 'r') as inJson:
-            data_chunk = json.load(inJson)
-            return json.dumps(data_chunk)
-    except FileNotFoundError:
-        print(f'ERROR: Could not find file {input_json}')
-    except ValueError:
-        print('ERROR: Could not read JSON data')
+        return json.dumps(report, sort_keys=True).replace("</", "<\\/")
+    except (TypeError, ValueError):
+        print('ERROR: Could not convert report data into JSON')
     return "{}"
 
 
@@ -78,8 +179,128 @@ def process_log(path: str, errors: int):
     if path is None or not os.path.exists(path):
         return ""
 
+    link = "<a href=\"" + html.escape(path) + "\">See full Log</a>"
     '''Check the number of errors, alert if it is not zero'''
     if errors > 0:
-        return "Errors: " + str(errors) + "<br><br><a href=" + path + ">See full Log</a>"
+        return "Errors: " + str(errors) + "<br><br>" + link
     else:
-        return "<a href=" + path + ">See full Log</a>"
+        return link
+
+
+"""
+   Write HTML page for a timeline (see scanTimeline): a table of enabled workflow versions for each assay,
+   with commits where they got enabled and disabled
+"""
+def render_timeline(out, timeline: dict, pretty: bool = False):
+    commits = timeline['commits']
+    line_end = "\n" if pretty else ""
+    out.write("<!DOCTYPE html><html><head><meta charset=\"UTF-8\"><title>Config Scanner Timeline</title>" + line_end)
+    out.write("<link rel=\"stylesheet\" href=\"css/config_scanner.css\">" + line_end)
+    out.write("<style>body { font-family: sans-serif; padding: 20px; } td, th { padding: 2px 10px; text-align: left; } "
+              ".disabled { color: #999999; }</style></head><body>" + line_end)
+    out.write("<h2>Workflows enabled for [ " + html.escape(timeline['instance']) + " ] shesmu in "
+              + html.escape(timeline['range']) + ", " + str(len(commits)) + " commits</h2>" + line_end)
+    for assay in sorted(timeline['assays'].keys()):
+        out.write("<details><summary>" + html.escape(assay) + "</summary><table>" + line_end)
+        out.write("<tr><th>Version</th><th>Workflow</th><th>Workflow version</th><th>Enabled</th>"
+                  "<th>Disabled</th></tr>" + line_end)
+        versions = timeline['assays'][assay]
+        for version in sorted(versions.keys()):
+            for wf in sorted(versions[version].keys()):
+                for wf_version in sorted(versions[version][wf].keys()):
+                    for enabled, disabled in versions[version][wf][wf_version]:
+                        row_class = "" if disabled is None else " class=\"disabled\""
+                        out.write("<tr" + row_class + "><td>" + html.escape(version) + "</td><td>" + html.escape(wf)
+                                  + "</td><td>" + html.escape(wf_version) + "</td><td>"
+                                  + timeline_commit(commits[enabled]) + "</td><td>"
+                                  + (timeline_commit(commits[disabled]) if disabled is not None else "") + "</td></tr>"
+                                  + line_end)
+        out.write("</table></details>" + line_end)
+    out.write(today_date() + "</body></html>" + line_end)
+
+
+'''Short hash and date of a commit, with the subject as a tooltip'''
+def timeline_commit(commit: list) -> str:
+    commit_hash, commit_time, subject = commit
+    commit_date = datetime.datetime.fromtimestamp(commit_time, datetime.timezone.utc).strftime("%Y-%m-%d")
+    return ("<span title=\"" + html.escape(subject) + "\">" + html.escape(commit_hash[:12]) + " "
+            + commit_date + "</span>")
+
+
+"""
+   Write HTML summary page for changes since the last run (see scanChanges): config errors which are new or
+   resolved and tables of workflow changes for each instance and for staged config. At most max_rows rows
+   of each table go into the page, all of them are in the .json changes file
+"""
+def render_changes(out, changes: dict, pretty: bool = False, max_rows: int = 5000):
+    line_end = "\n" if pretty else ""
+    out.write("<!DOCTYPE html><html><head><meta charset=\"UTF-8\"><title>Config Scanner Changes</title>" + line_end)
+    out.write("<link rel=\"stylesheet\" href=\"css/config_scanner.css\">" + line_end)
+    out.write("<style>body { font-family: sans-serif; padding: 20px; } td, th { padding: 2px 10px; text-align: left; } "
+              ".added { color: #227722; } .removed { color: #aa2222; }</style></head><body>" + line_end)
+    out.write("<h2>Changes since the last run</h2>" + line_end)
+    sections = [("[ " + instance + " ] shesmu", instance_changes)
+                for instance, instance_changes in changes['instances'].items()]
+    if 'staged_config' in changes:
+        sections.append(("Staged config", changes['staged_config']))
+    for title, section in sections:
+        rows = section['workflows']
+        out.write("<h3>" + html.escape(title) + ": " + str(len(rows)) + " workflow changes</h3>" + line_end)
+        if not section['previous']:
+            out.write("<div>No output of the previous run to compare with</div>" + line_end)
+        for label, errors in (("New errors", section.get('new_errors', [])),
+                              ("Resolved errors", section.get('resolved_errors', []))):
+            if len(errors) > 0:
+                out.write("<details><summary>" + label + ": " + str(len(errors)) + "</summary><ul>"
+                          + "".join("<li>" + html.escape(error) + "</li>" for error in errors) + "</ul></details>"
+                          + line_end)
+        if len(rows) == 0:
+            continue
+        out.write("<table><tr><th>Assay</th><th>Version</th><th>Workflow</th><th>Change</th><th>Added versions</th>"
+                  "<th>Removed versions</th></tr>" + line_end)
+        for row in rows[:max_rows]:
+            out.write("<tr><td>" + html.escape(row['assay']) + "</td><td>" + html.escape(row['version'])
+                      + "</td><td>" + html.escape(row['workflow']) + "</td><td>" + row['change']
+                      + "</td><td class=\"added\">" + html.escape(", ".join(row['added']))
+                      + "</td><td class=\"removed\">" + html.escape(", ".join(row['removed'])) + "</td></tr>"
+                      + line_end)
+        out.write("</table>" + line_end)
+        if len(rows) > max_rows:
+            out.write("<div>" + str(len(rows) - max_rows) + " more changes are in the .json changes file</div>"
+                      + line_end)
+    out.write(today_date() + "</body></html>" + line_end)
+
+
+"""
+   Render the combined index of a run with several sites (see scanSites): a table of instances of each site
+   with links to their pages and .json reports, links are relative to base_dir (the directory of the page)
+"""
+def render_index(out, index: dict, base_dir: str, pretty: bool = False):
+    line_end = "\n" if pretty else ""
+    out.write("<!DOCTYPE html><html><head><meta charset=\"UTF-8\"><title>Config Scanner Sites</title>" + line_end)
+    out.write("<link rel=\"stylesheet\" href=\"css/config_scanner.css\">" + line_end)
+    out.write("<style>body { font-family: sans-serif; padding: 20px; } td, th { padding: 2px 10px; text-align: left; }"
+              "</style></head><body>" + line_end)
+    out.write("<h2>Sites</h2>" + line_end)
+    for site, site_entry in index['sites'].items():
+        out.write("<h3>" + html.escape(site) + "</h3>" + line_end)
+        out.write("<div>Olives: " + html.escape(str(site_entry['olive_dir'])) + ", assay config: "
+                  + html.escape(str(site_entry['assay_config'])) + "</div>" + line_end)
+        out.write("<table><tr><th>Instance</th><th>Assays</th><th>Page</th><th>Report</th></tr>" + line_end)
+        for instance, outputs in site_entry['instances'].items():
+            links = [index_link(outputs[output], base_dir) for output in ('page', 'report')]
+            out.write("<tr><td>" + html.escape(instance) + "</td><td>" + str(outputs['assays']) + "</td><td>"
+                      + "</td><td>".join(links) + "</td></tr>" + line_end)
+        out.write("</table>" + line_end)
+        if site_entry['staged_config'] is not None:
+            out.write("<div>Staged config: " + index_link(site_entry['staged_config'], base_dir) + "</div>"
+                      + line_end)
+    out.write(today_date() + "</body></html>" + line_end)
+
+
+'''Return a link to an output file relative to base_dir, or an empty string if the file was not written'''
+def index_link(path: str, base_dir: str) -> str:
+    if path is None:
+        return ""
+    link = os.path.relpath(os.path.abspath(path), base_dir)
+    return "<a href=\"" + html.escape(link) + "\">" + html.escape(os.path.basename(path)) + "</a>"
@@ -1,4 +1,7 @@
     const data = readJson()
+    // Sharded pages have an index of assays, data for an assay is fetched when it is selected
+    const shardIndex = typeof readShardIndex === "function" ? readShardIndex() : null
+    const pendingShards = {};
 
     const sectionDropdown = document.getElementById("assay");
     const versionDropdown = document.getElementById("version");
@@ -6,17 +9,42 @@
     const output = document.getElementById("output");
 
     // Populate sections
-    Object.keys(data).forEach(sec => {
+    Object.keys(shardIndex ? shardIndex.assays : data).forEach(sec => {
       const opt = document.createElement("option");
       opt.value = sec;
       opt.textContent = sec;
       sectionDropdown.appendChild(opt);
     });
 
+    // Return data for a section, fetch its shard first if we do not have it yet
+    function loadSection(section) {
+      if (!shardIndex || section in data) {
+        return Promise.resolve(data[section]);
+      }
+      if (!(section in pendingShards)) {
+        pendingShards[section] = fetch(shardIndex.base + "/" + shardIndex.assays[section].shard)
+          .then(response => {
+            if (!response.ok) {
+              throw new Error(response.statusText);
+            }
+            return response.json();
+          })
+          .then(shard => {
+            data[section] = shard;
+            return shard;
+          })
+          .catch(error => {
+            delete pendingShards[section];
+            throw error;
+          });
+      }
+      return pendingShards[section];
+    }
+
     // Update versions when section changes
     function updateVersions() {
       const section = sectionDropdown.value;
-      const sectionData = data[section];
+      const sectionData = shardIndex ? shardIndex.assays[section] : data[section];
       
       reference.textContent = sectionData["reference"] || "Not set";
 
@@ -24,9 +52,8 @@
 
       // Show value
       // 
-      Object.keys(sectionData)
-        .filter(k => k !== "reference")
-        .forEach(ver => {
+      const versions = shardIndex ? sectionData.versions : Object.keys(sectionData).filter(k => k !== "reference");
+      versions.forEach(ver => {
           const opt = document.createElement("option");
           opt.value = ver;
           opt.textContent = ver;
@@ -41,8 +68,18 @@
     function updateOutput() {
       const section = sectionDropdown.value;
       const version = versionDropdown.value;
-      const jsonPretty = JSON.stringify(data[section][version], null, 2);
-      output.textContent = jsonPretty.replace(/\[\s+([\s\S]*?)\s+\]/g, m =>m.replace(/\s+/g, '').replace(/,\]/, ']'))
+      loadSection(section)
+        .then(sectionData => {
+          // Selection may have changed while the shard was loading
+          if (section !== sectionDropdown.value || version !== versionDropdown.value) {
+            return;
+          }
+          const jsonPretty = JSON.stringify(sectionData[version], null, 2);
+          output.textContent = jsonPretty.replace(/\[\s+([\s\S]*?)\s+\]/g, m =>m.replace(/\s+/g, '').replace(/,\]/, ']'))
+        })
+        .catch(error => {
+          output.textContent = "Could not load data for " + section + ": " + error.message;
+        });
     }
 
     // Event listeners
@@ -50,5 +87,5 @@
     versionDropdown.addEventListener("change", updateOutput);
 
     // Initialize
-    sectionDropdown.value = Object.keys(data)[0];
+    sectionDropdown.value = Object.keys(shardIndex ? shardIndex.assays : data)[0];
     updateVersions();
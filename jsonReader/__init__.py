@@ -0,0 +1,170 @@
+"""
+   Streaming reader for assay_info.jsonconfig (and staged .jsonconfig files), the counterpart of jsonWriter.
+   json.load needs the whole text of the file in memory next to the data parsed from it, here the file is read
+   in chunks and assay entries of "values" are parsed one at a time, so only the text of the entry being parsed
+   is held. Parsed entries are made compact as they come:
+
+   * strings (assays, versions, workflows, workflow versions) are interned, each one is kept once
+   * lists of workflow versions which are the same are one shared list (nothing changes these lists in place,
+     staged config replaces them, see configScanner.staged_workflows)
+
+   The result is what json.load gives for the file (or for its "values" if it has them)
+"""
+import json
+import sys
+
+CHUNK_SIZE = 1 << 20
+VALUES_KEY = "values"
+VERSIONS_KEY = "versions"
+WORKFLOWS_KEY = "workflows"
+SPACE = " \t\n\r"
+DECODER = json.JSONDecoder()
+
+
+class jsonInput:
+    """
+       Text of a file which we read in chunks. Text before pos is parsed already and is dropped when
+       the next chunk comes in
+    """
+    def __init__(self, source, chunk_size: int = CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    '''Read the next chunk, at least as much as we hold (so that values longer than a chunk take linear time)'''
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.source.read(max(self.chunk_size, len(self.text) - self.pos))
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        self.eof = len(chunk) == 0
+        return not self.eof
+
+    '''Return the next character which is not whitespace (None at the end of the file), without taking it'''
+    def peek(self):
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in SPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, expected: str) -> str:
+        found = self.peek()
+        if found is None or found not in expected:
+            raise json.JSONDecodeError(f"Expecting one of '{expected}'", self.text, self.pos)
+        self.pos += 1
+        return found
+
+    """
+       Parse the next value. A value which ends right at the end of the text we have may go on in the next
+       chunk (a number), so it is parsed again with more text
+    """
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                parsed, end = DECODER.raw_decode(self.text, self.pos)
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return parsed
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    """
+       Go over keys of an object, the caller takes the value of each key (with value() or by going over
+       its keys) before asking for the next one
+    """
+    def keys(self):
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise json.JSONDecodeError("Expecting a key", self.text, self.pos)
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+
+"""
+   Make parsed data compact: strings are interned, lists of strings which are the same are shared (shared holds
+   them, by their content)
+"""
+def compact(value, shared: dict):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(k): compact(v, shared) for k, v in value.items()}
+    if isinstance(value, list):
+        if all(isinstance(v, str) for v in value):
+            return shared.setdefault(tuple(value), [sys.intern(v) for v in value])
+        return [compact(v, shared) for v in value]
+    return value
+
+
+"""
+   Make an assay entry compact. Entries come as {reference, versions: {version: {workflows: {workflow: versions}}}},
+   cells of this shape are walked directly (most of the data is there), everything else goes through compact()
+"""
+def compact_entry(entry, shared: dict):
+    if not isinstance(entry, dict) or not isinstance(entry.get(VERSIONS_KEY), dict):
+        return compact(entry, shared)
+    compacted = {}
+    for key, value in entry.items():
+        if key != VERSIONS_KEY:
+            compacted[sys.intern(key)] = compact(value, shared)
+            continue
+        cells = {}
+        for version, cell in value.items():
+            workflows = cell.get(WORKFLOWS_KEY) if isinstance(cell, dict) and len(cell) == 1 else None
+            if not isinstance(workflows, dict):
+                cells[sys.intern(version)] = compact(cell, shared)
+                continue
+            compacted_workflows = {}
+            for wf, wf_versions in workflows.items():
+                '''Lists of strings we have seen are looked up without making them compact again, other lists
+                   (with lists or dicts in them) cannot be keys and are never shared'''
+                known = shared.get(tuple(wf_versions)) \
+                    if type(wf_versions) is list and all(isinstance(v, str) for v in wf_versions) else None
+                compacted_workflows[sys.intern(wf)] = known if known is not None else compact(wf_versions, shared)
+            cells[sys.intern(version)] = {WORKFLOWS_KEY: compacted_workflows}
+        compacted[VERSIONS_KEY] = cells
+    return compacted
+
+
+"""
+   Read a .jsonconfig file from an open text file, return "values" if the file has them (everything otherwise).
+   Raises json.JSONDecodeError if the file is not valid JSON
+"""
+def read_values(source, chunk_size: int = CHUNK_SIZE):
+    stream = jsonInput(source, chunk_size)
+    shared = {}
+    if stream.peek() != "{":
+        data = compact(stream.value(), shared)
+    else:
+        data = {}
+        values = None
+        for key in stream.keys():
+            if key == VALUES_KEY and stream.peek() == "{":
+                values = {}
+                for assay in stream.keys():
+                    values[sys.intern(assay)] = compact_entry(stream.value(), shared)
+            elif key == VALUES_KEY:
+                values = compact(stream.value(), shared)
+            else:
+                data[sys.intern(key)] = compact_entry(stream.value(), shared)
+        if values is not None:
+            data = values
+    if stream.peek() is not None:
+        raise json.JSONDecodeError("Extra data", stream.text, stream.pos)
+    return data
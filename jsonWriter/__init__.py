@@ -0,0 +1,187 @@
+"""
+   Streaming writer for .json reports and staged .jsonconfig files. The layout is the one we used to get
+   with json.dumps(indent=2) followed by a few regex clean-up passes (version arrays inline, strings ending
+   with a digit glued to what comes next, a newline after reference entries) but it is produced directly,
+   in one pass over the data and without building the whole document as a string.
+
+   Dicts are written sorted by key (as deepsort_dict does it, not descending into lists)
+"""
+import json
+from json.encoder import encode_basestring
+
+INDENT = "  "
+REPORT = "report"
+CONFIG = "config"
+FLUSH_PIECES = 4096
+
+
+class jsonOutput:
+    """
+       Buffer pieces of the document and write them out in batches. If we have a reference key,
+       text after it is held until we can tell where the reference entry ends and a newline goes in
+    """
+    def __init__(self, out, ref_key: str = None):
+        self.out = out
+        self.ref_key = ref_key
+        self.pieces = []
+        self.held = None
+
+    def write(self, piece: str):
+        if self.held is None:
+            if self.ref_key is None or self.ref_key not in piece:
+                self.pieces.append(piece)
+                if len(self.pieces) >= FLUSH_PIECES:
+                    self.flush()
+                return
+            self.held = piece
+        else:
+            self.held += piece
+        if reference_complete(self.held, self.ref_key):
+            self.release()
+
+    def release(self):
+        self.pieces.append(break_after_reference(self.held, self.ref_key))
+        self.held = None
+
+    def flush(self):
+        self.out.write("".join(self.pieces))
+        self.pieces = []
+
+    def close(self):
+        if self.held is not None:
+            self.release()
+        self.flush()
+
+
+"""
+   Write data into an open file, layout is REPORT (.json report) or CONFIG (staged .jsonconfig)
+"""
+def write_json(data, out, layout: str = REPORT, ref_key: str = None):
+    output = jsonOutput(out, ref_key)
+    write_value(output, data, 0, layout, True)
+    output.close()
+
+
+"""
+   Write a value, return the encoded string if the value is a str (separators after strings depend on it)
+"""
+def write_value(output: jsonOutput, value, level: int, layout: str, sort: bool):
+    if isinstance(value, str):
+        token = encode_string(value)
+        output.write(token)
+        return token
+    if isinstance(value, dict):
+        items = sorted(value.items(), key=lambda item: item[0]) if sort else value.items()
+        write_container(output, "{", "}", items, level, layout, sort)
+    elif isinstance(value, (list, tuple)):
+        write_container(output, "[", "]", value, level, layout, False)
+    else:
+        output.write(json.dumps(value))
+    return None
+
+
+"""
+   Write a dict (items are key, value pairs) or a list. Arrays start right after the opening bracket
+"""
+def write_container(output: jsonOutput, opener: str, closer: str, items, level: int, layout: str, sort: bool):
+    inner = INDENT * (level + 1)
+    output.write(opener)
+    token = None
+    first = True
+    for item in items:
+        if first:
+            output.write("" if opener == "[" else "\n" + inner)
+            first = False
+        else:
+            output.write("," + gap(token, False, layout, inner))
+        if opener == "{":
+            output.write(encode_string(item[0] if isinstance(item[0], str) else json.dumps(item[0])))
+            output.write(": ")
+            item = item[1]
+        token = write_value(output, item, level + 1, layout, sort)
+    if not first:
+        output.write(gap(token, True, layout, INDENT * level))
+    output.write(closer)
+
+
+"""
+   Whitespace after an item: nothing after strings ending with a digit if this is the last item,
+   after other items ending with a digit it depends on the layout (see module docstring)
+"""
+def gap(token, last: bool, layout: str, indent: str) -> str:
+    if token is not None and token[-2].isdecimal():
+        if last or layout == REPORT or token[-3] == ".":
+            return ""
+        return indent
+    return "\n" + indent
+
+
+"""
+   Encode a string, whitespace following an opening bracket is dropped (as it is for arrays)
+"""
+def encode_string(value: str) -> str:
+    token = encode_basestring(value)
+    if "[" not in token:
+        return token
+    encoded = []
+    skip = False
+    for ch in token:
+        if skip and ch.isspace():
+            continue
+        skip = ch == "["
+        encoded.append(ch)
+    return "".join(encoded)
+
+
+"""
+   Check if held text goes far enough past the last reference key to see where the entry ends:
+   the key, the rest of its token, whitespace and the next token followed by whitespace
+"""
+def reference_complete(text: str, ref_key: str) -> bool:
+    start = text.rfind(ref_key) + len(ref_key)
+    end = skip_run(text, start, False)
+    if end == len(text):
+        return False
+    if end == start:
+        return True
+    end = skip_run(text, end, True)
+    if end == len(text):
+        return False
+    return skip_run(text, end, False) < len(text)
+
+
+"""
+   Put a newline after the reference entry, i.e. after the last string ending with a digit (followed
+   by a comma) in the token which comes after the reference key
+"""
+def break_after_reference(text: str, ref_key: str) -> str:
+    broken = []
+    pos = 0
+    found = text.find(ref_key)
+    while found >= 0:
+        key_end = found + len(ref_key)
+        ws_start = skip_run(text, key_end, False)
+        next_start = skip_run(text, ws_start, True)
+        next_end = skip_run(text, next_start, False)
+        entry_end = -1
+        if ws_start > key_end and next_start > ws_start:
+            for k in range(next_end - 3, next_start, -1):
+                if text[k].isdecimal() and text[k + 1:k + 3] == '",':
+                    entry_end = k + 3
+                    break
+        if entry_end < 0:
+            found = text.find(ref_key, found + 1)
+            continue
+        broken.append(text[pos:entry_end])
+        broken.append("\n")
+        pos = entry_end
+        found = text.find(ref_key, entry_end)
+    broken.append(text[pos:])
+    return "".join(broken)
+
+
+'''Return position of the first character after a run of whitespace (or non-whitespace) characters'''
+def skip_run(text: str, pos: int, space: bool) -> int:
+    while pos < len(text) and text[pos].isspace() == space:
+        pos += 1
+    return pos
@@ -0,0 +1,156 @@
+"""
+   Persistent cache of parsed olives. Olives rarely change between scheduled runs, so we keep
+   tags, names and checks of olive blocks for each olive file in a .json file and skip parsing for unchanged files.
+
+   An entry is keyed by the olive path and validated by mtime/size (fast path, no read needed)
+   or, if these changed, by the hash of the content. The whole cache is dropped when check
+   patterns from settings change, and the number of entries is capped (least recently used go first).
+   Olives are also found by their content hash, so copies of an olive in other repositories are not parsed again
+"""
+import json
+import os
+from json import JSONDecodeError
+
+from gsiOlive import oliveRecord
+from outputWriter import atomic_open
+
+CACHE_FORMAT = 5
+
+
+class oliveCache:
+
+    def __init__(self, path: str, check_pattern: str, max_entries: int = 10000):
+        self.path = path
+        self.check_pattern = check_pattern
+        self.max_entries = max_entries
+        self.entries = {}
+        self.run = 0
+        self.hits = 0
+        self.misses = 0
+        self.hashes = None
+        self.load()
+
+    """
+       Load cached entries, if the cache was built with the same check pattern
+    """
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as cache_file:
+                cache_data = json.load(cache_file)
+        except (OSError, JSONDecodeError):
+            print(f"WARNING: Olive cache {self.path} could not be loaded, starting with an empty cache")
+            return
+        if not isinstance(cache_data, dict) or cache_data.get('format') != CACHE_FORMAT:
+            print(f"INFO: Olive cache {self.path} has an outdated format, starting with an empty cache")
+            return
+        if cache_data.get('pattern') != self.check_pattern:
+            print("INFO: Check pattern has changed, olive cache is invalidated")
+            return
+        self.run = cache_data.get('run', 0) + 1
+        self.entries = cache_data.get('olives', {})
+        print(f"INFO: Loaded {len(self.entries)} cached olives from {self.path}")
+
+    """
+       Return parsed olive data and its messages if the olive did not change (same mtime and size),
+       None otherwise. This does not read the olive
+    """
+    def lookup(self, m_olive: str):
+        entry = self.entries.get(m_olive)
+        if entry is None:
+            return None
+        try:
+            olive_stat = os.stat(m_olive)
+        except OSError:
+            return None
+        if entry['mtime'] == olive_stat.st_mtime_ns and entry['size'] == olive_stat.st_size:
+            self.hits += 1
+            return self.replay(m_olive, entry)
+        return None
+
+    '''Return content hash of the olive as we saw it last time'''
+    def known_hash(self, m_olive: str):
+        entry = self.entries.get(m_olive)
+        return entry['hash'] if entry is not None else None
+
+    """
+       Register the result of gsiOlive.scan_olive. If parsing was skipped because the content hash
+       did not change, return the cached data. Unreadable olives are not cached
+    """
+    def update(self, m_olive: str, parsed, messages: list, digest: str, olive_stat) -> tuple:
+        if parsed is None and m_olive in self.entries:
+            entry = self.entries[m_olive]
+            entry['mtime'], entry['size'] = olive_stat if olive_stat else (0, 0)
+            self.hits += 1
+            return self.replay(m_olive, entry)
+        self.misses += 1
+        return self.add(m_olive, parsed, messages, digest, olive_stat)
+
+    '''Add parsed data of an olive to the cache (unless we could not read it and have no hash)'''
+    def add(self, m_olive: str, parsed, messages: list, digest: str, olive_stat) -> tuple:
+        if digest is None:
+            return parsed, messages
+        self.entries[m_olive] = {'mtime': olive_stat[0] if olive_stat else 0,
+                                 'size': olive_stat[1] if olive_stat else 0,
+                                 'hash': digest,
+                                 'used': self.run,
+                                 'blocks': [{'block': record.block,
+                                             'tags': sorted(record.tags),
+                                             'names': sorted(record.names),
+                                             'checks': [[c.workflow, c.version, c.pattern] for c in record.checks]}
+                                            for record in parsed],
+                                 'messages': messages}
+        if self.hashes is not None:
+            self.hashes[digest] = m_olive
+        return parsed, messages
+
+    """
+       Add an olive with the same content as an olive parsed in this run or found in the cache under another path
+       (see find_hash). It was not parsed, so it counts as a hit
+    """
+    def add_shared(self, m_olive: str, parsed, messages: list, digest: str, olive_stat) -> tuple:
+        self.hits += 1
+        return self.add(m_olive, parsed, messages, digest, olive_stat)
+
+    """
+       Return an olive we have in the cache with this content hash (it may be another copy of an olive, i.e. in
+       another repository), None if we do not have it
+    """
+    def find_hash(self, digest: str):
+        if self.hashes is None:
+            self.hashes = {entry['hash']: m_olive for m_olive, entry in self.entries.items()}
+        m_olive = self.hashes.get(digest)
+        '''The olive may have changed (or be evicted) since, then its entry is not what we look for'''
+        if m_olive is None or self.entries.get(m_olive, {}).get('hash') != digest:
+            return None
+        return m_olive
+
+    """
+       Re-create parsed olive data (records of olive blocks) from a cache entry, together with the messages
+       we got when parsing it. Hits are counted by callers, for olives of the run
+    """
+    def replay(self, m_olive: str, entry: dict) -> tuple:
+        entry['used'] = self.run
+        return [oliveRecord([m_olive], block['tags'], block['checks'], block['names'], block['block'])
+                for block in entry['blocks']], list(entry['messages'])
+
+    """
+       Evict least recently used entries if we are over the limit and write the cache
+    """
+    def save(self):
+        if self.path is None:
+            return
+        if len(self.entries) > self.max_entries:
+            by_use = sorted(self.entries.items(), key=lambda item: item[1]['used'], reverse=True)
+            self.entries = dict(by_use[:self.max_entries])
+        cache_data = {'format': CACHE_FORMAT,
+                      'pattern': self.check_pattern,
+                      'run': self.run,
+                      'olives': self.entries}
+        try:
+            with atomic_open(self.path, "w") as cache_file:
+                json.dump(cache_data, cache_file)
+            print(f"INFO: Olive cache: {self.hits} hits, {self.misses} parsed, saved into {self.path}")
+        except OSError:
+            print(f"ERROR: writing olive cache {self.path} failed")
@@ -0,0 +1,175 @@
+"""
+   Output files (reports, HTML pages, staged config) are read by web servers and other scripts while we
+   may be rewriting them, so they are written into a temporary file in the same directory and renamed
+   over the old file when complete. Readers see either the old or the new file, never a partial one
+
+   Files which come out the same as they are on disk are not replaced (with skip_unchanged), so their
+   modification time stays and rsync or web caches downstream have nothing to do. Published outputs
+   (see publish) are also listed in a manifest in their directory, MANIFEST_NAME:
+   {
+     format  = MANIFEST_FORMAT
+     updated = time of the last change of any file in the manifest
+     files   = {file name: {sha256, size, mtime_ns, changed (time of the last change of the file)}}
+   }
+   Downstream consumers may poll this one file instead of checking every output. The manifest is updated
+   under a lock (where we have fcntl), so scans of instances in worker processes may publish at the same time.
+   The lock is held on the manifest file itself, no lock file is left next to published outputs
+"""
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+'''Permissions for new files as open() would give us, mkstemp makes files readable only by the owner'''
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+MANIFEST_NAME = "scan_manifest.json"
+MANIFEST_FORMAT = 1
+HASH_BLOCK = 1 << 20
+
+
+'''Return sha256 of a file content, None if we cannot read it'''
+def file_hash(path: str):
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as hashed_file:
+            for block in iter(lambda: hashed_file.read(HASH_BLOCK), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+"""
+   Return True if the file at path has the same content as the new file at new_path (with new_hash).
+   Files of a different size differ, the hash of the old file comes from its manifest entry if the file
+   was not touched since it was recorded
+"""
+def same_content(path: str, new_path: str, new_hash: str, entry: dict = None) -> bool:
+    try:
+        old_stat = os.stat(path)
+    except OSError:
+        return False
+    if old_stat.st_size != os.stat(new_path).st_size:
+        return False
+    if entry is not None and entry.get('size') == old_stat.st_size and entry.get('mtime_ns') == old_stat.st_mtime_ns:
+        return entry.get('sha256') == new_hash
+    return file_hash(path) == new_hash
+
+
+class outputManifest:
+
+    """
+       Manifest of published files in a directory
+    """
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self.manifest = {}
+
+    """
+       Hold the lock on the manifest (and files it lists) while we compare, replace and record a file. The lock
+       is on the manifest file (an empty one is created if there is none, load takes it as an empty manifest).
+       Saving the manifest replaces the file, so a process which waited for the lock on the replaced file
+       opens the new one and waits again
+    """
+    @contextlib.contextmanager
+    def lock(self):
+        if fcntl is None:
+            yield
+            return
+        while True:
+            with open(self.path, "a") as manifest_file:
+                fcntl.flock(manifest_file, fcntl.LOCK_EX)
+                try:
+                    if not os.path.samestat(os.fstat(manifest_file.fileno()), os.stat(self.path)):
+                        continue
+                except FileNotFoundError:
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(manifest_file, fcntl.LOCK_UN)
+                return
+
+    def load(self):
+        self.manifest = {'format': MANIFEST_FORMAT, 'updated': None, 'files': {}}
+        try:
+            with open(self.path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            if isinstance(manifest, dict) and manifest.get('format') == MANIFEST_FORMAT:
+                self.manifest = manifest
+        except (OSError, ValueError):
+            pass
+
+    def get_entry(self, name: str):
+        return self.manifest['files'].get(name)
+
+    '''Record a file, changed tells if its content changed (or it was not in the manifest before)'''
+    def record(self, name: str, sha256: str, path: str, changed: bool):
+        file_stat = os.stat(path)
+        entry = self.manifest['files'].get(name, {})
+        now = time.time()
+        self.manifest['files'][name] = {'sha256': sha256,
+                                        'size': file_stat.st_size,
+                                        'mtime_ns': file_stat.st_mtime_ns,
+                                        'changed': now if changed or 'changed' not in entry else entry['changed']}
+        if changed:
+            self.manifest['updated'] = now
+
+    def save(self):
+        with atomic_open(self.path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, sort_keys=True, indent=1)
+
+
+"""
+   Open a file for writing, it replaces the file at path only if writing finished without errors.
+   With skip_unchanged the file is not replaced if it has the same content, with manifest (an outputManifest
+   of the directory) the file is recorded in the manifest
+"""
+@contextlib.contextmanager
+def atomic_open(path: str, mode: str = "w", skip_unchanged: bool = False, manifest: outputManifest = None):
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as out:
+            yield out
+        os.chmod(tmp_path, FILE_MODE)
+        if not skip_unchanged and manifest is None:
+            os.replace(tmp_path, path)
+            return
+        new_hash = file_hash(tmp_path)
+        with manifest.lock() if manifest is not None else contextlib.nullcontext():
+            entry = None
+            if manifest is not None:
+                manifest.load()
+                entry = manifest.get_entry(name)
+            unchanged = skip_unchanged and same_content(path, tmp_path, new_hash, entry)
+            if unchanged:
+                os.remove(tmp_path)
+                if manifest is not None:
+                    print(f"INFO: {path} is unchanged, not rewritten")
+            else:
+                os.replace(tmp_path, path)
+            if manifest is not None and (not unchanged or entry is None or entry.get('sha256') != new_hash):
+                manifest.record(name, new_hash, path, not unchanged or entry is None)
+                manifest.save()
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+"""
+   Open an output file for publishing: it is written atomically, is not replaced if its content did not
+   change and is listed in the manifest of its directory
+"""
+def publish(path: str, mode: str = "w"):
+    return atomic_open(path, mode, True, outputManifest(os.path.dirname(os.path.abspath(path))))
@@ -0,0 +1,139 @@
+"""
+   Small local HTTP service answering queries over the workflow index (see workflowIndex) with JSON.
+   The index is kept in memory and is rebuilt only when report files change (i.e. after a scheduled or
+   a --watch run of the scanner), so responses do not need a scan or even reading reports:
+
+   GET /workflows                       names of all workflows
+   GET /workflows/<workflow>            rows for a workflow, filtered by query parameters version (a version
+                                        or a range), reference, instance and assay
+   GET /find                            rows, the same as above with workflow as a query parameter (optional)
+   GET /assays                          names of all assays (reference may be given)
+   GET /assays/<assay>                  workflows of an assay (instance and version may be given)
+   GET /health                          instances, reports and the time the index was built
+
+   Errors come as {"error": message} with 400 (bad query) or 404 (unknown path or assay)
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from workflowIndex import workflowIndex
+
+FIND_PARAMETERS = ("workflow", "version", "reference", "instance", "assay")
+
+
+class reportSource:
+
+    """
+       Index over .json reports (instance: path), rebuilt when any of the files changes. Reports are written
+       by renaming a complete file over the old one, so a change of inode, size or mtime means a new report
+    """
+    def __init__(self, report_files: dict):
+        self.report_files = report_files
+        self.lock = threading.Lock()
+        self.signature = None
+        self.index = None
+        self.built = None
+
+    def file_signature(self) -> tuple:
+        signature = []
+        for path in self.report_files.values():
+            try:
+                file_stat = os.stat(path)
+                signature.append((file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    '''Return the current index, rebuild it if reports changed since it was built'''
+    def get_index(self) -> workflowIndex:
+        signature = self.file_signature()
+        with self.lock:
+            if self.index is None or signature != self.signature:
+                self.index = workflowIndex.from_files(self.report_files)
+                self.signature = signature
+                self.built = time.time()
+                print(f"INFO: Built workflow index for {len(self.index.get_instances())} instances, "
+                      f"{len(self.index.get_workflows())} workflows")
+            return self.index
+
+    def get_health(self) -> dict:
+        index = self.get_index()
+        return {'instances': index.get_instances(),
+                'reports': self.report_files,
+                'built': self.built}
+
+
+class queryHandler(BaseHTTPRequestHandler):
+    '''Set for the server class in serve()'''
+    source = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            status, body = self.answer(path, query)
+        except ValueError as error:
+            status, body = 400, {'error': str(error)}
+        data = json.dumps(body, separators=(",", ":")).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    '''Return (HTTP status, body) for a request path (a list of parts) and query parameters'''
+    def answer(self, path: list, query: dict) -> tuple:
+        if path == ["health"]:
+            return 200, self.source.get_health()
+        index = self.source.get_index()
+        if path == ["workflows"]:
+            return 200, index.get_workflows()
+        if len(path) == 2 and path[0] == "workflows":
+            return 200, index.find(path[1], **find_parameters(query, ("workflow",)))
+        if path == ["find"]:
+            return 200, index.find(**find_parameters(query))
+        if path == ["assays"]:
+            return 200, index.get_assays(query.get("reference"))
+        if len(path) == 2 and path[0] == "assays":
+            workflows = index.assay_workflows(path[1], query.get("instance"), query.get("version"))
+            if workflows is None:
+                return 404, {'error': f"Unknown assay {path[1]}"}
+            return 200, workflows
+        return 404, {'error': f"Unknown path {self.path}"}
+
+    '''Requests are printed in our usual format, not into stderr'''
+    def log_message(self, message_format, *message_args):
+        print(f"INFO: {self.address_string()} {message_format % message_args}")
+
+
+"""
+   Return find() arguments from query parameters (without those we take from the path),
+   unknown parameters are an error
+"""
+def find_parameters(query: dict, from_path: tuple = ()) -> dict:
+    unknown = [key for key in query if key not in FIND_PARAMETERS or key in from_path]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown query parameters: {', '.join(sorted(unknown))}")
+    return dict(query)
+
+
+"""
+   Serve queries over reports until interrupted. The index is built before the first request
+"""
+def serve(report_files: dict, host: str, port: int):
+    source = reportSource(report_files)
+    source.get_index()
+    handler = type("reportQueryHandler", (queryHandler,), {'source': source})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"INFO: Serving workflow queries on http://{host}:{server.server_port}, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("INFO: Stopped serving queries")
+    finally:
+        server.server_close()
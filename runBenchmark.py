@@ -0,0 +1,105 @@
+"""
+   Benchmark the scanner on synthetic inputs: generate olives and assay config at a given scale,
+   time each stage of the scan and write results into a .json file. With a baseline (results of an
+   earlier run) stages which got slower are reported and the script exits with a non-zero code.
+   With --startup, startup and runs of the scanner as a separate process (i.e. with --only) are timed too,
+   with --engines matching of olives to assay versions with the set index and with the NumPy matrix,
+   with --memory peak memory of loading and saving assay config ten times larger than the generated one,
+   with --sites scans of several sites (forks of the generated olives) in separate runs and in one run
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import benchmark
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time stages of the scanner on synthetic inputs')
+    parser.add_argument('--olives', help="Number of olives per instance", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['olives'])
+    parser.add_argument('--assays', help="Number of assays in assay_info", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['assays'])
+    parser.add_argument('--versions', help="Max number of versions per assay", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['versions'])
+    parser.add_argument('--workflows', help="Number of distinct workflows", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['workflows'])
+    parser.add_argument('--patterns', help="Number of check patterns in settings", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['patterns'])
+    parser.add_argument('--seed', help="Seed for generating inputs", type=int, required=False,
+                        default=benchmark.DEFAULT_PARAMETERS['seed'])
+    parser.add_argument('--repeat', help="Number of timed runs", type=int, required=False, default=3)
+    parser.add_argument('-w', '--work-dir', help="Directory for inputs and outputs (a temporary directory is "
+                        "used and removed by default)", required=False)
+    parser.add_argument('-j', '--jscript', help="Path UI js", required=False, default=benchmark.JAVA_SCRIPT)
+    parser.add_argument('-o', '--output', help="Results file", required=False, default="benchmark_results.json")
+    parser.add_argument('-b', '--baseline', help="Results of an earlier run to compare with", required=False)
+    parser.add_argument('--startup', help="Also time startup: import and runs of the scanner in a new process, "
+                        "with --only config, json, html and with all outputs", action='store_true', required=False)
+    parser.add_argument('--engines', help="Also time matching olives to assay versions with each engine (index, "
+                        "and matrix if NumPy is installed)", action='store_true', required=False)
+    parser.add_argument('--memory', help="Also measure peak memory of loading assay config 10 times larger than the "
+                        "generated one (json.load, load_config and load_config with save_config)",
+                        action='store_true', required=False)
+    parser.add_argument('--sites', help="Also time scans of this many sites (forks of generated olives) as separate "
+                        "runs and as one run with all sites", type=int, required=False, default=0)
+    parser.add_argument('--tolerance', help="Allowed slowdown against the baseline (0.2 is 20%%)", type=float,
+                        required=False, default=0.2)
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        print("ERROR: Number of runs should be at least 1")
+        exit(1)
+    if not os.path.isfile(args.jscript):
+        print(f"ERROR: Java script {args.jscript} does not exist")
+        exit(1)
+
+    parameters = {'olives': args.olives, 'assays': args.assays, 'versions': args.versions,
+                  'workflows': args.workflows, 'patterns': args.patterns, 'seed': args.seed, 'repeat': args.repeat}
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix="configScanner_benchmark_")
+    try:
+        print(f"INFO: Generating inputs in {work_dir}")
+        settings_path = benchmark.generate_inputs(work_dir, args.olives, args.assays, args.versions, args.workflows,
+                                                  args.seed, args.patterns)
+        output_dir = os.path.join(work_dir, "outputs")
+        os.makedirs(output_dir, exist_ok=True)
+        print(f"INFO: Timing {args.repeat} runs")
+        timings = benchmark.time_stages(settings_path, output_dir, args.repeat, args.jscript)
+        if args.startup:
+            print("INFO: Timing startup")
+            timings.update(benchmark.time_startup(settings_path, output_dir, args.repeat, args.jscript))
+        if args.engines:
+            print("INFO: Timing engines")
+            timings.update(benchmark.time_engines(settings_path, args.repeat))
+        if args.memory:
+            print("INFO: Measuring peak memory")
+            timings.update(benchmark.time_memory(work_dir, args.assays, args.versions, args.workflows, args.seed,
+                                                 args.repeat))
+        if args.sites > 0:
+            print(f"INFO: Timing scans of {args.sites} sites")
+            batch_path, site_paths = benchmark.generate_sites(work_dir, args.sites)
+            timings.update(benchmark.time_sites(batch_path, site_paths, output_dir, args.repeat, args.jscript))
+        results = benchmark.summarize(timings, parameters)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f"INFO: Saved results into {args.output}")
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, "r") as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, json.JSONDecodeError):
+            print(f"ERROR: Could not load baseline from {args.baseline}")
+            exit(1)
+    if baseline is None:
+        for stage, stage_results in results['stages'].items():
+            print(f"{stage:<24}{stage_results['min']:>12.4f}")
+    elif len(benchmark.compare(results, baseline, args.tolerance)) > 0:
+        print("ERROR: Some stages are slower than the baseline")
+        exit(1)
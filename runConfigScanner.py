@@ -13,16 +13,36 @@
    and the deployed olives which may or may not be checking for the respective flags.
 """
 import argparse
-import json
+import contextlib
+import io
 from json import JSONDecodeError
 import os.path
-import re
 import tomli
 
+from checkMatcher import checkMatcher
 from configScanner import configScanner
 import gsiOlive
-import htmlRenderer
+import jsonReader
+import jsonWriter
+from oliveCache import oliveCache
+from outputWriter import publish
+from scanChanges import scanChanges, CHANGES_SUFFIX
+from scanMetrics import scanMetrics
+from scanSession import scanSession
+from scanSites import scanSites, INDEX_SUFFIX
+from scanState import scanState
+'''
+   HTML rendering, git, process pools, profiling and watching are imported where they are used,
+   so that runs which do not need them (i.e. --only config) start faster
+'''
 
+DEFAULT_SETTINGS = "config.toml"
+STATE_SUFFIX = ".state.json"
+CONFIG_TARGET = "assay_config"
+SHORT_HASH = 12
+TIMELINE_SUFFIX = "_timeline"
+PROFILE_TOP = 25
+OUTPUTS = ("config", "json", "html")
 CONF_HEADER = {"missingUsesDefaults": False, "types": {"versions": {"is": "dictionary", "key": "s",
                "value": {"fields": {"workflows": "msas"}, "is": "object"}}, "reference": "s"}}
 """
@@ -54,15 +74,26 @@ def init_filters(prefs: dict, instance: str):
 
 
 """
-   Load assay setting according to the config, we need only enabled workflows
+   Load assay setting according to the config, we need only enabled workflows.
+   With a revision, the config is read from git as it was at this revision (if it is in the repository).
+   The config is read in chunks into compact data (see jsonReader), without holding the whole text of the file
 """
-def load_config(path):
+def load_config(path, repo_dir: str = None, revision: str = None):
     json_data = {}
     try:
-        with open(path, "r") as conf_file:
-            json_data = json.load(conf_file)
-            if isinstance(json_data, dict) and 'values' in json_data.keys():
-                return json_data['values']
+        repo = None
+        if revision is not None:
+            from gitRepo import gitRepo
+            repo = gitRepo.open(repo_dir)
+        repo_path = repo.repo_path(path) if repo is not None else None
+        if repo_path is not None:
+            content = repo.read_file(revision, repo_path)
+            if content is None:
+                raise FileNotFoundError(path)
+            json_data = jsonReader.read_values(io.TextIOWrapper(io.BytesIO(content), encoding="utf-8"))
+        else:
+            with open(path, "r") as conf_file:
+                json_data = jsonReader.read_values(conf_file)
     except FileNotFoundError:
         print(f"ERROR: cannot load config data from {path}")
     except JSONDecodeError:
@@ -78,106 +109,531 @@ def save_config(conf_data: dict, output_conf: str):
     try:
         vetted_od["values"].update(conf_data)
         vetted_od.update(CONF_HEADER)
-        vetted_od = configScanner.deepsort_dict(vetted_od)
-        with open(output_conf, "w") as wfj:
-            jstring = json.dumps(vetted_od, indent=2, ensure_ascii=False)
-            jstring = re.sub(r'(\[)\n', r'\1', jstring)
-            jstring = re.sub(r'(\d\")\s+', r'\1', jstring)
-            jstring = re.sub(r'(\.\d\",)\s+', r'\1', jstring)
-            jstring = re.sub(r'(\[)\s+', r'\1', jstring)
-            jstring = re.sub(r'(\d\",)\n', r'\1', jstring)
-            '''Take care of strings with reference'''
-            pattern_string = configScanner.REF_KEY + r"\S+\s+\S+\d\","
-            ptr = re.compile(f'({pattern_string})')
-            jstring = re.sub(ptr, r'\1' + "\n", jstring)
-            wfj.write(jstring)
+        with publish(output_conf, "w") as wfj:
+            jsonWriter.write_json(vetted_od, wfj, jsonWriter.CONFIG, configScanner.REF_KEY)
             print(f"INFO: Saved assay config into a .jsonconfig file {output_conf}")
     except:
         print(f"ERROR: writing to a config file {output_conf} failed")
 
 
+"""
+   Build report and staged config for one instance with a scan session (assay config shared by instances),
+   save the .json report and generate HTML page. Returns the report, staged config updates of the instance
+   (a delta, see configScanner.get_staged_delta, empty if we have no olives for the instance) and changes since
+   the last run (see scanChanges.instance_changes, None unless we track changes)
+
+   Options are output names and switches from the command line:
+   output_base, output_page, java_script, log_file, pretty_html, sharded_html, compress_shards,
+   incremental, full_rebuild, outputs (a set of OUTPUTS to write, the staged config is saved by the caller),
+   engine (one of configScanner.ENGINES) and changes (compare the report with the .json report of the last run)
+"""
+def scan_instance(instance_to_scan: str, instance_olives: list, session: scanSession, prefixes: dict,
+                  options: dict, metrics: scanMetrics = None) -> tuple:
+    vetted_report = {}
+    staged_delta = {}
+    instance_changes = None
+    metrics = metrics if metrics is not None else scanMetrics()
+    '''Load and update the version settings, if available'''
+    if len(instance_olives) > 0:
+        filters = init_filters(prefixes, instance_to_scan)
+        output_json = options['output_base'] + "_" + instance_to_scan + ".json"
+        with metrics.stage("configScanner", instance_to_scan):
+            '''In incremental mode recompute only report cells affected by changes since the last scan'''
+            state = None
+            rebuilt = None
+            previous_report = None
+            if options['changes'] or (options['incremental'] and not options['full_rebuild']):
+                previous_report = configScanner.load_report(output_json)
+            if options['incremental']:
+                state = scanState(os.path.splitext(output_json)[0] + STATE_SUFFIX)
+                if not options['full_rebuild']:
+                    rebuilt = state.plan(session, instance_olives, filters, previous_report,
+                                         scanState.file_hash(output_json))
+            confScanner = session.scan(instance_olives, filters, rebuilt)
+            if rebuilt is not None:
+                state.restore(confScanner, rebuilt, previous_report)
+        metrics.count('report_cells', len(confScanner.get_cells()), instance_to_scan)
+        metrics.count('report_cells_computed', confScanner.get_computed_cells(), instance_to_scan)
+        metrics.count('errors', confScanner.get_errors(), instance_to_scan)
+        vetted_report = confScanner.get_report()
+        staged_delta = confScanner.get_staged_delta()
+        if options['changes']:
+            '''Without the report of the last run there is nothing to compare with'''
+            instance_changes = scanChanges.instance_changes(previous_report if os.path.exists(output_json) else None,
+                                                            vetted_report, confScanner.get_error_messages())
+        ''' 5. Dump the data into json file and generate a report HTML page '''
+        if len(vetted_report) > 0 and 'json' in options['outputs']:
+            with metrics.stage("save_report", instance_to_scan):
+                confScanner.save_report(output_json)
+        if len(vetted_report) > 0 and 'html' in options['outputs']:
+            import htmlRenderer
+            with metrics.stage("render_page", instance_to_scan):
+                instance_page = options['output_page'] + "_" + instance_to_scan + ".html"
+                shard_index = None
+                if options['sharded_html']:
+                    shard_index = htmlRenderer.write_shards(vetted_report, instance_page, options['compress_shards'])
+                with publish(instance_page, 'w') as op:
+                    htmlRenderer.render_page(op,
+                                             vetted_report,
+                                             options['java_script'],
+                                             instance_to_scan,
+                                             options['log_file'],
+                                             confScanner.get_errors(),
+                                             options['pretty_html'],
+                                             shard_index)
+        '''The state goes with the .json report, without a new report we keep the state of the last one'''
+        if state is not None and 'json' in options['outputs']:
+            state.update(confScanner, session, instance_olives, filters, scanState.file_hash(output_json))
+            state.save()
+    else:
+        print(f"ERROR: Was not able to collect up-to-date information for {instance_to_scan}, no olives")
+    return vetted_report, staged_delta, instance_changes
+
+
+"""
+   Run a function with its output captured, this is for scanning instances in a process pool.
+   Captured output is printed by the main process in the order of instances, together with output of parsing
+   olives of the instance (see scan_instances)
+"""
+def run_captured(func, *func_args) -> tuple:
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        result = func(*func_args)
+    return result, output.getvalue()
+
+
+"""
+   Scan an instance with metrics of its own, this is for scanning instances in a process pool:
+   metrics come back with the result and are merged by the main process
+"""
+def measured_scan(*scan_args) -> tuple:
+    metrics = scanMetrics()
+    return scan_instance(*scan_args, metrics), metrics
+
+
+"""
+   Collect and parse olives, scan instances (in a process pool if we have one) in a scan session.
+   Returns a dict of instances with their reports and staged config deltas. With a revision,
+   olives are read from git (local_olive_dir should be in a git repository). contents is for parsed olives
+   shared by scans of several sites (see gsiOlive.parse_shared_olives)
+"""
+def scan_instances(instances: list, settings: dict, blacklist: list, config_check, session: scanSession,
+                   prefixes: dict, options: dict, olive_cache=None, executor=None, revision: str = None,
+                   metrics: scanMetrics = None, contents: dict = None) -> dict:
+    scans = {}
+    olive_dir = settings["data"]["local_olive_dir"]
+    metrics = metrics if metrics is not None else scanMetrics()
+    '''With a pool, output of parsing is kept and printed with the output of the scan of the same instance'''
+    parse_outputs = {}
+    for instance_to_scan in instances:
+        parse_output = io.StringIO() if executor is not None else None
+        with contextlib.redirect_stdout(parse_output) if parse_output is not None else contextlib.nullcontext():
+            with metrics.stage("collect_olives", instance_to_scan):
+                olive_files = gsiOlive.collect_olives(olive_dir, instance_to_scan, blacklist, {}, revision)
+            with metrics.stage("parse_olives", instance_to_scan):
+                instance_olives = gsiOlive.parse_olives(olive_files, config_check, olive_cache, executor, olive_dir,
+                                                        revision, metrics.get_counters(instance_to_scan), contents)
+        scan_args = (instance_to_scan, instance_olives, session, prefixes, options)
+        if executor is None:
+            scans[instance_to_scan] = scan_instance(*scan_args, metrics)
+        else:
+            parse_outputs[instance_to_scan] = parse_output.getvalue()
+            scans[instance_to_scan] = executor.submit(run_captured, measured_scan, *scan_args)
+    '''Print output of each instance as one block in the order of instances, so that it does not depend on
+       the number of jobs'''
+    if executor is not None:
+        for instance_to_scan in instances:
+            (scans[instance_to_scan], worker_metrics), scan_output = scans[instance_to_scan].result()
+            metrics.merge(worker_metrics)
+            print(parse_outputs[instance_to_scan] + scan_output, end="")
+    return scans
+
+
+"""
+   Merge staged config deltas over assay config of the session in the order of instances (so that outputs
+   do not depend on what was rescanned last) and save them (unless output_conf is None), save the olive cache too.
+   With changes, staged config is compared with the staged config of the last run before it is overwritten
+"""
+def save_combined(instances: list, scans: dict, session: scanSession, output_conf: str, olive_cache=None,
+                  changes: scanChanges = None):
+    if output_conf is not None:
+        staged_config = session.staged_config([scans[instance][1] for instance in instances])
+        if changes is not None:
+            previous_config = load_config(output_conf) if os.path.exists(output_conf) else None
+            changes.set_staged_config(previous_config, staged_config)
+        save_config(staged_config, output_conf)
+    if olive_cache is not None:
+        olive_cache.save()
+
+
+"""
+   Save changes since the last run for instances as .json and as HTML summary page
+   (<output base>_changes.json and <output page>_changes.html). Instances which are not in scanned (if we have it)
+   were not scanned again, their errors are kept from the last run
+"""
+def save_changes(instances: list, scans: dict, changes: scanChanges, options: dict, scanned: list = None):
+    import htmlRenderer
+    for instance in instances:
+        if scanned is not None and instance not in scanned:
+            changes.keep_instance(instance)
+            continue
+        instance_changes = scans[instance][2]
+        if instance_changes is not None:
+            changes.add_instance(instance, instance_changes)
+    changes.save(options['output_base'] + CHANGES_SUFFIX + ".json")
+    with publish(options['output_page'] + CHANGES_SUFFIX + ".html", 'w') as op:
+        htmlRenderer.render_changes(op, changes.get_changes(), options['pretty_html'])
+
+
+"""
+   Save metrics of a run as .json and/or in Prometheus text format, if we have paths for them
+"""
+def save_metrics(metrics: scanMetrics, metrics_file: str = None, prometheus_file: str = None):
+    if metrics_file:
+        metrics.save(metrics_file)
+    if prometheus_file:
+        metrics.save_prometheus(prometheus_file)
+
+
+"""
+   Stop profiling, save profile data (for pstats, snakeviz etc.) and print functions we spent most time in
+"""
+def save_profile(profiler, path: str):
+    import pstats
+    profiler.disable()
+    profiler.dump_stats(path)
+    print(f"INFO: Saved profile into {path}, functions with most time spent:")
+    pstats.Stats(profiler).sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP)
+
+
+"""
+   Build timelines of workflow enablement for instances over commits of a range (oldest first) and save them
+   as .json and HTML. Results are carried over between adjacent commits: if neither olives of an instance nor
+   assay config changed, the report stays as it is, otherwise only report cells affected by the changes
+   are recomputed (see scanState)
+"""
+def scan_timeline(instances: list, commits: list, revision_range: str, settings: dict, blacklist: list,
+                  config_check, prefixes: dict, assay_config_file: str, options: dict, executor=None):
+    from gitRepo import gitRepo
+    from scanTimeline import scanTimeline
+    olive_dir = settings["data"]["local_olive_dir"]
+    repo = gitRepo.open(olive_dir)
+    config_path = repo.repo_path(assay_config_file)
+    timelines = {instance: scanTimeline(instance, revision_range) for instance in instances}
+    states = {instance: scanState(None) for instance in instances}
+    reports = {instance: {} for instance in instances}
+    inputs = {instance: None for instance in instances}
+    session = None
+    config_oid = None
+    for commit in commits:
+        commit_info = repo.commit_info(commit)
+        print(f"INFO: Scanning revision {commit}")
+        if config_path is not None or session is None:
+            commit_config = repo.file_oid(commit, config_path) if config_path is not None else None
+            if session is None or commit_config != config_oid:
+                session = scanSession(load_config(assay_config_file, olive_dir, commit), options['engine'])
+                config_oid = commit_config
+        for instance in instances:
+            olive_files = gsiOlive.collect_olives(olive_dir, instance, blacklist, {}, commit)
+            instance_inputs = (config_oid, [(f, repo.file_oid(commit, repo.repo_path(f))) for f in olive_files])
+            if instance_inputs == inputs[instance]:
+                timelines[instance].add(commit_info)
+                continue
+            inputs[instance] = instance_inputs
+            instance_olives = gsiOlive.parse_olives(olive_files, config_check, None, executor, olive_dir, commit)
+            if len(instance_olives) == 0:
+                print(f"ERROR: Was not able to collect up-to-date information for {instance}, no olives")
+                reports[instance] = {}
+                states[instance] = scanState(None)
+            else:
+                filters = init_filters(prefixes, instance)
+                rebuilt = states[instance].plan(session, instance_olives, filters, reports[instance], None)
+                confScanner = session.scan(instance_olives, filters, rebuilt)
+                if rebuilt is not None:
+                    states[instance].restore(confScanner, rebuilt, reports[instance])
+                states[instance].update(confScanner, session, instance_olives, filters, None)
+                reports[instance] = confScanner.get_report()
+            timelines[instance].add(commit_info, reports[instance])
+    for instance in instances:
+        if 'json' in options['outputs']:
+            timelines[instance].save(options['output_base'] + "_" + instance + TIMELINE_SUFFIX + ".json")
+        if 'html' in options['outputs']:
+            import htmlRenderer
+            timeline_page = options['output_page'] + "_" + instance + TIMELINE_SUFFIX + ".html"
+            with publish(timeline_page, 'w') as op:
+                htmlRenderer.render_timeline(op, timelines[instance].get_timeline(), options['pretty_html'])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run parsing script to generate assay scan report table')
-    parser.add_argument('-s', '--settings', help='Settings file in TOML format', required=False, default="config.toml")
+    parser.add_argument('-s', '--settings', help='Settings file in TOML format, may be repeated to scan with several '
+                        'settings in one run (default config.toml)', action='append', required=False)
     parser.add_argument('-o', '--out-prefix', help='Output base name', required=False, default="enabled_workflows")
     parser.add_argument('-j', '--jscript', help="Path UI js", required=False, default="js/dropDown.js")
     parser.add_argument('-c', '--config', help="Staging config", required=False, default="assay_staging.jsonconfig")
     parser.add_argument('-p', '--outpage', help='HTML page basename', required=False, default="running_workflows")
     parser.add_argument('-l', '--log', help="configScanner log file", required=False)
+    parser.add_argument('-k', '--cache', help="Olive parse cache file", required=False)
+    parser.add_argument('--cache-size', help="Max number of olives kept in the cache", type=int, required=False,
+                        default=10000)
+    parser.add_argument('--pretty-html', help="Indent HTML report pages", action='store_true', required=False)
+    parser.add_argument('--sharded-html', help="Write report data for HTML pages as per-assay shards, loaded on demand",
+                        action='store_true', required=False)
+    parser.add_argument('--compress-shards', help="Also write precompressed .gz copies of HTML data shards",
+                        action='store_true', required=False)
+    parser.add_argument('--incremental', help="Recompute only report cells affected by changes since the last scan",
+                        action='store_true', required=False)
+    parser.add_argument('--full-rebuild', help="Rebuild everything but keep the state for next incremental scans",
+                        action='store_true', required=False)
+    parser.add_argument('--jobs', help="Number of worker processes for parsing olives and scanning instances",
+                        type=int, required=False, default=1)
+    parser.add_argument('--watch', help="Keep running and rescan instances when olives or assay config change",
+                        action='store_true', required=False)
+    parser.add_argument('--debounce', help="Seconds without changes to wait for before rescanning in watch mode",
+                        type=float, required=False, default=2.0)
+    parser.add_argument('--poll-interval', help="Seconds between checks for changes when inotify is not available",
+                        type=float, required=False, default=5.0)
+    parser.add_argument('--revision', help="Scan olives and assay config as they are in git at a revision, or at each "
+                        "commit of a range (A..B)", required=False)
+    parser.add_argument('--metrics', help="Write timing, counters and peak memory of the run into a .json file",
+                        required=False)
+    parser.add_argument('--prometheus', help="Write metrics of the run in Prometheus text format (i.e. a .prom file "
+                        "for the node exporter textfile collector)", required=False)
+    parser.add_argument('--profile', help="Profile the run (main process) and save cProfile data into this file",
+                        required=False)
+    parser.add_argument('--timeline', help="With a range of commits, write a timeline of workflow enablement for "
+                        "each instance instead of reports for each commit", action='store_true', required=False)
+    parser.add_argument('--only', help="Write only these outputs (may be repeated): config is the staged assay "
+                        "config, json the .json reports, html the report pages. All are written by default",
+                        choices=OUTPUTS, action='append', required=False)
+    parser.add_argument('--changes', help="Compare reports and staged config with outputs of the last run, write "
+                        "what changed into <out-prefix>_changes.json and <outpage>_changes.html",
+                        action='store_true', required=False)
+    parser.add_argument('--engine', help="How olives are matched to assay versions: index (sets), matrix (NumPy) or "
+                        "auto (the matrix for large jobs if NumPy is installed)", choices=configScanner.ENGINES,
+                        required=False, default="auto")
     args = parser.parse_args()
 
-    settings_path = args.settings
+    settings_files = args.settings if args.settings else [DEFAULT_SETTINGS]
     output_base = args.out_prefix
     output_page = args.outpage
     java_script = args.jscript
     output_config = args.config
     log_file = args.log
+    cache_file = args.cache
+    outputs = set(args.only) if args.only else set(OUTPUTS)
+
+    metrics = scanMetrics()
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    if not java_script or not os.path.exists(java_script):
+    if args.jobs < 1:
+        print("ERROR: Number of jobs should be at least 1")
+        exit(1)
+
+    '''java script goes into HTML pages, we do not need it for other outputs'''
+    if 'html' in outputs and (not java_script or not os.path.exists(java_script)):
         print("ERROR: Cannot access non-optional file with java script!")
         exit(1)
 
-    ''' 1. Load settings'''
-    settings = load_settings(settings_path)
+    ''' 1. Load settings, a settings file may describe several sites (see scanSites), each is scanned as a unit
+          as if it had a settings file of its own '''
+    units = []
+    settings_names = [os.path.splitext(os.path.basename(path))[0] for path in settings_files]
+    for settings_path, settings_name in zip(settings_files, settings_names):
+        for site, site_settings in scanSites.expand(load_settings(settings_path)):
+            unit_name = settings_name if site is None else site if len(settings_files) == 1 \
+                else settings_name + "_" + site
+            units.append((settings_path, settings_name, site, unit_name, site_settings))
 
-    ''' 2. We have search patterns in config file, compile them here '''
-    config_check = None
-    try:
-        check_pattern = settings["checks"]["assay"]
-        config_check = re.compile(rf'({check_pattern})')
-    except:
-        print("Failed to compile a search pattern for olive check detection")
+    '''With several settings files or sites (a batch), outputs of each unit get its name appended'''
+    batch = len(units) > 1 or units[0][2] is not None
+    unit_names = [unit[3] for unit in units]
+    if batch:
+        if args.watch or args.revision:
+            print("ERROR: Watch mode and scans of git revisions need a single settings file without sites")
+            exit(1)
+        if len(set(settings_names)) < len(settings_names) or len(set(unit_names)) < len(unit_names):
+            print("ERROR: Settings files and sites should have different names, outputs are named after them")
+            exit(1)
 
-    ''' 3. collect and process olives, extract modules and tags '''
-    olive_files = []
-    olive_info = {}
-    blacklist = []
-    combined_report = {}
-    combined_config = {}
-    prefixes = {}
+    executor = None
+    if args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
 
-    if 'blacklist' in settings['checks'].keys():
-        blacklist = settings['checks']['blacklist']
+    '''
+       Units with the same assay config share a scan session, the config is loaded and indexed once. Units of
+       a settings file share the olive cache, units of a batch share olives parsed in this run (by content)
+    '''
+    sessions = {}
+    caches = {}
+    contents = {} if batch else None
+    sites = scanSites() if batch else None
+    for settings_path, settings_name, site, unit_name, settings in units:
+        suffix = "_" + unit_name if batch else ""
+        settings_config = suffix.join(os.path.splitext(output_config))
+        config_output = settings_config if 'config' in outputs else None
 
-    ''' 4. with loaded config file check the assays for enabled workflows and construct the report '''
-    try:
-        config_data = load_config(settings["data"]["assay_config_file"])
-    except:
-        print("No config file configured in the settings")
-        exit(1)
+        ''' 2. We have search patterns in config file, compile them here (all of them into one matcher) '''
+        config_check = checkMatcher.from_settings(settings.get("checks", {}))
+        if config_check is None:
+            print("Failed to compile a search pattern for olive check detection")
 
-    ''' 5. check for instance-specific assay prefixes '''
-    try:
-        prefixes = settings["prefixes"]
-    except:
-        print("No instance-specific prefixes found")
-
-    for instance_to_scan in settings['instances'].values():
-        olive_files = gsiOlive.collect_olives(settings["data"]["local_olive_dir"], instance_to_scan, blacklist, {})
-        olive_info[instance_to_scan] = gsiOlive.parse_olives(olive_files, config_check)
-        vetted_report = {}
-        '''Load and update the version settings, if available'''
-        if len(olive_info[instance_to_scan]) > 0:
-            filters = init_filters(prefixes, instance_to_scan)
-            output_json = output_base + "_" + instance_to_scan + ".json"
-            confScanner = configScanner(config_data, olive_info[instance_to_scan], filters)
-            vetted_report = confScanner.get_report()
-            combined_report.update(vetted_report)
-            combined_config.update(confScanner.get_staged_config())
-            ''' 5. Dump the data into json file and generate a report HTML page '''
-            if len(vetted_report) > 0:
-                confScanner.save_report(output_json)
-                html_page = htmlRenderer.convert2page(output_json,
-                                                      java_script,
-                                                      instance_to_scan,
-                                                      log_file,
-                                                      confScanner.get_errors())
-                instance_page = output_page + "_" + instance_to_scan + ".html"
-                with open(instance_page, 'w') as op:
-                    op.write(html_page)
-        else:
-            print(f"ERROR: Was not able to collect up-to-date information for {instance_to_scan}, no olives")
+        olive_cache = None
+        if cache_file:
+            if settings_path not in caches:
+                cache_suffix = "_" + settings_name if len(settings_files) > 1 else ""
+                caches[settings_path] = oliveCache(cache_suffix.join(os.path.splitext(cache_file)),
+                                                   config_check.pattern if config_check else None, args.cache_size)
+            olive_cache = caches[settings_path]
+
+        ''' 3. collect and process olives, extract modules and tags '''
+        blacklist = []
+        prefixes = {}
+
+        if 'blacklist' in settings['checks'].keys():
+            blacklist = settings['checks']['blacklist']
+
+        ''' 4. with loaded config file check the assays for enabled workflows and construct the report '''
+        try:
+            assay_config_file = settings["data"]["assay_config_file"]
+        except:
+            print("No config file configured in the settings")
+            exit(1)
+        olive_dir = settings["data"].get("local_olive_dir")
+
+        '''With a revision (or a range) olives and assay config come from git, we scan each commit'''
+        revisions = [None]
+        if args.revision:
+            if args.watch:
+                print("ERROR: Watch mode cannot be used when scanning git revisions")
+                exit(1)
+            from gitRepo import gitRepo
+            repo = gitRepo.open(olive_dir) if olive_dir else None
+            revisions = repo.revisions(args.revision) if repo is not None else []
+            if len(revisions) == 0:
+                print(f"ERROR: No commits to scan for {args.revision}")
+                exit(1)
+        if args.timeline and not args.revision:
+            print("ERROR: Timeline needs a range of commits to scan (--revision)")
+            exit(1)
+        if args.timeline and args.changes:
+            print("ERROR: Changes are not tracked for timelines")
+            exit(1)
+        if args.timeline and 'json' not in outputs and 'html' not in outputs:
+            print("ERROR: Timeline is written as .json and HTML, nothing to write with --only config")
+            exit(1)
+
+        ''' 5. check for instance-specific assay prefixes '''
+        try:
+            prefixes = settings["prefixes"]
+        except:
+            print("No instance-specific prefixes found")
+
+        scan_options = {'output_base': output_base + suffix,
+                        'output_page': output_page + suffix,
+                        'java_script': java_script,
+                        'log_file': log_file,
+                        'pretty_html': args.pretty_html,
+                        'sharded_html': args.sharded_html,
+                        'compress_shards': args.compress_shards,
+                        'incremental': args.incremental or args.full_rebuild,
+                        'full_rebuild': args.full_rebuild,
+                        'outputs': outputs,
+                        'engine': args.engine,
+                        'changes': args.changes}
+        instances = list(settings['instances'].values())
+        if args.timeline:
+            scan_timeline(instances, revisions, args.revision, settings, blacklist, config_check, prefixes,
+                          assay_config_file, scan_options, executor)
+            revisions = []
+        for revision in revisions:
+            revision_options = scan_options
+            revision_config = config_output
+            '''For a range of commits, outputs of each commit get its short hash appended to their names'''
+            if ".." in (args.revision or ""):
+                print(f"INFO: Scanning revision {revision}")
+                revision_suffix = "_" + revision[:SHORT_HASH]
+                revision_options = dict(scan_options, output_base=scan_options['output_base'] + revision_suffix,
+                                        output_page=scan_options['output_page'] + revision_suffix)
+                revision_config = revision_suffix.join(os.path.splitext(settings_config)) if config_output else None
+            with metrics.stage("load_config"):
+                if revision is None and assay_config_file in sessions:
+                    print(f"INFO: Using assay config {assay_config_file} loaded for earlier settings")
+                    session = sessions[assay_config_file]
+                else:
+                    session = scanSession(load_config(assay_config_file, olive_dir, revision), args.engine)
+                    if revision is None:
+                        sessions[assay_config_file] = session
+            '''Changes of the last run are read before outputs are overwritten'''
+            changes = scanChanges(revision_options['output_base'] + CHANGES_SUFFIX + ".json") if args.changes else None
+            '''In a batch instances of units may have the same names, their metrics go under unit/instance'''
+            unit_metrics = scanMetrics() if batch else metrics
+            scans = scan_instances(instances, settings, blacklist, config_check, session, prefixes, revision_options,
+                                   olive_cache, executor, revision, unit_metrics, contents)
+            if batch:
+                metrics.merge(unit_metrics, unit_name + "/")
+            with metrics.stage("save_config"):
+                save_combined(instances, scans, session, revision_config, None, changes)
+            if changes is not None:
+                with metrics.stage("save_changes"):
+                    save_changes(instances, scans, changes, revision_options)
+            if sites is not None:
+                sites.add(unit_name, settings_path, settings, instances, scans, revision_options, revision_config)
+    '''Scans of git revisions are done, git cat-file processes are not needed anymore'''
+    if args.revision:
+        from gitRepo import gitRepo
+        gitRepo.close_all()
+    '''The olive cache is saved once, after all units using it were scanned'''
+    with metrics.stage("save_config"):
+        for unit_cache in caches.values():
+            unit_cache.save()
+    if sites is not None:
+        with metrics.stage("save_index"):
+            sites.save(output_base + INDEX_SUFFIX + ".json",
+                       output_page + INDEX_SUFFIX + ".html" if 'html' in outputs else None, args.pretty_html)
+    save_metrics(metrics, args.metrics, args.prometheus)
+    if profiler is not None:
+        save_profile(profiler, args.profile)
 
-    save_config(combined_config, output_config)
+    ''' 6. In watch mode keep running, rescan instances when their olives (or assay config) change '''
+    if args.watch:
+        from scanWatcher import scanWatcher
+        watch_targets = {instance: os.path.join(settings["data"]["local_olive_dir"], instance)
+                         for instance in instances}
+        watch_targets[CONFIG_TARGET] = assay_config_file
+        watcher = scanWatcher(watch_targets, args.debounce, args.poll_interval)
+        print("INFO: Watching olives and assay config for changes, press Ctrl+C to stop")
+        try:
+            while True:
+                changed = watcher.wait()
+                metrics = scanMetrics()
+                if CONFIG_TARGET in changed:
+                    print("INFO: Assay config changed, rescanning all instances")
+                    with metrics.stage("load_config"):
+                        session = scanSession(load_config(assay_config_file), args.engine)
+                    to_scan = instances
+                else:
+                    to_scan = [instance for instance in instances if instance in changed]
+                    print(f"INFO: Olives changed for {', '.join(to_scan)}, rescanning")
+                changes = scanChanges(scan_options['output_base'] + CHANGES_SUFFIX + ".json") if args.changes else None
+                scans.update(scan_instances(to_scan, settings, blacklist, config_check, session, prefixes,
+                                            scan_options, olive_cache, executor, None, metrics))
+                with metrics.stage("save_config"):
+                    save_combined(instances, scans, session, config_output, olive_cache, changes)
+                if changes is not None:
+                    with metrics.stage("save_changes"):
+                        save_changes(instances, scans, changes, scan_options, to_scan)
+                save_metrics(metrics, args.metrics, args.prometheus)
+        except KeyboardInterrupt:
+            print("INFO: Stopped watching")
+        finally:
+            watcher.close()
+    if executor is not None:
+        executor.shutdown()
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/
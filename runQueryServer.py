@@ -0,0 +1,45 @@
+"""
+   Serve queries over .json reports of the scanner (which assays/versions run a workflow, which workflows
+   run for an assay) as a small local HTTP JSON service, see queryServer for the endpoints.
+   Reports are found the way runConfigScanner names them: <output base>_<instance>.json, or with --index
+   in the combined index of a run with several sites (see scanSites), their instances are site/instance
+"""
+import argparse
+import json
+
+import tomli
+
+from queryServer import serve
+from scanSites import scanSites
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve workflow/assay queries over scan reports')
+    parser.add_argument('-s', '--settings', help='Settings file in TOML format', required=False, default="config.toml")
+    parser.add_argument('-o', '--out-prefix', help='Output base name of reports', required=False,
+                        default="enabled_workflows")
+    parser.add_argument('--host', help="Address to listen on", required=False, default="127.0.0.1")
+    parser.add_argument('--port', help="Port to listen on", type=int, required=False, default=8085)
+    parser.add_argument('--index', help="Combined index of a run with several sites (<out-prefix>_index.json), "
+                        "serve reports of all sites", required=False)
+    args = parser.parse_args()
+
+    if args.index:
+        try:
+            with open(args.index, "r") as index_file:
+                report_files = scanSites.report_files(json.load(index_file))
+        except (OSError, ValueError, KeyError):
+            print(f"ERROR: Failed to load the index of sites from {args.index}")
+            exit(1)
+        serve(report_files, args.host, args.port)
+        exit(0)
+    try:
+        with open(args.settings, "rb") as settings_file:
+            settings = tomli.load(settings_file)
+    except (OSError, tomli.TOMLDecodeError):
+        print(f"ERROR: Failed to load settings from {args.settings}")
+        exit(1)
+    instances = list(settings.get('instances', {}).values())
+    if len(instances) == 0:
+        print("ERROR: No instances in the settings")
+        exit(1)
+    serve({instance: args.out_prefix + "_" + instance + ".json" for instance in instances}, args.host, args.port)
@@ -0,0 +1,154 @@
+"""
+   Changes since the last run: reports of instances and staged config are compared with the outputs of the previous
+   run (the .json report, see configScanner.load_report, and the staged .jsonconfig) before they are overwritten.
+   Changes are written as compact JSON:
+   {
+     format        = CHANGES_FORMAT
+     instances     = {instance: {previous, workflows, errors, new_errors, resolved_errors}}
+     staged_config = {previous, workflows} (if we write staged config)
+   }
+   previous tells if we had the previous output to compare with (without it there are no workflow changes),
+   workflows are rows for assay/version cells with changes:
+   {assay, version, workflow, change (added, removed or changed), added (versions), removed (versions)}
+   errors are all config errors of the instance in this run, new_errors and resolved_errors compare them
+   with errors in the changes file of the previous run. Instances which were not scanned again (in watch mode)
+   keep their errors from the previous run, without changes, so the file stays the baseline for all instances.
+
+   Reports are walked once, cell by cell, and cells which are equal are skipped, so the time is linear in the size
+   of reports and we keep only rows for cells which changed (not sets of all entries of both reports)
+"""
+import json
+import os
+from json import JSONDecodeError
+
+from configScanner import configScanner
+from outputWriter import publish
+
+CHANGES_FORMAT = 1
+CHANGES_SUFFIX = "_changes"
+
+
+class scanChanges:
+
+    """
+       previous_path is the changes file of the previous run, we get errors of instances from it
+    """
+    def __init__(self, previous_path: str = None):
+        self.instances = {}
+        self.staged_config = None
+        self.previous_errors = {}
+        if previous_path is not None and os.path.exists(previous_path):
+            try:
+                with open(previous_path, "r") as changes_file:
+                    previous = json.load(changes_file)
+                if isinstance(previous, dict) and previous.get('format') == CHANGES_FORMAT:
+                    self.previous_errors = {instance: changes.get('errors', [])
+                                            for instance, changes in previous['instances'].items()}
+            except (OSError, JSONDecodeError):
+                print(f"WARNING: Changes of the previous run {previous_path} could not be loaded")
+
+    '''Versions of a workflow as a set of strings, a workflow enabled without a list of versions has none'''
+    @staticmethod
+    def version_set(wf_versions) -> set:
+        if isinstance(wf_versions, list):
+            return set(v for v in wf_versions if isinstance(v, str))
+        return {wf_versions} if isinstance(wf_versions, str) else set()
+
+    """
+       Return rows for workflows of an assay/version cell which changed, workflows are {workflow: versions}
+       (None for a cell which is not there)
+    """
+    @staticmethod
+    def cell_changes(assay: str, version: str, previous: dict, current: dict) -> list:
+        previous = previous if previous is not None else {}
+        current = current if current is not None else {}
+        rows = []
+        for wf in sorted(set(previous.keys()).union(current.keys())):
+            if wf in previous and wf in current and previous[wf] == current[wf]:
+                continue
+            old_versions = scanChanges.version_set(previous.get(wf))
+            new_versions = scanChanges.version_set(current.get(wf))
+            change = "changed" if wf in previous and wf in current else "added" if wf in current else "removed"
+            if change == "changed" and old_versions == new_versions:
+                continue
+            rows.append({'assay': assay,
+                         'version': version,
+                         'workflow': wf,
+                         'change': change,
+                         'added': sorted(new_versions - old_versions),
+                         'removed': sorted(old_versions - new_versions)})
+        return rows
+
+    """
+       Return rows of changes between two reports ({assay: {version: {workflow: versions}}}), sorted by assay,
+       version and workflow
+    """
+    @staticmethod
+    def report_changes(previous: dict, current: dict) -> list:
+        rows = []
+        for assay in sorted(set(previous.keys()).union(current.keys())):
+            old_versions = previous.get(assay, {})
+            new_versions = current.get(assay, {})
+            if old_versions == new_versions:
+                continue
+            for version in sorted(set(old_versions.keys()).union(new_versions.keys())):
+                if version == configScanner.REF_KEY:
+                    continue
+                rows.extend(scanChanges.cell_changes(assay, version, old_versions.get(version),
+                                                     new_versions.get(version)))
+        return rows
+
+    """
+       Return rows of changes between two assay configs ({assay: {versions: {version: {workflows: ...}}}})
+    """
+    @staticmethod
+    def config_changes(previous: dict, current: dict) -> list:
+        return scanChanges.report_changes(scanChanges.config_cells(previous), scanChanges.config_cells(current))
+
+    '''Return workflows of assay config cells in the shape of a report, cells are not copied'''
+    @staticmethod
+    def config_cells(config_data: dict) -> dict:
+        return {assay: {version: cell.get('workflows', {}) for version, cell in entry.get('versions', {}).items()}
+                for assay, entry in config_data.items() if isinstance(entry, dict)}
+
+    """
+       Return changes of an instance (this goes with the result of a scan, see add_instance). previous_report
+       is None if we do not have a report of the previous run
+    """
+    @staticmethod
+    def instance_changes(previous_report: dict, report: dict, errors: list) -> dict:
+        rows = scanChanges.report_changes(previous_report, report) if previous_report is not None else []
+        return {'previous': previous_report is not None, 'workflows': rows, 'errors': list(errors)}
+
+    '''Register changes of an instance, errors are compared with errors of the previous run'''
+    def add_instance(self, instance: str, changes: dict):
+        errors = changes['errors']
+        previous_errors = self.previous_errors.get(instance, [])
+        known = set(previous_errors)
+        current = set(errors)
+        self.instances[instance] = dict(changes,
+                                        new_errors=[e for e in errors if e not in known],
+                                        resolved_errors=[e for e in previous_errors if e not in current])
+
+    '''Keep errors of an instance which was not scanned again from the previous run, it has no changes'''
+    def keep_instance(self, instance: str):
+        if instance in self.previous_errors:
+            self.instances[instance] = {'previous': True, 'workflows': [],
+                                        'errors': list(self.previous_errors[instance]),
+                                        'new_errors': [], 'resolved_errors': []}
+
+    '''Register changes of staged config, previous_config is None if we do not have the previous staged config'''
+    def set_staged_config(self, previous_config: dict, staged_config: dict):
+        rows = scanChanges.config_changes(previous_config, staged_config) if previous_config is not None else []
+        self.staged_config = {'previous': previous_config is not None, 'workflows': rows}
+
+    def get_changes(self) -> dict:
+        changes = {'format': CHANGES_FORMAT, 'instances': self.instances}
+        if self.staged_config is not None:
+            changes['staged_config'] = self.staged_config
+        return changes
+
+    def save(self, path: str):
+        with publish(path, "w") as changes_file:
+            json.dump(self.get_changes(), changes_file, separators=(",", ":"))
+            print(f"INFO: Saved changes since the last run into {path}")
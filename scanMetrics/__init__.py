@@ -0,0 +1,150 @@
+"""
+   Metrics of a scan: wall and CPU time of each stage, counters (olive files, bytes read, parsed olives and
+   cache hits, computed report cells, errors) and peak memory. Stages and counters are kept for the run and
+   for each instance. Metrics go into a .json file:
+   {
+     format    = METRICS_FORMAT
+     started   = start of the run (seconds since epoch)
+     wall      = wall time of the run so far
+     peak_memory_bytes = max resident set size of this process and its (finished) worker processes
+     run       = {stages: {stage: {wall, cpu, calls}}, counters: {counter: value}}
+     instances = {instance: {stages, counters}}
+   }
+   and may also be written in Prometheus text format, for the node exporter textfile collector.
+   CPU time is of the process where a stage ran, stages of instances scanned in a pool are measured
+   in workers and merged into the metrics of the main process
+"""
+import contextlib
+import json
+import sys
+import time
+
+from outputWriter import atomic_open
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+METRICS_FORMAT = 1
+RUN = ""
+PROMETHEUS_PREFIX = "configscanner_"
+'''Not "instance", Prometheus sets that label for the scraped target'''
+INSTANCE_LABEL = "shesmu_instance"
+
+
+class scanMetrics:
+
+    def __init__(self):
+        self.started = time.time()
+        self.started_wall = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    """
+       Time a stage of the run or (if we have it) of an instance, stages with the same name add up
+    """
+    @contextlib.contextmanager
+    def stage(self, name: str, instance: str = RUN):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(instance, {}).setdefault(name, [0.0, 0.0, 0])
+            record[0] += time.perf_counter() - wall
+            record[1] += time.process_time() - cpu
+            record[2] += 1
+
+    '''Return counters of the run or of an instance, as a dict we can add to'''
+    def get_counters(self, instance: str = RUN) -> dict:
+        return self.counters.setdefault(instance, {})
+
+    def count(self, name: str, value: int = 1, instance: str = RUN):
+        counters = self.get_counters(instance)
+        counters[name] = counters.get(name, 0) + value
+
+    """
+       Add stages and counters measured elsewhere (i.e. in a worker process). With a prefix, instances get it
+       prepended (i.e. site/ for instances of a site, see scanSites)
+    """
+    def merge(self, other, prefix: str = ""):
+        for instance, stages in other.stages.items():
+            for name, (wall, cpu, calls) in stages.items():
+                target = prefix + instance if instance != RUN else RUN
+                record = self.stages.setdefault(target, {}).setdefault(name, [0.0, 0.0, 0])
+                record[0] += wall
+                record[1] += cpu
+                record[2] += calls
+        for instance, counters in other.counters.items():
+            for name, value in counters.items():
+                self.count(name, value, prefix + instance if instance != RUN else RUN)
+
+    '''Peak memory in bytes, None if we cannot get it on this platform'''
+    @staticmethod
+    def peak_memory():
+        if resource is None:
+            return None
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        '''ru_maxrss is in kilobytes on Linux, in bytes on macOS'''
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    def get_metrics(self) -> dict:
+        metrics = {'format': METRICS_FORMAT,
+                   'started': self.started,
+                   'wall': time.perf_counter() - self.started_wall,
+                   'peak_memory_bytes': scanMetrics.peak_memory(),
+                   'run': {'stages': {}, 'counters': {}},
+                   'instances': {}}
+        for instance in sorted(set(self.stages.keys()).union(self.counters.keys())):
+            target = metrics['run'] if instance == RUN else metrics['instances'].setdefault(instance, {})
+            target['stages'] = {name: {'wall': wall, 'cpu': cpu, 'calls': calls}
+                                for name, (wall, cpu, calls) in self.stages.get(instance, {}).items()}
+            target['counters'] = dict(self.counters.get(instance, {}))
+        return metrics
+
+    def save(self, path: str):
+        try:
+            with atomic_open(path, "w") as metrics_file:
+                json.dump(self.get_metrics(), metrics_file, indent=2, sort_keys=True)
+        except OSError:
+            print(f"ERROR: writing metrics {path} failed")
+
+    """
+       Write metrics in Prometheus text format. Stages and counters of instances have a shesmu_instance label,
+       stages of the whole run go into separate run_stage_* metrics
+    """
+    def save_prometheus(self, path: str):
+        metrics = self.get_metrics()
+        lines = []
+        samples = {}
+        for instance, data in [(RUN, metrics['run'])] + sorted(metrics['instances'].items()):
+            labels = {} if instance == RUN else {INSTANCE_LABEL: instance}
+            stage_prefix = "run_stage_" if instance == RUN else "stage_"
+            for name, stage in sorted(data['stages'].items()):
+                stage_labels = dict(labels, stage=name)
+                samples.setdefault((stage_prefix + "wall_seconds", "gauge"), []).append((stage_labels, stage['wall']))
+                samples.setdefault((stage_prefix + "cpu_seconds", "gauge"), []).append((stage_labels, stage['cpu']))
+            for name, value in sorted(data['counters'].items()):
+                samples.setdefault((name, "gauge"), []).append((labels, value))
+        samples[("run_wall_seconds", "gauge")] = [({}, metrics['wall'])]
+        samples[("last_run_timestamp_seconds", "gauge")] = [({}, metrics['started'])]
+        if metrics['peak_memory_bytes'] is not None:
+            samples[("peak_memory_bytes", "gauge")] = [({}, metrics['peak_memory_bytes'])]
+        for (name, metric_type), values in samples.items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {metric_type}")
+            for labels, value in values:
+                label_text = ",".join(f'{k}="{prometheus_label(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{PROMETHEUS_PREFIX}{name}{{{label_text}}} {value}" if label_text else
+                             f"{PROMETHEUS_PREFIX}{name} {value}")
+        try:
+            with atomic_open(path, "w") as prometheus_file:
+                prometheus_file.write("\n".join(lines) + "\n")
+        except OSError:
+            print(f"ERROR: writing metrics {path} failed")
+
+
+'''Escape a label value for Prometheus text format'''
+def prometheus_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,82 @@
+"""
+   Scan session: assay config (assay_info) loaded once and shared by scans of any number of instances (and of
+   several settings files using the same assay config). What does not depend on olives is done once per session:
+   * prefix filters are compiled and assays filtered once for each set of filters, this gives the report layout
+     (assays and assay/version cells) and the index of assay config for these cells (see configScanner.index_config)
+   * workflows configured in assay config (olives are validated against them) are collected once
+   * hashes of assay/version entries (for incremental scans, see scanState) are computed once
+
+   Each scan gets a configScanner of its own, so errors and staged config updates stay with their instance.
+   Staged config updates of an instance are a delta (only cells which got updates, see
+   configScanner.get_staged_delta), deltas of instances are merged over the shared assay config when staged
+   config is saved
+"""
+import json
+import re
+
+from configScanner import configScanner
+from scanState import scanState
+
+
+class scanSession:
+
+    def __init__(self, config_data: dict, engine: str = "auto"):
+        self.config_data = config_data
+        self.engine = engine
+        self.layouts = {}
+        self.workflows = None
+        self.cell_hashes = {}
+
+    '''Return filters (see runConfigScanner.init_filters) with compiled patterns'''
+    @staticmethod
+    def compile_filters(filters: dict) -> dict:
+        return {f_type: [re.compile(f) for f in patterns] for f_type, patterns in filters.items()}
+
+    """
+       Return (assays, cells, index) for filters: assays and assay/version cells we report on and the index
+       of assay config for these cells. They are built on the first request for these filters
+    """
+    def layout(self, filters: dict) -> tuple:
+        key = json.dumps(filters)
+        if key not in self.layouts:
+            assays, cells = configScanner.report_layout(self.config_data, scanSession.compile_filters(filters))
+            self.layouts[key] = (assays, cells, configScanner.index_config(cells, self.config_data))
+        return self.layouts[key]
+
+    '''Return a set of workflows configured in assay config'''
+    def configured_workflows(self) -> set:
+        if self.workflows is None:
+            self.workflows = configScanner.configured_workflows(self.config_data)
+        return self.workflows
+
+    '''Return the hash of an assay/version entry of assay config (see scanState.cell_hash)'''
+    def cell_hash(self, assay: str, version: str) -> str:
+        if (assay, version) not in self.cell_hashes:
+            self.cell_hashes[(assay, version)] = scanState.cell_hash(self.config_data, assay, version)
+        return self.cell_hashes[(assay, version)]
+
+    """
+       Scan olives of an instance, return its configScanner. With only_cells the report is computed only
+       for these cells (incremental scans)
+    """
+    def scan(self, olive_info: list, filters: dict, only_cells: set = None) -> configScanner:
+        return configScanner(self.config_data, olive_info, filters, only_cells, self.engine, self)
+
+    """
+       Return staged config: assay config with staged config deltas of instances applied in the order they
+       come (if instances update the same cell, the last one wins). Entries without updates stay shared with
+       assay config
+    """
+    def staged_config(self, deltas: list) -> dict:
+        staged = dict(self.config_data)
+        copied = set()
+        for delta in deltas:
+            for assay, versions in delta.items():
+                if assay not in copied:
+                    staged[assay] = dict(staged[assay])
+                    staged[assay]['versions'] = dict(staged[assay]['versions'])
+                    copied.add(assay)
+                for version, workflows in versions.items():
+                    staged[assay]['versions'][version] = dict(staged[assay]['versions'][version],
+                                                              workflows=workflows)
+        return staged
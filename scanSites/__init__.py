@@ -0,0 +1,117 @@
+"""
+   Several sites (or forks) in one settings file, each with its own repository of olives, instances, prefixes
+   and blacklist, scanned in one run:
+
+   [checks]                         check patterns, shared by all sites
+   assay = '...'
+
+   [data]                           defaults for sites, optional
+   assay_config_file = "..."
+
+   [sites.toronto]
+   local_olive_dir = "..."
+   assay_config_file = "..."        [data] has the default
+   blacklist = ['...']              the blacklist of [checks] is the default
+   [sites.toronto.instances]
+   instance_a = "research"
+   [sites.toronto.prefixes]
+   research = "RUO"
+
+   Each site is turned into settings of the usual shape ([data], [instances], [prefixes] and [checks]), so it
+   is scanned as if it had a settings file of its own. Sites with the same assay config share a scan session,
+   all sites share the worker pool, the olive cache and parsed olives (olives with the same content are parsed
+   once, see gsiOlive.parse_shared_olives).
+
+   The combined index of a run lists sites with their instances and outputs:
+   {
+     format = INDEX_FORMAT
+     sites  = {site: {settings, olive_dir, assay_config, staged_config,
+                      instances: {instance: {assays, report, page}}}}
+   }
+   Outputs which were not written are None
+"""
+import json
+import os
+
+from outputWriter import publish
+
+SITES_KEY = "sites"
+DATA_KEYS = ("local_olive_dir", "assay_config_file")
+INDEX_FORMAT = 1
+INDEX_SUFFIX = "_index"
+
+
+class scanSites:
+
+    def __init__(self):
+        self.sites = {}
+
+    """
+       Return a list of (site, settings) for settings loaded from a settings file: one for each site in its
+       [sites] table, or (None, settings) if it has no sites
+    """
+    @staticmethod
+    def expand(settings: dict) -> list:
+        sites = settings.get(SITES_KEY)
+        if not isinstance(sites, dict) or len(sites) == 0:
+            return [(None, settings)]
+        checks = settings.get('checks', {})
+        expanded = []
+        for site, site_data in sites.items():
+            data = {key: site_data.get(key, settings.get('data', {}).get(key)) for key in DATA_KEYS}
+            instances = site_data.get('instances', {})
+            if isinstance(instances, list):
+                instances = {instance: instance for instance in instances}
+            site_checks = dict(checks)
+            if 'blacklist' in site_data:
+                site_checks['blacklist'] = site_data['blacklist']
+            expanded.append((site, {'data': {key: value for key, value in data.items() if value is not None},
+                                    'instances': instances,
+                                    'prefixes': site_data.get('prefixes', settings.get('prefixes', {})),
+                                    'checks': site_checks}))
+        return expanded
+
+    """
+       Register a scanned site: scans are results of scan_instances for its instances, options are its output
+       names and outputs (see runConfigScanner.scan_instance), staged_config is the path of its staged config
+       (None if it was not written)
+    """
+    def add(self, site: str, settings_path: str, settings: dict, instances: list, scans: dict, options: dict,
+            staged_config: str = None):
+        site_instances = {}
+        for instance in instances:
+            report = scans[instance][0]
+            written = len(report) > 0
+            site_instances[instance] = {
+                'assays': len(report),
+                'report': options['output_base'] + "_" + instance + ".json"
+                if written and 'json' in options['outputs'] else None,
+                'page': options['output_page'] + "_" + instance + ".html"
+                if written and 'html' in options['outputs'] else None}
+        self.sites[site] = {'settings': settings_path,
+                            'olive_dir': settings['data'].get('local_olive_dir'),
+                            'assay_config': settings['data'].get('assay_config_file'),
+                            'staged_config': staged_config,
+                            'instances': site_instances}
+
+    def get_index(self) -> dict:
+        return {'format': INDEX_FORMAT, 'sites': self.sites}
+
+    '''Return .json reports of all instances as {site/instance: path}, i.e. for a workflowIndex over all sites'''
+    @staticmethod
+    def report_files(index: dict) -> dict:
+        return {site + "/" + instance: outputs['report']
+                for site, site_entry in index['sites'].items()
+                for instance, outputs in site_entry['instances'].items() if outputs['report'] is not None}
+
+    """
+       Save the index as .json and as HTML page with links to pages of sites (links are relative to the page)
+    """
+    def save(self, output_json: str, output_page: str = None, pretty: bool = False):
+        with publish(output_json, "w") as index_file:
+            json.dump(self.get_index(), index_file, sort_keys=True, indent=1)
+            print(f"INFO: Saved index of {len(self.sites)} sites into {output_json}")
+        if output_page is not None:
+            import htmlRenderer
+            with publish(output_page, "w") as op:
+                htmlRenderer.render_index(op, self.get_index(), os.path.dirname(os.path.abspath(output_page)), pretty)
@@ -0,0 +1,146 @@
+"""
+   State of an instance scan, kept between runs for incremental re-evaluation. We keep parsed olives,
+   hashes of assay/version entries of assay_info and the cells of staged config which got updates.
+   The report itself is read back from the previous .json report (see configScanner.load_report),
+   the state only keeps its hash to make sure it is the report we produced.
+
+   When olives or assay/version entries change, only report cells they may affect are recomputed:
+   * cells with a new or changed assay/version entry
+   * cells where a changed, added or removed olive was (or is) enabled or has its workflow configured
+   Everything is rebuilt if the state is missing, olives come in a different order or filters changed
+"""
+import hashlib
+import json
+import os
+from json import JSONDecodeError
+
+from configScanner import configScanner
+from gsiOlive import oliveRecord
+from outputWriter import atomic_open
+
+STATE_FORMAT = 3
+
+
+class scanState:
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {}
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as state_file:
+                state_data = json.load(state_file)
+        except (OSError, JSONDecodeError):
+            print(f"WARNING: Scan state {self.path} could not be loaded, doing a full rebuild")
+            return
+        if isinstance(state_data, dict) and state_data.get('format') == STATE_FORMAT:
+            self.state = state_data
+
+    '''Olive record we compare between runs, all of its checks decide where an olive is enabled'''
+    @staticmethod
+    def olive_record(oli: oliveRecord) -> list:
+        return [list(oli.olives), sorted(oli.tags), sorted(oli.names), [[k, v] for k, v in oli.checks], oli.block]
+
+    '''Olive blocks are known by olive files and their position in the file'''
+    @staticmethod
+    def record_key(record: list) -> str:
+        return json.dumps([record[0], record[4]])
+
+    @staticmethod
+    def cell_hash(config_data: dict, assay: str, version: str) -> str:
+        cell_data = json.dumps(config_data[assay]['versions'][version], sort_keys=True)
+        return hashlib.sha256(cell_data.encode()).hexdigest()
+
+    '''Return hash of a file content, None if we cannot read it'''
+    @staticmethod
+    def file_hash(path: str):
+        try:
+            with open(path, "rb") as hashed_file:
+                return hashlib.sha256(hashed_file.read()).hexdigest()
+        except OSError:
+            return None
+
+    """
+       Return a set of assay/version cells to recompute or None if everything needs to be rebuilt.
+       Report layout, the index and hashes of assay config come from the scan session (see scanSession)
+    """
+    def plan(self, session, olive_info: list, filters: dict, previous_report: dict, report_hash: str):
+        if len(self.state) == 0:
+            return None
+        if self.state['filters'] != json.loads(json.dumps(filters)) or self.state['report'] != report_hash:
+            print("INFO: Filters or the report changed since the last scan, doing a full rebuild")
+            return None
+
+        old_olives = {scanState.record_key(record): record for record in self.state['olives']}
+        new_olives = {}
+        for oli in olive_info:
+            record = json.loads(json.dumps(scanState.olive_record(oli)))
+            new_olives[scanState.record_key(record)] = record
+        common = set(old_olives.keys()).intersection(new_olives.keys())
+        if [o for o in old_olives.keys() if o in common] != [o for o in new_olives.keys() if o in common]:
+            print("INFO: Olives come in a different order since the last scan, doing a full rebuild")
+            return None
+        changed_olives = [old_olives[o] for o in old_olives.keys() if new_olives.get(o) != old_olives[o]]
+        changed_olives.extend(new_olives[o] for o in new_olives.keys() if old_olives.get(o) != new_olives[o])
+
+        _, cells, index = session.layout(filters)
+        all_cells = set(range(len(cells)))
+        affected = set()
+        for c, (assay, version) in enumerate(cells):
+            known_hash = self.state['cells'].get(assay, {}).get(version)
+            if known_hash != session.cell_hash(assay, version) or \
+                    version not in previous_report.get(assay, {}):
+                affected.add(c)
+        for record in changed_olives:
+            if len(record[3]) == 0:
+                affected = all_cells
+                break
+            affected |= configScanner.enabled_cells(record[3], index, all_cells)
+            for n in record[2]:
+                affected |= index['configured'].get(n, set())
+        print(f"INFO: Incremental scan, {len(affected)} of {len(cells)} report cells to recompute")
+        return set(cells[c] for c in affected)
+
+    """
+       Fill cells which were not recomputed with data from the previous report and staged config updates
+    """
+    def restore(self, conf_scanner: configScanner, rebuilt: set, previous_report: dict):
+        report = conf_scanner.get_report()
+        for assay, version in conf_scanner.get_cells():
+            if (assay, version) in rebuilt:
+                continue
+            report[assay][version] = previous_report[assay][version]
+            staged_cell = self.state['staged'].get(assay, {}).get(version)
+            if staged_cell is not None:
+                conf_scanner.set_staged_workflows(assay, version, staged_cell)
+
+    """
+       Remember what we scanned, report_hash is the hash of the saved .json report
+    """
+    def update(self, conf_scanner: configScanner, session, olive_info: list, filters: dict, report_hash: str):
+        config_data = session.config_data
+        self.state = {'format': STATE_FORMAT,
+                      'filters': filters,
+                      'report': report_hash,
+                      'olives': [scanState.olive_record(oli) for oli in olive_info],
+                      'cells': {},
+                      'staged': {}}
+        for assay, version in conf_scanner.get_cells():
+            self.state['cells'].setdefault(assay, {})[version] = session.cell_hash(assay, version)
+        for assay, versions in conf_scanner.get_staged_delta().items():
+            for version, workflows in versions.items():
+                if workflows != config_data[assay]['versions'][version]['workflows']:
+                    self.state['staged'].setdefault(assay, {})[version] = workflows
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with atomic_open(self.path, "w") as state_file:
+                json.dump(self.state, state_file)
+        except OSError:
+            print(f"ERROR: writing scan state {self.path} failed")
@@ -0,0 +1,67 @@
+"""
+   Timeline of workflow enablement for an instance over a range of commits. We get the report for each
+   commit (oldest first) and keep intervals of commits where a workflow version was enabled for an assay/version.
+   The timeline is written as compact JSON:
+   {
+     instance = shesmu instance
+     range    = range of commits, as given
+     commits  = [[commit hash, commit time, subject]]
+     assays   = {assay: {version: {workflow: {workflow version: [[first commit, commit where disabled or null]]}}}}
+   }
+   Commits in intervals are positions in the list of commits
+"""
+import json
+
+from configScanner import configScanner
+from outputWriter import publish
+
+
+class scanTimeline:
+
+    def __init__(self, instance: str, revision_range: str):
+        self.instance = instance
+        self.revision_range = revision_range
+        self.commits = []
+        self.intervals = {}
+        self.open = {}
+
+    '''Return (assay, version, workflow, workflow version) entries of a report'''
+    @staticmethod
+    def report_entries(report: dict) -> set:
+        entries = set()
+        for assay, versions in report.items():
+            for version, workflows in versions.items():
+                if version == configScanner.REF_KEY:
+                    continue
+                for wf, wf_versions in workflows.items():
+                    entries.update((assay, version, wf, v) for v in wf_versions)
+        return entries
+
+    """
+       Register the report of the next commit. None means the report did not change since the previous commit
+    """
+    def add(self, commit_info: tuple, report: dict = None):
+        position = len(self.commits)
+        self.commits.append(list(commit_info))
+        if report is None:
+            return
+        current = scanTimeline.report_entries(report)
+        for entry in current.difference(self.open.keys()):
+            self.open[entry] = [position, None]
+            self.intervals.setdefault(entry, []).append(self.open[entry])
+        for entry in set(self.open.keys()).difference(current):
+            self.open.pop(entry)[1] = position
+
+    def get_timeline(self) -> dict:
+        assays = {}
+        for (assay, version, wf, wf_version), intervals in self.intervals.items():
+            assays.setdefault(assay, {}).setdefault(version, {}).setdefault(wf, {})[wf_version] = intervals
+        return {'instance': self.instance,
+                'range': self.revision_range,
+                'commits': self.commits,
+                'assays': assays}
+
+    def save(self, path: str):
+        with publish(path, "w") as timeline_file:
+            json.dump(self.get_timeline(), timeline_file, sort_keys=True, separators=(",", ":"))
+            print(f"INFO: Saved timeline for {self.instance} into {path}")
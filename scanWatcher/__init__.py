@@ -0,0 +1,164 @@
+"""
+   Watching olive directories and assay config file for changes, this is for keeping reports up to date
+   in a long-running process. On Linux we use inotify (through libc, no extra modules needed), elsewhere
+   or if inotify is not available we poll the watched paths.
+
+   Changes usually come in bursts (i.e. a git checkout touching many olives), so once something changed
+   we wait until things are quiet for a while and return everything which changed meanwhile
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+             IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class scanWatcher:
+
+    """
+       targets is a dict of names and paths to watch, paths may be directories or files.
+       For files we watch the directory they are in, as editors and git replace files instead of writing them
+    """
+    def __init__(self, targets: dict, debounce: float = 2.0, poll_interval: float = 5.0, use_inotify: bool = True):
+        self.targets = targets
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.inotify_fd = None
+        self.watches = {}
+        self.snapshots = {}
+        if use_inotify:
+            self.init_inotify()
+        if self.inotify_fd is None:
+            print("INFO: Watching for changes by polling")
+            self.snapshots = {name: scanWatcher.snapshot(path) for name, path in self.targets.items()}
+
+    def init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            inotify_fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError, TypeError):
+            return
+        if inotify_fd < 0:
+            return
+        self.libc = libc
+        self.inotify_fd = inotify_fd
+        for name in self.targets.keys():
+            if not self.add_watch(name):
+                print(f"WARNING: Cannot watch {self.targets[name]} with inotify, falling back to polling")
+                os.close(self.inotify_fd)
+                self.inotify_fd = None
+                self.watches = {}
+                return
+
+    '''Watch a target (directory of a file target), return False if it cannot be watched'''
+    def add_watch(self, name: str) -> bool:
+        path = self.targets[name]
+        watched = path if os.path.isdir(path) else os.path.dirname(os.path.abspath(path))
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(watched), WATCH_MASK)
+        if wd < 0:
+            return False
+        self.watches.setdefault(wd, set()).add(name)
+        return True
+
+    """
+       Block until something changes, then keep collecting changes until we have a quiet period.
+       Return names of changed targets
+    """
+    def wait(self) -> set:
+        changed = set()
+        while len(changed) == 0:
+            changed |= self.changes(None)
+        while True:
+            more = self.changes(self.debounce)
+            if len(more) == 0:
+                return changed
+            changed |= more
+
+    '''Return names of targets which changed within timeout (None means wait for a change)'''
+    def changes(self, timeout) -> set:
+        if self.inotify_fd is not None:
+            return self.inotify_changes(timeout)
+        return self.polled_changes(timeout)
+
+    def inotify_changes(self, timeout) -> set:
+        changed = set()
+        ready, _, _ = select.select([self.inotify_fd], [], [], timeout)
+        if len(ready) == 0:
+            return changed
+        try:
+            events = os.read(self.inotify_fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        lost = set()
+        while offset < len(events):
+            wd, mask, _, name_length = EVENT_HEADER.unpack_from(events, offset)
+            offset += EVENT_HEADER.size
+            event_name = os.fsdecode(events[offset:offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            for target in self.watches.get(wd, set()):
+                path = self.targets[target]
+                if os.path.isdir(path) or mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) or \
+                        event_name == os.path.basename(path):
+                    changed.add(target)
+            if mask & IN_IGNORED:
+                lost |= self.watches.pop(wd, set())
+        '''Watched directory was removed or replaced, watch it again once it is back'''
+        for target in lost:
+            if not self.add_watch(target):
+                print(f"WARNING: Lost watch on {self.targets[target]}, will check it again on the next change")
+        return changed
+
+    def polled_changes(self, timeout) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_for = self.poll_interval if deadline is None else min(self.poll_interval,
+                                                                       max(0.0, deadline - time.monotonic()))
+            time.sleep(wait_for)
+            changed = set()
+            for name, path in self.targets.items():
+                current = scanWatcher.snapshot(path)
+                if current != self.snapshots.get(name):
+                    self.snapshots[name] = current
+                    changed.add(name)
+            if len(changed) > 0 or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    '''Modification times and sizes of a file or of files in a directory'''
+    @staticmethod
+    def snapshot(path: str) -> dict:
+        state = {}
+        try:
+            if os.path.isdir(path):
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        entry_stat = entry.stat()
+                        state[entry.name] = (entry_stat.st_mtime_ns, entry_stat.st_size)
+            else:
+                path_stat = os.stat(path)
+                state[path] = (path_stat.st_mtime_ns, path_stat.st_size)
+        except OSError:
+            pass
+        return state
+
+    def close(self):
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
@@ -0,0 +1,141 @@
+"""
+   Lightweight lexer for .shesmu olives. One pass over the content with a single regex finds only the tokens
+   we need: comments, string literals, Olive (and Define/Function) keywords, Run actions and check lines.
+   Comments and strings are skipped as a whole, so a Run or a check literal in them is never seen.
+   Runs and check lines are attributed to the olive block they are in, block 0 is everything outside olives
+   (before the first Olive or in Define/Function blocks):
+
+   [(runs, check_lines)]  runs are action names after Run, check_lines are lines with check literals
+                          (cut at a comment which follows on the same line)
+
+   Check lines of Define and Function blocks may also be kept by the name of the block, with olive blocks which
+   refer to the name (outside comments and strings, direct references only):
+
+   {name: (check_lines, {olive blocks})}
+
+   Tokens are told apart by their text, not by regex groups: without groups every alternative of the
+   regex starts with a literal byte and the regex engine skips quickly over text between tokens.
+   A check literal takes the rest of its line (with strings in it) into the same token, up to a comment
+   or a keyword, so a check line is usually a single token
+"""
+import functools
+import re
+
+from checkMatcher import literal_trie
+
+'''Loops are unrolled (a run of plain characters, then a special one), so the regex engine does not branch on each
+   character of strings and lines'''
+STRING_TOKEN = rb'"[^"\\\n]*(?:\\.[^"\\\n]*)*"'
+TOKENS = (rb'#[^\n]*', STRING_TOKEN, rb'Olive\b', rb'Define\b', rb'Function\b', rb'Run\s+\S+')
+LINE_REST = rb'[^"#\nRODF]*(?:(?:' + STRING_TOKEN + rb'|(?!Run\s|Olive\b|Define\b|Function\b)[RODF])[^"#\nRODF]*)*'
+LINE_ENDS = (b"\n", b"#", b"")
+COMMENT = ord("#")
+STRING = ord('"')
+OLIVE = b"Olive"
+DEFINE = (b"Define", b"Function")
+RUN = b"Run"
+KEYWORD_STARTS = {ord("O"), ord("D"), ord("F"), ord("R")}
+WORD = frozenset(b"_0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
+DEFINE_NAME = re.compile(rb'\s*(\w+)')
+
+
+"""
+   Return the lexer regex for check literals (bytes). With every_line each line start is a token too,
+   for check patterns without literals
+"""
+@functools.lru_cache(maxsize=16)
+def lexer(literals: tuple, every_line: bool = False) -> re.Pattern:
+    tokens = list(TOKENS)
+    if literals:
+        tokens.append(literal_trie(list(literals), LINE_REST))
+    if every_line:
+        tokens.insert(0, rb'^' + LINE_REST)
+    return re.compile(b"|".join(tokens), re.MULTILINE)
+
+
+"""
+   Split olive content into blocks: return a list of (runs, check_lines), the first one is for everything
+   outside olive blocks. Runs are decoded, check lines are bytes. With defines (a dict) check lines of Define
+   and Function blocks also go there by name, with olive blocks which refer to them (see olive_references)
+"""
+def olive_blocks(content: bytes, literals: tuple, every_line: bool = False, defines: dict = None) -> list:
+    blocks = [([], [])]
+    current = blocks[0]
+    '''Name of the Define or Function we are in, check lines of Define and Function blocks and spans of olive blocks'''
+    define = None
+    define_lines = {}
+    spans = []
+    '''Start and end of the last check line, the end moves back if a comment starts on this line'''
+    check_line = None
+    size = len(content)
+    for found in lexer(literals, every_line).finditer(content):
+        start = found.start()
+        first = content[start] if start < size else None
+        if first == STRING:
+            continue
+        if first == COMMENT:
+            if check_line is not None and start < check_line[1]:
+                check_line[1] = start
+            continue
+        if first in KEYWORD_STARTS:
+            token = found.group()
+            run = token.startswith(RUN) and token[3:4].isspace()
+            if token == OLIVE or token in DEFINE or run:
+                '''A keyword is a whole word, not the end of another word'''
+                if start > 0 and content[start - 1] in WORD:
+                    continue
+                if run:
+                    current[0].append(token[3:].lstrip().decode(errors="replace"))
+                    continue
+                if spans and spans[-1][1] is None:
+                    spans[-1][1] = start
+                if token == OLIVE:
+                    blocks.append(([], []))
+                    current = blocks[-1]
+                    define = None
+                    spans.append([start, None])
+                else:
+                    current = blocks[0]
+                    name = DEFINE_NAME.match(content, found.end())
+                    define = name.group(1) if name is not None else None
+                continue
+        if check_line is None or start >= check_line[1]:
+            line_end = found.end()
+            if line_end == start and first in KEYWORD_STARTS:
+                '''A line start right before a keyword (with every_line), the line goes to the next olive block'''
+                continue
+            if content[line_end:line_end + 1] not in LINE_ENDS:
+                '''The token stopped at a keyword or an unclosed string, the line goes on'''
+                line_end = content.find(b"\n", line_end)
+                line_end = size if line_end < 0 else line_end
+            check_line = [content.rfind(b"\n", 0, start) + 1, line_end]
+            current[1].append(check_line)
+            if define is not None:
+                define_lines.setdefault(define, []).append(check_line)
+    if defines is not None and len(define_lines) > 0:
+        if spans and spans[-1][1] is None:
+            spans[-1][1] = size
+        references = olive_references(content, spans, list(define_lines))
+        for name, check_lines in define_lines.items():
+            defines[name.decode(errors="replace")] = (line_texts(content, check_lines), references.get(name, set()))
+    return [(runs, line_texts(content, check_lines)) for runs, check_lines in blocks]
+
+
+'''Return text of check lines (start and end offsets), lines which are empty once cut at a comment are dropped'''
+def line_texts(content: bytes, check_lines: list) -> list:
+    return [line for start, end in check_lines if (line := content[start:end].rstrip())]
+
+
+"""
+   Return olive blocks (1 is the first one) which refer to names (bytes) as {name: {blocks}}, spans are start
+   and end of olive blocks. Comments and strings are skipped, so a name mentioned there is not a reference
+"""
+def olive_references(content: bytes, spans: list, names: list) -> dict:
+    reference = re.compile(rb'#[^\n]*|' + STRING_TOKEN + rb'|(?<!\w)(?:' +
+                           b"|".join(re.escape(name) for name in sorted(names, key=len, reverse=True)) + rb')(?!\w)')
+    references = {}
+    for block, (start, end) in enumerate(spans, 1):
+        for found in reference.finditer(content, start, end):
+            if content[found.start()] not in (COMMENT, STRING):
+                references.setdefault(found.group(), set()).add(block)
+    return references
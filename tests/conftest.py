@@ -0,0 +1,7 @@
+"""
+   Tests import packages of the scanner from the top directory of the repository
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+"""
+   Tests for checkMatcher: patterns which cannot be combined into one regex (global inline flags, numbered
+   group references) are searched on their own and still give checks of olives. The olive lexer looks for
+   literals as they are, so only the rest of a line may differ in case for a (?i) pattern
+"""
+import os
+import tempfile
+import unittest
+
+import gsiOlive
+from checkMatcher import checkMatcher
+
+ASSAY = r'config::assay_info::get\(\S+\)\.versions\[\S+\]\.workflows\["(?P<workflow>[^"]+)"\]:\s*Any\s+v\s*==\s*' \
+        r'"(?P<version>[^"]+)"'
+'''The quote around the workflow is repeated with a numbered group reference'''
+PROJECT = r'config::project_info::get\(\S+\)\.workflows\[(["\'])(?P<workflow>[^"\']+)\1\]:\s*Any\s+v\s*==\s*' \
+          r'"(?P<version>[^"]+)"'
+ASSAY_LINE = 'Where config::assay_info::get(a).versions[v].workflows["bwaMem"]: Any v == "1.0.2"'
+PROJECT_LINE = "Where config::project_info::get(p).workflows['star']: Any v == \"2.7.3\""
+OLIVE = ("Olive\n"
+         "  Input gsi_cerberus_file;\n"
+         "  Where CONFIG::assay_info::Get(a).Versions[v].Workflows[\"bwaMem\"]: ANY v == \"1.0.2\"\n"
+         "  Where config::project_info::get(p).workflows['star']: Any v == \"2.7.3\"\n"
+         "  Run bwamem_v1_0_2\n"
+         "  With {};\n")
+
+
+class checkMatcherTest(unittest.TestCase):
+
+    def test_global_flags(self):
+        matcher = checkMatcher.from_settings({'assay': "(?i)" + ASSAY, 'patterns': [
+            {'name': "project", 'pattern': PROJECT.replace(r"\1", "'")}]})
+        self.assertIsNotNone(matcher)
+        self.assertIn(0, matcher.separate)
+        self.assertEqual(matcher.search(ASSAY_LINE.replace("config::", "CONFIG::").replace("Any", "ANY")),
+                         ("bwaMem", "1.0.2", "assay"))
+        self.assertEqual(matcher.search(ASSAY_LINE), ("bwaMem", "1.0.2", "assay"))
+        self.assertEqual(matcher.search(PROJECT_LINE), ("star", "2.7.3", "project"))
+
+    def test_numbered_reference(self):
+        matcher = checkMatcher.from_settings({'patterns': [{'name': "assay", 'pattern': ASSAY},
+                                                           {'name': "project", 'pattern': PROJECT}]})
+        self.assertIsNotNone(matcher)
+        self.assertEqual(set(matcher.separate), {1})
+        self.assertEqual(matcher.search(PROJECT_LINE), ("star", "2.7.3", "project"))
+        self.assertEqual(matcher.search(ASSAY_LINE), ("bwaMem", "1.0.2", "assay"))
+        self.assertIsNone(matcher.search(PROJECT_LINE.replace("'star'", "'star\"")))
+
+    def test_leftmost_check(self):
+        matcher = checkMatcher.from_settings({'patterns': [{'name': "assay", 'pattern': ASSAY},
+                                                           {'name': "project", 'pattern': PROJECT}]})
+        self.assertEqual(matcher.search(PROJECT_LINE + " && " + ASSAY_LINE), ("star", "2.7.3", "project"))
+        self.assertEqual(matcher.search(ASSAY_LINE + " && " + PROJECT_LINE), ("bwaMem", "1.0.2", "assay"))
+
+    def test_olive_checks(self):
+        matcher = checkMatcher.from_settings({'assay': "(?i)" + ASSAY,
+                                              'patterns': [{'name': "project", 'pattern': PROJECT}]})
+        with tempfile.TemporaryDirectory() as olive_dir:
+            olive = os.path.join(olive_dir, "test.shesmu")
+            with open(olive, "w") as olive_file:
+                olive_file.write(OLIVE)
+            records = gsiOlive.parse_olive(olive, matcher)
+        self.assertEqual(sorted((check.workflow, check.version, check.pattern) for record in records
+                                for check in record.checks),
+                         [("bwaMem", "1.0.2", "assay"), ("star", "2.7.3", "project")])
+
+    def test_invalid_pattern(self):
+        self.assertIsNone(checkMatcher.from_settings({'patterns': [{'name': "broken", 'pattern': "(?P<workflow>"}]}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+   Tests for jsonReader: read_values gives what json.load gives (values of the file if it has them), also for
+   workflow versions which are not lists of strings and for chunks smaller than any value
+"""
+import io
+import json
+import os
+import unittest
+
+import jsonReader
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+CHUNK_SIZES = (1, 2, 3, 7, 64, jsonReader.CHUNK_SIZE)
+NESTED = {"values": {
+    "ASSAY1": {"reference": "hg38",
+               "versions": {"1.0": {"workflows": {"wf1": ["1.0.0", "1.1.0"],
+                                                  "wf2": [["1.0.0"], "2.0.0"],
+                                                  "wf3": [{"version": "3.0.0"}, "3.1.0"],
+                                                  "wf4": ["1.0.0", "1.1.0"],
+                                                  "wf5": [],
+                                                  "wf6": "1.0.0"}},
+                            "2.0": {"workflows": {"wf2": [["1.0.0"], "2.0.0"], "wf3": [[], {}]}}}},
+    "ASSAY2": {"versions": {"1.0": {"workflows": {"wf1": [1, 2.5, None, True]}, "extra": ["a"]}},
+               "other": [["x"], {"y": "é\\\""}]}}}
+
+
+def read_all(text: str, chunk_size: int):
+    return jsonReader.read_values(io.StringIO(text), chunk_size)
+
+
+class jsonReaderTest(unittest.TestCase):
+
+    def assert_same(self, text: str):
+        expected = json.loads(text)
+        expected = expected["values"] if isinstance(expected, dict) and "values" in expected else expected
+        for chunk_size in CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(read_all(text, chunk_size), expected)
+
+    def test_nested_versions(self):
+        self.assert_same(json.dumps(NESTED))
+        self.assert_same(json.dumps(NESTED, indent=2))
+
+    def test_without_values(self):
+        self.assert_same(json.dumps(NESTED["values"], indent=1))
+
+    def test_config(self):
+        with open(os.path.join(DATA_DIR, "config_input.json"), "r", encoding="utf-8") as data_file:
+            self.assert_same(data_file.read())
+
+    def test_shared_lists(self):
+        values = read_all(json.dumps(NESTED), 3)
+        workflows = values["ASSAY1"]["versions"]["1.0"]["workflows"]
+        self.assertIs(workflows["wf1"], workflows["wf4"])
+        self.assertIsNot(values["ASSAY1"]["versions"]["2.0"]["workflows"]["wf2"], workflows["wf2"])
+
+    def test_extra_data(self):
+        with self.assertRaises(json.JSONDecodeError):
+            read_all(json.dumps(NESTED) + " {}", 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
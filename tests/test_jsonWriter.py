@@ -0,0 +1,49 @@
+"""
+   Golden-file tests for jsonWriter: golden files were written with json.dumps(indent=2) and the regex clean-up
+   passes we used before the streaming writer (report: configScanner.save_report, staged config: save_config),
+   write_json has to give the same bytes
+"""
+import io
+import json
+import os
+import unittest
+
+import jsonWriter
+from configScanner import configScanner
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+CONF_HEADER = {"missingUsesDefaults": False, "types": {"versions": {"is": "dictionary", "key": "s",
+               "value": {"fields": {"workflows": "msas"}, "is": "object"}}, "reference": "s"}}
+
+
+def load_data(name: str):
+    with open(os.path.join(DATA_DIR, name), "r", encoding="utf-8") as data_file:
+        return json.load(data_file)
+
+
+def read_golden(name: str) -> str:
+    with open(os.path.join(DATA_DIR, name), "r", encoding="utf-8", newline="") as golden_file:
+        return golden_file.read()
+
+
+class jsonWriterTest(unittest.TestCase):
+
+    def test_report_matches_golden(self):
+        out = io.StringIO()
+        jsonWriter.write_json(load_data("report_input.json"), out, jsonWriter.REPORT)
+        self.assertEqual(out.getvalue(), read_golden("report_golden.json"))
+
+    def test_config_matches_golden(self):
+        vetted_od = {"values": load_data("config_input.json")}
+        vetted_od.update(CONF_HEADER)
+        out = io.StringIO()
+        jsonWriter.write_json(vetted_od, out, jsonWriter.CONFIG, configScanner.REF_KEY)
+        self.assertEqual(out.getvalue(), read_golden("config_golden.jsonconfig"))
+
+    def test_config_header_is_the_one_we_save(self):
+        import runConfigScanner
+        self.assertEqual(runConfigScanner.CONF_HEADER, CONF_HEADER)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+   Tests for shesmuLexer: Runs and check lines in comments and strings are not seen, check lines are cut at
+   trailing comments, and checks in a Define (outside olive blocks) apply only to olive blocks which call it
+"""
+import os
+import tempfile
+import unittest
+
+import gsiOlive
+import shesmuLexer
+from checkMatcher import checkMatcher
+
+LITERALS = (b"assay_info",)
+CHECK = b'config::assay_info::get(a).versions[v].workflows["bwaMem"]: Any v == "1.0.2"'
+ASSAY = r'config::assay_info::get\(\S+\)\.versions\[\S+\]\.workflows\["(?P<workflow>[^"]+)"\]:\s*Any\s+v\s*==\s*' \
+        r'"(?P<version>[^"]+)"'
+
+
+'''Parse an olive with the assay pattern, return records and messages'''
+def parse(content: bytes) -> tuple:
+    messages = []
+    with tempfile.TemporaryDirectory() as olive_dir:
+        olive = os.path.join(olive_dir, "test.shesmu")
+        with open(olive, "wb") as olive_file:
+            olive_file.write(content)
+        records = gsiOlive.parse_olive(olive, checkMatcher.from_settings({'assay': ASSAY}), messages=messages)
+    return records, messages
+
+
+class shesmuLexerTest(unittest.TestCase):
+
+    def test_commented_runs(self):
+        content = (b"Olive\n"
+                   b"  # Run star_v2_7_3\n"
+                   b"  Input gsi_cerberus_file; # Run hidden_v1_0\n"
+                   b"  Run bwaMem_v1_0_2\n"
+                   b"  With {};\n")
+        self.assertEqual(shesmuLexer.olive_blocks(content, LITERALS), [([], []), (["bwaMem_v1_0_2"], [])])
+
+    def test_strings(self):
+        content = (b"Olive\n"
+                   b'  Label "Run star_v2_7_3 # not a comment"\n'
+                   b'  Where x == "config::assay_info::get(a)"\n'
+                   b'  Where ' + CHECK + b' && y == "\\"Run\\" # Olive"\n'
+                   b"  Run bwaMem_v1_0_2\n"
+                   b"  With {};\n")
+        self.assertEqual(shesmuLexer.olive_blocks(content, LITERALS),
+                         [([], []), (["bwaMem_v1_0_2"], [b'  Where ' + CHECK + b' && y == "\\"Run\\" # Olive"'])])
+
+    def test_trailing_comments(self):
+        content = (b"Olive\n"
+                   b"  Where " + CHECK + b" # config::assay_info::get(b)\n"
+                   b"  # Where " + CHECK + b"\n"
+                   b"  Run bwaMem_v1_0_2 # Run star_v2_7_3\n"
+                   b"  With {};\n")
+        self.assertEqual(shesmuLexer.olive_blocks(content, LITERALS),
+                         [([], []), (["bwaMem_v1_0_2"], [b"  Where " + CHECK])])
+
+    def test_blocks(self):
+        content = (b"Define checked()\n"
+                   b"  Where " + CHECK + b";\n"
+                   b"Olive\n"
+                   b"  Run star_v2_7_3\n"
+                   b"  With {};\n"
+                   b"OliveOlive Olive\n"
+                   b"  Run bwaMem_v1_0_2\n"
+                   b"  With {};\n")
+        self.assertEqual(shesmuLexer.olive_blocks(content, LITERALS),
+                         [([], [b"  Where " + CHECK + b";"]), (["star_v2_7_3"], []), (["bwaMem_v1_0_2"], [])])
+
+    def test_define_references(self):
+        content = (b"Define checked()\n"
+                   b"  Where " + CHECK + b";\n"
+                   b"Function unused(string x) x;\n"
+                   b"Olive\n"
+                   b"  checked() # unused()\n"
+                   b"  Run bwaMem_v1_0_2\n"
+                   b"  With {};\n"
+                   b"Olive\n"
+                   b'  Label "checked()" # checked()\n'
+                   b"  Where not_checked(x)\n"
+                   b"  Run star_v2_7_3\n"
+                   b"  With {};\n")
+        defines = {}
+        blocks = shesmuLexer.olive_blocks(content, LITERALS, False, defines)
+        self.assertEqual(blocks[0][1], [b"  Where " + CHECK + b";"])
+        self.assertEqual(defines, {"checked": ([b"  Where " + CHECK + b";"], {1})})
+
+    def test_define_checks(self):
+        content = (b"Define checked()\n"
+                   b"  Where " + CHECK + b";\n"
+                   b"Olive\n"
+                   b"  Input gsi_cerberus_file;\n"
+                   b"  checked()\n"
+                   b"  Run bwaMem_v1_0_2\n"
+                   b"  With {};\n"
+                   b"Olive\n"
+                   b'  Where config::assay_info::get(a).versions[v].workflows["star"]: Any v == "2.7.3"\n'
+                   b"  Run star_v2_7_3\n"
+                   b"  With {};\n"
+                   b"Olive\n"
+                   b"  Input gsi_cerberus_file;\n"
+                   b"  Run wfE_v1_0\n"
+                   b"  With {};\n")
+        records, messages = parse(content)
+        self.assertEqual([(record.block, sorted(record.names), record.checks_dict()) for record in records],
+                         [(1, ["bwaMem"], {"bwaMem": "1.0.2"}), (2, ["star"], {"star": "2.7.3"}),
+                          (3, ["wfE"], {})])
+        self.assertEqual([message for message in messages if message.startswith("WARNING")], [])
+
+    def test_loose_checks(self):
+        content = (b"Where " + CHECK + b"\n"
+                   b"Olive\n"
+                   b"  Run wfE_v1_0\n"
+                   b"  With {};\n")
+        records, messages = parse(content)
+        self.assertEqual([(record.block, sorted(record.names), record.checks_dict()) for record in records],
+                         [(1, ["wfE"], {})])
+        self.assertEqual(len([message for message in messages if message.startswith("WARNING")]), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+"""
+   In-memory index over reports of instances, for questions like "which assays/versions run bcl2fastq 3.1.x
+   in research". It is built from reports (as configScanner.get_report returns them or as they are saved
+   in .json reports) of each instance:
+
+   workflows  = {workflow: [(assay, assay version, instance, workflow versions)]}
+   assays     = {assay: {instance: {assay version: {workflow: workflow versions}}}}
+   references = {reference: set of assays}
+
+   Lookups by workflow, version, reference, instance and assay return rows (dicts) with workflow, versions,
+   assay, assay_version, instance and reference. A version may be a range:
+
+   3.1.7          exactly this version
+   3.1.x, 3.1.*   any version starting with 3.1
+   >=3.1,<3.2     all comparisons have to hold (>, >=, <, <=, ==, !=), versions are compared part by part,
+                  numbers as numbers
+"""
+import json
+import re
+
+from configScanner import configScanner
+
+COMPARISON = re.compile(r"^\s*(>=|<=|==|!=|>|<)\s*(\S+)\s*$")
+WILDCARDS = ("x", "X", "*")
+OPERATORS = {">=": lambda a, b: a >= b,
+             "<=": lambda a, b: a <= b,
+             "==": lambda a, b: a == b,
+             "!=": lambda a, b: a != b,
+             ">": lambda a, b: a > b,
+             "<": lambda a, b: a < b}
+
+
+class workflowIndex:
+
+    """
+       reports is a dict of instance reports (instance: report), instances keep their order in results
+    """
+    def __init__(self, reports: dict):
+        self.workflows = {}
+        self.assays = {}
+        self.references = {}
+        self.assay_references = {}
+        self.instances = list(reports.keys())
+        for instance, report in reports.items():
+            for assay, versions in report.items():
+                reference = versions.get(configScanner.REF_KEY)
+                if reference is not None:
+                    self.assay_references[assay] = reference
+                    self.references.setdefault(reference, set()).add(assay)
+                assay_entry = self.assays.setdefault(assay, {}).setdefault(instance, {})
+                for version, workflows in versions.items():
+                    if version == configScanner.REF_KEY:
+                        continue
+                    assay_entry[version] = workflows
+                    for wf, wf_versions in workflows.items():
+                        self.workflows.setdefault(wf, []).append((assay, version, instance, tuple(wf_versions)))
+
+    """
+       Build an index from saved .json reports (instance: path). Reports we cannot read are reported
+       and left out
+    """
+    @classmethod
+    def from_files(cls, report_files: dict):
+        reports = {}
+        for instance, path in report_files.items():
+            try:
+                with open(path, "r") as report_file:
+                    reports[instance] = json.load(report_file)
+            except (OSError, ValueError):
+                print(f"ERROR: Could not load the report for {instance} from {path}")
+        return cls(reports)
+
+    """
+       Find rows for a workflow (all workflows if None), optionally limited to versions matching a version
+       (or a range, see version_filter), a reference, an instance and an assay. Versions of a row are those
+       which matched. Raises ValueError if the version range cannot be parsed
+    """
+    def find(self, workflow: str = None, version: str = None, reference: str = None, instance: str = None,
+             assay: str = None) -> list:
+        matches = version_filter(version)
+        if workflow is not None:
+            entries = [(workflow, entry) for entry in self.workflows.get(workflow, [])]
+        else:
+            entries = [(wf, entry) for wf in sorted(self.workflows) for entry in self.workflows[wf]]
+        assays = self.references.get(reference, set()) if reference is not None else None
+        rows = []
+        for wf, (entry_assay, assay_version, entry_instance, wf_versions) in entries:
+            if instance is not None and entry_instance != instance:
+                continue
+            if assay is not None and entry_assay != assay:
+                continue
+            if assays is not None and entry_assay not in assays:
+                continue
+            versions = [v for v in wf_versions if matches(v)]
+            if len(versions) == 0:
+                continue
+            rows.append({'workflow': wf,
+                         'versions': versions,
+                         'assay': entry_assay,
+                         'assay_version': assay_version,
+                         'instance': entry_instance,
+                         'reference': self.assay_references.get(entry_assay)})
+        return rows
+
+    """
+       Return workflows of an assay: {assay, reference, instances: {instance: {assay version: {workflow:
+       versions}}}}, optionally for one instance and/or assay version. None if we do not know the assay
+    """
+    def assay_workflows(self, assay: str, instance: str = None, version: str = None):
+        if assay not in self.assays:
+            return None
+        instances = {}
+        for assay_instance, versions in self.assays[assay].items():
+            if instance is not None and assay_instance != instance:
+                continue
+            instances[assay_instance] = {v: workflows for v, workflows in versions.items()
+                                         if version is None or v == version}
+        return {'assay': assay, 'reference': self.assay_references.get(assay), 'instances': instances}
+
+    '''Return names of all workflows we have in reports'''
+    def get_workflows(self) -> list:
+        return sorted(self.workflows)
+
+    '''Return names of all assays, for a reference if we have it'''
+    def get_assays(self, reference: str = None) -> list:
+        if reference is not None:
+            return sorted(self.references.get(reference, set()))
+        return sorted(self.assays)
+
+    def get_instances(self) -> list:
+        return self.instances
+
+    def get_references(self) -> list:
+        return sorted(self.references)
+
+
+'''Key for comparing versions: parts are compared as numbers if they are numbers (numbers go before words)'''
+def version_key(version: str) -> tuple:
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in version.split("."))
+
+
+"""
+   Return a function telling if a workflow version matches a version or a range of versions (see above).
+   Without a version every version matches. Raises ValueError for a range we cannot parse
+"""
+def version_filter(spec: str = None):
+    if spec is None or spec.strip() == "":
+        return lambda version: True
+    spec = spec.strip()
+    if "," not in spec and not COMPARISON.match(spec):
+        parts = spec.split(".")
+        if parts[-1] in WILDCARDS:
+            prefix = parts[:-1]
+            if any(part in WILDCARDS or part == "" for part in prefix):
+                raise ValueError(f"Version {spec} may have a wildcard only as its last part")
+            return lambda version: version.split(".")[:len(prefix)] == prefix and \
+                len(version.split(".")) > len(prefix)
+        return lambda version: version == spec
+    comparisons = []
+    for clause in spec.split(","):
+        found = COMPARISON.match(clause)
+        if found is None:
+            raise ValueError(f"Cannot parse version range {spec}: {clause.strip()} is not a comparison")
+        comparisons.append((OPERATORS[found.group(1)], version_key(found.group(2))))
+    return lambda version: all(compare(version_key(version), bound) for compare, bound in comparisons)